@@ -1,3 +1,4 @@
+import io
 import os
 import re
 import time
@@ -6,7 +7,7 @@ from typing import List, Dict, Optional, Tuple, Iterable
 """
 跨平台CLI批量筛选（百万行/≤500条件）
 依赖：pandas、openpyxl（可选：rapidfuzz用于加速模糊匹配）
-用法：直接运行该脚本；参数在代码顶部配置
+用法：直接运行该脚本（参数在代码顶部配置）；或通过命令行参数覆盖配置、以 --manifest 批量执行任务清单（见 --help）
 
 设计说明（概览）：
 - 输入：一个或多个 Excel/CSV 文件，支持 Sheet 多表合并
@@ -30,6 +31,8 @@ EXCEL_FILES: List[str] = [
 # - "Sheet1,Sheet2"：指定多个工作表并纵向合并
 # - "*"：合并该文件所有工作表
 SHEET: str = ""
+SHEET_WORKERS: int = 0          # 多工作表并行解析的进程数：0→min(工作表数, CPU核数)；1→逐表顺序读取
+SHEET_COLUMN: Optional[str] = None # 非空时为每行追加来源工作表列（如 "_sheet"），合并结果可追溯到工作表
 # CONDITIONS_CSV：条件文件路径（CSV/Excel）；为空将回退到“仅Major列”的旧逻辑（不建议）
 CONDITIONS_CSV: Optional[str] = "F:/AAAAclass/python/lzf数据分析/combined_conditions_full.csv"
 
@@ -45,11 +48,87 @@ MERGE_OUT: Optional[str] = "merged_filtered.xlsx" # 合并输出文件；None→
 APPEND: bool = False            # 追加模式：True→读旧结果并合并，False→覆盖
 DEDUP: bool = True              # 是否启用去重
 DEDUP_KEY: Optional[str] = "PersonID" # 去重键列名；None→回退“规范化Major+编码”（旧逻辑兼容）
+EXCEL_WRITER: str = "auto"      # Excel 写出方式：auto（已安装 xlsxwriter 用其常量内存模式，否则 openpyxl 只写模式）| xlsxwriter | openpyxl
+EXCEL_MAX_ROWS: int = 1048576   # 每个工作表的行数上限（含表头，即 Excel 上限）；写满后自动续写到 _part2、_part3…
+EXCEL_SPLIT: str = "sheet"      # 超出上限时的续写方式：sheet（同一文件新增工作表 Sheet1_part2…）| file（新文件 <名称>_part2.xlsx…）
+OUTPUT_FORMAT: Optional[str] = None # 输出格式：None→按输出文件扩展名；xlsx | csv | csv.gz | csv.zst | csv.xz | parquet（替换输出文件扩展名）
+ZSTD_LEVEL: int = 3             # zstd 压缩级别（.csv.zst 输出与 Parquet 列压缩）
+ZSTD_THREADS: int = 0           # zstd 压缩线程数：0→CPU核数（需 zstandard；未安装时用 pyarrow 单线程压缩）
+
+# 执行引擎
+ENGINE: str = "pandas"              # pandas（分块向量化评估）| duckdb（条件编译为单条SQL，进程内执行）| polars（LazyFrame 流式执行）| cluster（分片分发给工作进程，见下方“分布式执行”）
+ENGINE_OUTPUT_FORMAT: str = "parquet" # duckdb/polars 引擎输出格式：parquet | csv（输出文件名为其他扩展名时按此替换）
+DUCKDB_MEMORY_LIMIT: Optional[str] = None # duckdb 内存上限（如 "4GB"），超出部分溢写到临时目录；None→默认（物理内存80%）
+DUCKDB_THREADS: int = 0             # duckdb 线程数；0→CPU核数
 
 # 性能与日志
 CHUNK_SIZE: int = 50000            # 分块行数（建议5万~10万；越大内存占用越多）
+CSV_BACKEND: str = "auto"          # CSV读取后端：auto（有pyarrow用pyarrow）| pyarrow | pandas
+CSV_ENCODING: str = "auto"         # CSV编码：auto（检测UTF-8/GBK）或显式指定（如 gb18030）
+PREFETCH_DEPTH: int = 2            # 后台预读的分块数（有界队列深度）；0→关闭，读取与评估串行
+PREFETCH_MODE: str = "auto"        # 预读方式：auto（Excel用进程、CSV/Parquet用线程，单核不预读）| process | thread
+BACKGROUND_WRITE: bool = True      # 逐文件结果交给后台写出线程，主线程继续处理下一个文件
 PROGRESS_STEP: int = 5000         # 每处理N行输出一次进度
 WRITE_AUDIT_COLUMNS: bool = False   # 是否写出每条件审计列（便于调试；关闭更轻量）
+DEFAULT_SCORER: str = "token_set_ratio" # fuzzy 默认评分器；条件 options 中 scorer=<名称> 可逐条指定（ratio/partial_ratio/jw/indel/ngram/difflib）
+FUZZY_MATCHER: str = "auto"         # 同列 fuzzy 条件很多时：auto（仅 cutoff=true 的条件 TF-IDF 召回候选后精确复评，_score_all 不变）| tfidf（AND/OR 下全部召回，非候选记 0 分）| exact（逐条全量评分）
+TFIDF_MIN_TARGETS: int = 1000       # 启用 TF-IDF 候选召回的同列 fuzzy 条件数下限
+TFIDF_TOP_K: int = 10               # 每个取值召回的候选目标数（只对候选做精确评分，其余相似度记 0）
+REGEX_ENGINE: str = "auto"          # 同列 regex match 条件的多模式集合引擎：auto（re2 → hyperscan → re）| re2 | hyperscan | re
+REGEX_SET_CHUNK: int = 64           # re 引擎下每个交替式预筛包含的模式数（命中预筛后再逐条确认）
+AFFIX_INDEX_MIN_RULES: int = 2      # 同列 text startswith（或 endswith）条件数达到该值时编入按长度分层的前缀/后缀索引，每种模式长度对块内去重取值只查找一次
+SIM_MEMO: bool = True               # 持久化相似度缓存（写在条件文件旁：<条件文件>.simmemo.sqlite）
+SIM_MEMO_MAX_ENTRIES: int = 2000000 # 缓存条目上限；超出后按最近使用时间（LRU）淘汰
+OPTIMIZE_CONDITIONS: bool = False   # 执行前静态优化条件集：合并重复、移除被覆盖的条件、折叠常量选项，并输出优化前后的成本估算（命中不变但 _score_all 可能变小，需显式开启；写出审计列时不优化）
+
+# 抽样预览（--preview）：在全部文件/工作表/分块上均匀抽样，估计命中数、各条件选择率与全量耗时，不写出结果
+PREVIEW_ROWS: int = 5000            # 抽样行数
+PREVIEW_SEED: Optional[int] = None  # 抽样随机种子；None→每次不同
+PREVIEW_CONFIDENCE: float = 0.95    # 置信区间的置信水平
+
+# 运行指标：结构化事件、Prometheus 指标与 Chrome trace（均为文件路径，None→不写出）
+METRICS_EVENTS: Optional[str] = None # JSON Lines 事件日志（追加写入）：进度、逐文件耗时/吞吐/各阶段耗时、任务汇总
+METRICS_PROM: Optional[str] = None   # Prometheus 文本格式指标文件（每次运行覆盖，可供 node_exporter textfile collector 采集）
+TRACE_FILE: Optional[str] = None     # Chrome trace-event 文件（chrome://tracing / Perfetto）：每个分块的读取、评估与写出区间
+
+# 内存剖析（--profile-memory）：逐阶段/逐分块峰值 RSS、tracemalloc 快照与内存归因报告；剖析时关闭预读、并行解析与后台写出，使各阶段不重叠
+PROFILE_MEMORY: bool = False         # 是否剖析内存（会拖慢运行，建议只在排查内存问题时开启）
+MEMORY_REPORT: Optional[str] = None  # 报告路径（JSON）；None→合并输出旁的 <合并输出名>.memprofile.json
+TRACEMALLOC_TOP: int = 10            # 每个快照保留的分配位置数（前 N 个）
+TRACEMALLOC_INTERVAL: float = 30.0   # 快照间隔（秒，在阶段结束时检查）；0→只在结束时做一次
+MEMORY_SAMPLE_INTERVAL: float = 0.05 # RSS 采样间隔（秒），用于捕捉阶段内的峰值
+CHUNK_MEMORY_MB: Optional[float] = None # 自适应分块：每个分块的内存预算（MB），按内存剖析报告中的每行内存换算分块行数；None→固定 CHUNK_SIZE
+CHUNK_MIN_ROWS: int = 1000           # 自适应分块行数下限
+CHUNK_MAX_ROWS: int = 500000         # 自适应分块行数上限
+
+# 检查点（长任务中断后继续）
+CHECKPOINT: bool = True             # 每处理完一个分块记录进度，命中行溢写到检查点目录；中断后最多重做一个分块
+CHECKPOINT_DIR: Optional[str] = None # 检查点目录；None→合并输出所在目录下的 .filter_checkpoint/
+RESUME: bool = False                # 从上次中断处继续（命令行 --resume）；输入、条件或组合设置变化时从头开始
+
+# 服务模式（python filter_cli.py --serve）：常驻进程，复用条件计划与读取缓存
+SERVICE_HOST: str = "127.0.0.1"     # 仅监听本机
+SERVICE_PORT: int = 8765
+SERVICE_WORKERS: int = 2            # 同时执行的任务数
+SERVICE_QUEUE_SIZE: int = 64        # 排队任务上限（超出返回503）
+SERVICE_CACHE_ROWS: int = 2000000   # 读取缓存可保留的总行数（小文件重复任务免重复解析）
+SERVICE_TOKEN: Optional[str] = None # 服务口令（请求头 Authorization: Bearer <口令>）；None→不校验（也可用环境变量 FILTER_SERVICE_TOKEN）；SERVICE_HOST 不是本机回环地址时必须设置
+
+# 分布式执行（ENGINE="cluster"）：协调者把输入切分为分片（CSV 按字节区间、Parquet 按行组、Excel 按文件×工作表），经 TCP 分发给工作进程（python filter_cli.py --worker 主机:端口），
+# 工作进程可在本机或共享同一文件系统（输入、输出路径相同）的其他主机上；各分片结果最后按顺序流式合并、去重
+CLUSTER_HOST: str = "127.0.0.1"     # 协调者监听地址；跨主机时改为 0.0.0.0 并设置 CLUSTER_TOKEN
+CLUSTER_PORT: int = 8766            # 协调者端口；0→由系统分配（本机工作进程自动使用实际端口）
+CLUSTER_TOKEN: Optional[str] = None # 工作进程连接口令；None→不校验（也可用环境变量 FILTER_CLUSTER_TOKEN）；CLUSTER_HOST 不是本机回环地址时必须设置
+CLUSTER_LOCAL_WORKERS: int = 0      # 协调者在本机启动的工作进程数；0→只等待外部工作进程连接
+CLUSTER_SHARD_ROWS: int = 200000    # 每个分片的约计行数（未压缩 CSV 按平均行长换算为字节区间，Parquet 累计行组）；Excel 与压缩 CSV 每个文件×工作表为一个分片
+CLUSTER_HEARTBEAT: float = 5.0      # 工作进程心跳间隔（秒）
+CLUSTER_TIMEOUT: float = 30.0       # 超过该秒数没有心跳的工作进程视为失联，其分片重新分配
+CLUSTER_MAX_ATTEMPTS: int = 3       # 单个分片最多分配次数（失败或失联都计一次），超出后任务失败
+CLUSTER_WORK_DIR: Optional[str] = None # 分片结果目录（须为各主机共享）；None→合并输出所在目录下的 .filter_cluster/
+CLUSTER_SIM_MEMO: bool = False      # 工作进程使用相似度缓存（SQLite 多进程写入，不适合网络文件系统）
+
+# 启动性能：重依赖延迟到首次使用时导入，并在校验配置期间后台预加载
+STARTUP_BUDGET_MS: int = 100        # 冷启动（导入本脚本）耗时预算，--bench-startup 据此判定是否回退
 
 # ===================== 工具函数 =====================
 def to_halfwidth(s: str) -> str:
@@ -83,6 +162,9 @@ def normalize_text(s: str) -> str:
     s = re.sub(r"\s+", " ", s)  # 仅压缩空格，保留词界
     return s
 
+# 规范化规则版本：修改 normalize_text 的行为时递增，相似度缓存会据此整体失效
+NORMALIZE_VERSION = "cli-norm-1"
+
 def extract_code(s: str) -> str:
     """
     从文本中提取4~6位的数字编码（忽略后缀字母），用于编码优先匹配。
@@ -105,6 +187,38 @@ def resolve_path(p: str) -> str:
         return p
     return os.path.abspath(p)
 
+# 延迟导入的重依赖（导入本脚本时不加载；首次使用时导入或由 preload_modules 在后台预加载）
+HEAVY_MODULES = ("pandas", "openpyxl", "xlsxwriter", "rapidfuzz", "ahocorasick")
+
+def preload_modules(names: Iterable[str] = HEAVY_MODULES):
+    """
+    在后台线程中预加载重依赖，使导入与配置校验、清单解析等并行；缺失的可选依赖静默跳过。
+    主线程随后的 import 会等待同一模块导入完成（导入锁），不会重复加载。
+    返回：
+      已启动的线程对象
+    """
+    import threading
+    import importlib
+    def _load():
+        for name in names:
+            try:
+                importlib.import_module(name)
+            except Exception:
+                pass
+    t = threading.Thread(target=_load, name="preload-modules", daemon=True)
+    t.start()
+    return t
+
+def module_installed(name: str) -> bool:
+    """
+    检查可选依赖是否已安装（不触发导入）。
+    """
+    import importlib.util
+    try:
+        return importlib.util.find_spec(name) is not None
+    except Exception:
+        return False
+
 def ensure_pandas():
     """
     安全导入 pandas，缺失依赖时给出安装提示。
@@ -159,7 +273,7 @@ def build_sheet_frames(pd, excel_path: str, sheet: str) -> List[Tuple[str, Optio
     生成“文件-工作表”组合列表，用于后续分块读取。
     规则：
       - ""：返回 (文件, None) → 读取首个工作表
-      - "*"：返回 (文件, "*") → 读取所有工作表
+      - "*"：Excel 展开为每个工作表一帧 (文件,"Sheet1"),(文件,"Sheet2")...（便于逐表并行解析）；CSV/Parquet 返回 (文件, "*")
       - "A,B"：返回 (文件,"A"),(文件,"B")
     """
     # 返回 (文件路径, 工作表名或None表示首个) 列表
@@ -168,11 +282,23 @@ def build_sheet_frames(pd, excel_path: str, sheet: str) -> List[Tuple[str, Optio
         return [(excel_path, None)]
     s = sheet.strip()
     if s == "*":
-        # 标识所有工作表，实际读取时获取列表
-        return [(excel_path, "*")]
+        if input_format(excel_path) != "excel":
+            return [(excel_path, "*")]
+        return [(excel_path, nm) for nm in excel_sheet_names(excel_path)]
     names = [x.strip() for x in s.split(",") if x.strip()]
     return [(excel_path, nm) for nm in names]
 
+def excel_sheet_names(excel_path: str) -> List[str]:
+    """
+    列出工作表名（read_only 模式只读取工作簿目录，不解析数据）。
+    """
+    from openpyxl import load_workbook  # type: ignore
+    wb = load_workbook(excel_path, read_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
 def chunk_generator_from_excel(pd, excel_path: str, sheet: Optional[str], chunk_size: int) -> Iterable:
     """
     Excel 流式分块读取：
@@ -204,12 +330,313 @@ def chunk_generator_from_excel(pd, excel_path: str, sheet: Optional[str], chunk_
             yield pd.DataFrame(buf)
     wb.close()
 
-def chunk_generator_from_csv(pd, csv_path: str, chunk_size: int) -> Iterable:
+# 压缩扩展名 → 编解码器
+COMPRESSION_EXTS = {".gz": "gzip", ".zst": "zstd", ".zstd": "zstd", ".xz": "xz"}
+
+def split_compression(path: str) -> Tuple[str, Optional[str]]:
+    """
+    拆分压缩扩展名：data.csv.gz → ("data.csv", "gzip")；未压缩返回 (path, None)。
+    """
+    stem, ext = os.path.splitext(path)
+    codec = COMPRESSION_EXTS.get(ext.lower())
+    return (stem, codec) if codec else (path, None)
+
+def input_format(path: str) -> str:
+    """
+    输入文件类型（忽略压缩扩展名）：csv | parquet | excel。
+    """
+    base = split_compression(path)[0].lower()
+    if base.endswith(".csv"):
+        return "csv"
+    if base.endswith(".parquet"):
+        return "parquet"
+    return "excel"
+
+class CompressedInput(io.RawIOBase):
+    """
+    压缩输入的流式解压（gzip / zstd / xz），不落盘、不整体解压：
+    - zstd 优先用 zstandard，未安装时用 pyarrow 的 CompressedInputStream
+    - bytes_read：已从磁盘读取的压缩字节数；bytes_total：压缩文件大小（按压缩字节计算进度）
+    一般经 open_input_binary 包装为缓冲读取器使用。
+    """
+    def __init__(self, path: str, codec: str):
+        super().__init__()
+        self.codec = codec
+        self.file = open(path, "rb")
+        self.bytes_total = os.fstat(self.file.fileno()).st_size
+        try:
+            if codec == "gzip":
+                import gzip
+                self.stream = gzip.GzipFile(fileobj=self.file, mode="rb")
+            elif codec == "xz":
+                import lzma
+                self.stream = lzma.LZMAFile(self.file, mode="rb")
+            elif module_installed("zstandard"):
+                import zstandard  # type: ignore
+                self.stream = zstandard.ZstdDecompressor().stream_reader(self.file, read_across_frames=True)
+            else:
+                import pyarrow as pa  # type: ignore
+                self.stream = pa.CompressedInputStream(pa.PythonFile(self.file, mode="r"), "zstd")
+        except BaseException:
+            self.file.close()
+            raise
+
+    @property
+    def bytes_read(self) -> int:
+        return self.file.tell() if not self.file.closed else self.bytes_total
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        data = self.stream.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            try:
+                self.stream.close()
+            finally:
+                self.file.close()
+        super().close()
+
+def open_input_binary(path: str):
+    """
+    以二进制只读方式打开输入文件；压缩文件（.gz/.zst/.xz）返回流式解压的缓冲读取器（raw 为 CompressedInput）。
+    """
+    codec = split_compression(path)[1]
+    if not codec:
+        return open(path, "rb")
+    return io.BufferedReader(CompressedInput(path, codec), buffer_size=1 << 20)
+
+def mark_source_progress(block, fh) -> None:
+    """
+    压缩输入：在块的 attrs 中记录已读取/总共的压缩字节数，主循环据此外推总行数（进度按压缩字节计）。
+    """
+    raw = getattr(fh, "raw", None)
+    if isinstance(raw, CompressedInput):
+        block.attrs["bytes_read"] = raw.bytes_read
+        block.attrs["bytes_total"] = raw.bytes_total
+
+def detect_csv_encoding(csv_path: str, sample_bytes: int = 1 << 20) -> str:
+    """
+    检测CSV编码（CSV_ENCODING="auto" 时使用）：
+    - 带BOM → utf-8-sig；前 sample_bytes 字节可按UTF-8解码 → utf-8；否则按 GBK 系（gb18030，兼容GBK/GB2312）
+    """
+    if CSV_ENCODING and CSV_ENCODING.lower() != "auto":
+        return CSV_ENCODING
+    import codecs
+    with open_input_binary(csv_path) as f:
+        head = f.read(sample_bytes)
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        # final=False：允许采样末尾截断半个多字节字符
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "gb18030"
+
+def transcode_to_utf8(csv_path: str, encoding: str) -> str:
+    """
+    将非UTF-8或压缩的CSV流式转码/解压为UTF-8临时文件（按 路径+修改时间+大小 缓存，同一文件只转码一次）。
+    返回：
+      转码后的文件路径（位于系统临时目录 filter_cli_transcoded/ 下）
+    """
+    import hashlib
+    import tempfile
+    st = os.stat(csv_path)
+    key = hashlib.sha1(f"{csv_path}|{st.st_mtime_ns}|{st.st_size}|{encoding}".encode("utf-8")).hexdigest()[:16]
+    out_dir = os.path.join(tempfile.gettempdir(), "filter_cli_transcoded")
+    os.makedirs(out_dir, exist_ok=True)
+    out_path = os.path.join(out_dir, f"{key}.csv")
+    if os.path.exists(out_path):
+        return out_path
+    tmp = out_path + f".{os.getpid()}.part"
+    with io.TextIOWrapper(open_input_binary(csv_path), encoding=encoding, errors="replace", newline="") as src, open(tmp, "w", encoding="utf-8", newline="") as dst:
+        while True:
+            block = src.read(1 << 22)
+            if not block:
+                break
+            dst.write(block)
+    os.replace(tmp, out_path)
+    return out_path
+
+def csv_byte_range(csv_path: str, start: int, stop: Optional[int]) -> Tuple[bytes, bytes]:
+    """
+    读取未压缩 CSV 的一个字节区间（分布式分片）：返回（标题行, 数据行）。
+    区间两端都对齐到下一个行首（偏移所在行归前一个区间），相邻区间首尾相接、不重不漏；只读取区间内的字节。
+    UTF-8 与 GBK 系编码的多字节字符不含换行字节，按字节对齐不会切断字符；字段内含换行（引号包裹）的 CSV 不能按字节切分。
+    """
+    with open(csv_path, "rb") as f:
+        header = f.readline()
+        def align(off: Optional[int]) -> int:
+            if off is None:
+                return os.fstat(f.fileno()).st_size
+            if off <= len(header):
+                return len(header)
+            f.seek(off - 1)
+            f.readline()
+            return f.tell()
+        begin, end = align(start), align(stop)
+        f.seek(begin)
+        return header, f.read(max(end - begin, 0))
+
+def chunk_generator_from_csv_pandas(pd, csv_path: str, chunk_size: int, byte_range: Optional[Tuple[int, Optional[int]]] = None) -> Iterable:
+    """
+    CSV 分块读取（pandas 后端）：
+    - pandas.read_csv(chunksize=...) 迭代返回 DataFrame块，编码按 detect_csv_encoding
+    - 每块重置索引（与 Excel 分块一致从0开始），保证与评估阶段新建的 Series 对齐
+    - 压缩文件（.gz/.zst/.xz）边读边解压，块上记录压缩字节进度（见 mark_source_progress）
+    - byte_range：只读取该字节区间内的数据行（见 csv_byte_range）
+    """
+    encoding = detect_csv_encoding(csv_path)
+    with (io.BytesIO(b"".join(csv_byte_range(csv_path, *byte_range))) if byte_range else open_input_binary(csv_path)) as fh:
+        for block in pd.read_csv(fh, chunksize=chunk_size, encoding=encoding):
+            block = block.reset_index(drop=True)
+            mark_source_progress(block, fh)
+            yield block
+
+def arrow_string_mapper(pd, pa):
+    """
+    Arrow→pandas 转换时的类型映射：字符串列映射为 Arrow 支持的 StringDtype（旧版 pandas 不支持时返回 None，按默认转换）。
+    """
+    try:
+        str_dtype = pd.StringDtype("pyarrow")
+        return {pa.string(): str_dtype, pa.large_string(): str_dtype}.get
+    except Exception:
+        return None
+
+def chunk_generator_from_parquet(pd, parquet_path: str, chunk_size: int, row_groups: Optional[List[int]] = None) -> Iterable:
+    """
+    Parquet 分块读取：pyarrow.parquet 按 chunk_size 行迭代记录批，字符串列同 pyarrow CSV 后端保持 Arrow 存储。
+    row_groups：只读取这些行组（分布式分片）；None→全部。
+    """
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+    mapper = arrow_string_mapper(pd, pa)
+    pf = pq.ParquetFile(parquet_path)
+    for batch in pf.iter_batches(batch_size=chunk_size, row_groups=row_groups):
+        yield pa.Table.from_batches([batch]).to_pandas(types_mapper=mapper)
+
+def arrow_text_types(pa, schema) -> Dict:
+    """
+    Arrow 推断为日期/时间/时间戳的列改按字符串读取（pandas 后端与旧版从不解析日期，
+    2020-01-05 10:00 若转成时间戳再转文本会变成 2020-01-05 10:00:00，text 条件不再命中，写出也变成日期单元格）。
+    返回：{列名: pa.string()}（无时间类列时为空字典）
+    """
+    return {f.name: pa.string() for f in schema if pa.types.is_temporal(f.type)}
+
+# 字节区间分片的列类型（按 路径+修改时间+大小+编码 缓存）：同一文件的各分片使用与从头顺序读取相同的推断结果
+_CSV_COLUMN_TYPES: Dict[Tuple, Dict] = {}
+
+def csv_column_types(csv_path: str, encoding: str, block_size: int = 1 << 24) -> Dict:
+    """
+    推断 CSV 的列类型：与 chunk_generator_from_csv_arrow 从头读取时一致，只解析文件开头一个块（block_size 字节，截到最后一个整行）。
+    """
+    import pyarrow as pa  # type: ignore
+    import pyarrow.csv as pacsv  # type: ignore
+    st = os.stat(csv_path)
+    key = (os.path.abspath(csv_path), st.st_mtime_ns, st.st_size, encoding)
+    if key not in _CSV_COLUMN_TYPES:
+        with open(csv_path, "rb") as f:
+            head = f.read(block_size)
+        if len(head) == block_size and b"\n" in head:
+            head = head[:head.rindex(b"\n") + 1]
+        if encoding not in ("utf-8", "utf-8-sig"):
+            head = head.decode(encoding, errors="replace").encode("utf-8")
+        reader = pacsv.open_csv(pa.BufferReader(head), read_options=pacsv.ReadOptions(block_size=block_size))
+        _CSV_COLUMN_TYPES[key] = dict({f.name: f.type for f in reader.schema}, **arrow_text_types(pa, reader.schema))
+    return _CSV_COLUMN_TYPES[key]
+
+def chunk_generator_from_csv_arrow(pd, csv_path: str, chunk_size: int, byte_range: Optional[Tuple[int, Optional[int]]] = None) -> Iterable:
     """
-    CSV 分块读取：
-    - 直接使用 pandas.read_csv(chunksize=...) 迭代返回 DataFrame块
+    CSV 分块读取（pyarrow 后端）：
+    - 内存映射文件 + pyarrow.csv.open_csv 流式读取，块解析由 Arrow 多线程完成
+    - 攒够 chunk_size 行后转为 DataFrame；字符串列映射为 Arrow 支持的 StringDtype，评估阶段直接使用，不再复制为 object 列
+    - 非UTF-8文件先转码一次（见 transcode_to_utf8）再映射读取；UTF-8 压缩文件边读边解压（不映射），块上记录压缩字节进度
+    - 后续数据块与首块推断的列类型冲突时，从已产出的行之后按全字符串列重新打开继续读取
+    - 日期/时间类列按字符串读取（见 arrow_text_types），与 pandas 后端的文本语义一致
+    - byte_range：只读取该字节区间内的数据行（见 csv_byte_range，非UTF-8只转码区间内的字节），列类型沿用文件开头的推断结果（见 csv_column_types）
     """
-    yield from pd.read_csv(csv_path, chunksize=chunk_size)
+    import pyarrow as pa  # type: ignore
+    import pyarrow.csv as pacsv  # type: ignore
+    encoding = detect_csv_encoding(csv_path)
+    data = None
+    column_types = None
+    if byte_range:
+        data = b"".join(csv_byte_range(csv_path, *byte_range))
+        if encoding not in ("utf-8", "utf-8-sig"):
+            data = data.decode(encoding, errors="replace").encode("utf-8")
+        column_types = csv_column_types(csv_path, encoding)
+        src = csv_path
+    else:
+        src = csv_path if encoding in ("utf-8", "utf-8-sig") else transcode_to_utf8(csv_path, encoding)
+    compressed = split_compression(src)[1] is not None
+    mapper = arrow_string_mapper(pd, pa)
+    def to_frame(batches):
+        return pa.Table.from_batches(batches).to_pandas(types_mapper=mapper)
+    yielded = 0
+    inferred = column_types
+    while True:
+        read_opts = pacsv.ReadOptions(use_threads=True, block_size=1 << 24, skip_rows_after_names=yielded)
+        conv_opts = pacsv.ConvertOptions(column_types=column_types) if column_types else pacsv.ConvertOptions()
+        with (pa.BufferReader(data) if data is not None else open_input_binary(src) if compressed else pa.memory_map(src, "r")) as mm:
+            reader = pacsv.open_csv(mm, read_options=read_opts, convert_options=conv_opts)
+            names = reader.schema.names
+            if column_types is None and arrow_text_types(pa, reader.schema):
+                # 首块推断出时间类列：这些列改按字符串重新打开（其余列仍按块推断）
+                column_types = inferred = arrow_text_types(pa, reader.schema)
+                continue
+            buf = []
+            buf_rows = 0
+            try:
+                for batch in reader:
+                    buf.append(batch)
+                    buf_rows += batch.num_rows
+                    while buf_rows >= chunk_size:
+                        table = pa.Table.from_batches(buf)
+                        head, rest = table.slice(0, chunk_size), table.slice(chunk_size)
+                        block = to_frame(head.to_batches())
+                        mark_source_progress(block, mm)
+                        yield block
+                        yielded += chunk_size
+                        buf = rest.to_batches()
+                        buf_rows = rest.num_rows
+            except pa.ArrowInvalid:
+                if column_types is not None and column_types is not inferred:
+                    raise
+                # 类型推断冲突：未产出的缓冲行随重新打开一起重读
+                column_types = {nm: pa.string() for nm in names}
+                continue
+            if buf_rows:
+                block = to_frame(buf)
+                mark_source_progress(block, mm)
+                yield block
+            return
+
+def chunk_generator_from_csv(pd, csv_path: str, chunk_size: int, byte_range: Optional[Tuple[int, Optional[int]]] = None) -> Iterable:
+    """
+    CSV 分块读取：按 CSV_BACKEND 选择后端
+    - auto：已安装 pyarrow 时使用 pyarrow 流式读取，否则 pandas
+    - pyarrow：强制 pyarrow，未安装时提示并回退 pandas
+    - pandas：pandas.read_csv(chunksize=...)
+    - byte_range：（起始字节, 结束字节或None）只读取该区间内的数据行（分布式分片，见 csv_byte_range）
+    """
+    backend = (CSV_BACKEND or "auto").lower()
+    if backend in ("auto", "pyarrow"):
+        try:
+            import pyarrow.csv  # type: ignore  # noqa
+        except Exception:
+            if backend == "pyarrow":
+                print("警告：未安装 pyarrow，CSV 读取回退到 pandas（pip install pyarrow）")
+            backend = "pandas"
+    if backend == "pyarrow" or backend == "auto":
+        yield from chunk_generator_from_csv_arrow(pd, csv_path, chunk_size, byte_range)
+    else:
+        yield from chunk_generator_from_csv_pandas(pd, csv_path, chunk_size, byte_range)
 
 def total_rows_excel(excel_path: str, sheet: Optional[str]) -> int:
     """
@@ -242,11 +669,20 @@ def total_rows_excel(excel_path: str, sheet: Optional[str]) -> int:
 
 def total_rows_csv(csv_path: str) -> int:
     """
-    估算CSV总行数（不含标题行）：统计文件行数-1
+    估算CSV总行数（不含标题行）：统计文件行数-1（压缩文件需完整解压一遍，进度占比改用 estimate_total_rows 的压缩字节外推）
     """
     try:
-        with open(csv_path, "r", encoding="utf-8", errors="ignore") as f:
-            cnt = sum(1 for _ in f)
+        cnt = 0
+        last = b"\n"
+        with open_input_binary(csv_path) as f:
+            while True:
+                block = f.read(1 << 22)
+                if not block:
+                    break
+                cnt += block.count(b"\n")
+                last = block[-1:]
+        if last != b"\n":
+            cnt += 1  # 末行无换行符
         return max(cnt - 1, 0)
     except Exception:
         return 0
@@ -275,6 +711,230 @@ def render_progress(done: int, total: int, width: int = 30) -> str:
     bar = "#" * filled + "-" * (width - filled)
     return f"[{bar}] {pct:02d}%"
 
+# ===================== 相似度缓存 =====================
+class SimilarityMemo:
+    """
+    持久化相似度缓存（SQLite）：
+    - 键：(评分器, 规范化目标, 规范化取值) → 相似度（0~1）
+    - 每个评分器登记一个“指纹”（评分器实现/版本 + 规范化版本），指纹变化时清空该评分器的全部条目
+    - 条目数超过 max_entries 时按最近使用时间淘汰（LRU），淘汰在 flush 时批量执行
+    - 内存前置字典承接同一进程内的重复查询；新增与（超过刷新间隔的）命中先缓冲，flush 时统一落盘
+    线程安全：内部使用锁串行化对连接的访问，可在多个线程间共享
+    """
+
+    FRONT_LIMIT = 500000    # 内存前置字典上限，超出后清空重建
+    BATCH = 500             # IN 查询每批的取值个数（低于 SQLite 变量上限）
+    TOUCH_INTERVAL = 3600.0 # 命中条目的使用时间超过该秒数才刷新，避免每次运行都整体回写
+
+    def __init__(self, path: str, max_entries: int = 2000000):
+        import sqlite3
+        import threading
+        self.path = resolve_path(path)
+        self.max_entries = max(int(max_entries or 0), 0)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sim ("
+            "scorer TEXT NOT NULL, target TEXT NOT NULL, value TEXT NOT NULL, "
+            "score REAL NOT NULL, used REAL NOT NULL, "
+            "PRIMARY KEY (scorer, target, value)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sim_used ON sim(used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (scorer TEXT PRIMARY KEY, fingerprint TEXT NOT NULL)")
+        self._conn.commit()
+        self._front: Dict[Tuple[str, str, str], float] = {}
+        self._pending: Dict[Tuple[str, str, str], float] = {}
+        self._touched = set()
+        self._bound: Dict[str, str] = {}
+        self._stale_before = time.time() - self.TOUCH_INTERVAL
+
+    def bind(self, scorer: str, fingerprint: str) -> None:
+        """
+        登记评分器指纹；与库中记录不一致（评分器或规范化规则变化）时清空该评分器的缓存条目。
+        """
+        if self._bound.get(scorer) == fingerprint:
+            return
+        with self._lock:
+            row = self._conn.execute("SELECT fingerprint FROM meta WHERE scorer=?", (scorer,)).fetchone()
+            if row is None or row[0] != fingerprint:
+                self._conn.execute("DELETE FROM sim WHERE scorer=?", (scorer,))
+                self._conn.execute("INSERT OR REPLACE INTO meta(scorer, fingerprint) VALUES (?, ?)", (scorer, fingerprint))
+                self._conn.commit()
+                for k in [k for k in self._front if k[0] == scorer]:
+                    del self._front[k]
+            self._bound[scorer] = fingerprint
+
+    def get(self, scorer: str, target: str, value: str) -> Optional[float]:
+        """
+        查询单个取值的相似度；未缓存返回 None（适合逐行调用，内存前置字典优先）。
+        """
+        key = (scorer, target, value)
+        s = self._front.get(key)
+        if s is not None:
+            return s
+        with self._lock:
+            s = self._pending.get(key)
+            if s is None:
+                row = self._conn.execute(
+                    "SELECT score, used FROM sim WHERE scorer=? AND target=? AND value=?", key
+                ).fetchone()
+                if row is None:
+                    return None
+                s = row[0]
+                if row[1] < self._stale_before:
+                    self._touched.add(key)
+        self._remember(key, s)
+        return s
+
+    def get_many(self, scorer: str, target: str, values: Iterable[str]) -> Dict[str, float]:
+        """
+        批量查询一组（去重后的）取值，返回 取值→相似度 的已缓存部分。
+        """
+        found: Dict[str, float] = {}
+        missing = []
+        for v in values:
+            s = self._front.get((scorer, target, v))
+            if s is None:
+                missing.append(v)
+            else:
+                found[v] = s
+        if not missing:
+            return found
+        with self._lock:
+            for i in range(0, len(missing), self.BATCH):
+                part = missing[i:i + self.BATCH]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT value, score, used FROM sim WHERE scorer=? AND target=? AND value IN ({marks})",
+                    [scorer, target] + part,
+                ).fetchall()
+                for v, s, used in rows:
+                    found[v] = s
+                    if used < self._stale_before:
+                        self._touched.add((scorer, target, v))
+            for v in missing:
+                s = self._pending.get((scorer, target, v))
+                if s is not None:
+                    found[v] = s
+        for v, s in found.items():
+            self._remember((scorer, target, v), s)
+        return found
+
+    def put(self, scorer: str, target: str, value: str, score: float) -> None:
+        """
+        写入单个相似度（缓冲，flush 时落盘）。
+        """
+        key = (scorer, target, value)
+        with self._lock:
+            self._pending[key] = float(score)
+        self._remember(key, float(score))
+
+    def put_many(self, scorer: str, target: str, scores: Dict[str, float]) -> None:
+        """
+        批量写入 取值→相似度（缓冲，flush 时落盘）。
+        """
+        with self._lock:
+            for v, s in scores.items():
+                self._pending[(scorer, target, v)] = float(s)
+        for v, s in scores.items():
+            self._remember((scorer, target, v), float(s))
+
+    def _remember(self, key: Tuple[str, str, str], score: float) -> None:
+        if len(self._front) >= self.FRONT_LIMIT:
+            self._front.clear()
+        self._front[key] = score
+
+    def flush(self) -> None:
+        """
+        将缓冲的新增条目与命中刷新（更新使用时间）落盘，并按上限执行 LRU 淘汰。
+        """
+        with self._lock:
+            if not self._pending and not self._touched:
+                return
+            now = time.time()
+            if self._pending:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO sim(scorer, target, value, score, used) VALUES (?, ?, ?, ?, ?)",
+                    [(k[0], k[1], k[2], s, now) for k, s in self._pending.items()],
+                )
+            touched = [k for k in self._touched if k not in self._pending]
+            if touched:
+                self._conn.executemany(
+                    "UPDATE sim SET used=? WHERE scorer=? AND target=? AND value=?",
+                    [(now, k[0], k[1], k[2]) for k in touched],
+                )
+            self._pending.clear()
+            self._touched.clear()
+            self._stale_before = now - self.TOUCH_INTERVAL
+            if self.max_entries > 0:
+                count = self._conn.execute("SELECT COUNT(*) FROM sim").fetchone()[0]
+                if count > self.max_entries:
+                    # 一次多淘汰 10%，避免每次 flush 都触发淘汰
+                    n = count - int(self.max_entries * 0.9)
+                    self._conn.execute(
+                        "DELETE FROM sim WHERE (scorer, target, value) IN "
+                        "(SELECT scorer, target, value FROM sim ORDER BY used LIMIT ?)",
+                        (n,),
+                    )
+                    self._front.clear()
+            self._conn.commit()
+
+    def close(self) -> None:
+        """
+        落盘并关闭连接。
+        """
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._conn.close()
+
+def similarity_memo_path(conditions_path: str) -> str:
+    """
+    相似度缓存文件路径：与条件文件同目录，文件名为 <条件文件名>.simmemo.sqlite
+    """
+    return resolve_path(conditions_path) + ".simmemo.sqlite"
+
+def open_similarity_memo(conditions_path: Optional[str], max_entries: int = SIM_MEMO_MAX_ENTRIES) -> Optional[SimilarityMemo]:
+    """
+    打开条件文件旁的相似度缓存；无条件文件或打开失败（只读目录等）时返回 None，评估照常进行。
+    """
+    if not conditions_path:
+        return None
+    try:
+        return SimilarityMemo(similarity_memo_path(conditions_path), max_entries)
+    except Exception as e:
+        print(f"相似度缓存不可用（忽略）：{e}")
+        return None
+
+def needs_similarity_memo(conditions: List[Dict[str, str]]) -> bool:
+    """
+    条件中是否含 fuzzy 相似度条件（只有这类条件读写相似度缓存；不含时不创建缓存文件）。
+    """
+    return any(c.get("type") == "fuzzy" and c.get("operator") == "similar" for c in conditions)
+
+def contains_token_groups(conditions: List[Dict[str, str]]) -> Dict[str, Tuple[List[str], bool]]:
+    """
+    按列归并“text contains”条件的词（同列、同选项为一组；同列多组时后出现的组生效，与合并regex的行为一致）；
+    重复的词只保留一次，条件优化合并后的条件带词表 _tokens（见 optimize_conditions）。
+    返回：
+      列名→(非空词列表, 是否忽略大小写)
+    """
+    col_ops = {}
+    for cond in conditions:
+        if cond["type"] == "text" and cond["operator"] == "contains":
+            key = (cond["column"], "contains", cond.get("options",""))
+            col_ops.setdefault(key, []).extend(cond.get("_tokens") or [cond["value"]])
+    groups = {}
+    for (col, _, opts), tokens in col_ops.items():
+        tokens = list(dict.fromkeys(t for t in tokens if t))
+        if not tokens:
+            continue
+        groups[col] = (tokens, parse_options(opts).get("ignore_case","false").lower()=="true")
+    return groups
+
 def compile_text_operations(pd, df, conditions: List[Dict[str, str]]) -> Dict:
     """
     对“text contains”类条件按列进行合并与预编译：
@@ -282,41 +942,605 @@ def compile_text_operations(pd, df, conditions: List[Dict[str, str]]) -> Dict:
     - 返回：列名→预编译regex
     """
     # 将相同列/相同选项的 contains 合并为一个大regex，提高效率
-    col_ops = {}
-    for cond in conditions:
-        col = cond["column"]
-        typ = cond["type"]
-        op = cond["operator"]
-        opts = cond.get("options","")
-        if typ == "text" and op == "contains":
-            key = (col, "contains", opts)
-            col_ops.setdefault(key, []).append(cond["value"])
     compiled = {}
     import re as _re
-    for (col, _, opts), tokens in col_ops.items():
-        tokens = [t for t in tokens if t]
-        if not tokens:
-            continue
-        ignore_case = parse_options(opts).get("ignore_case","false").lower()=="true"
+    for col, (tokens, ignore_case) in contains_token_groups(conditions).items():
         pat = "|".join([_re.escape(t) for t in tokens])
         flags = _re.IGNORECASE if ignore_case else 0
         compiled[col] = _re.compile(pat, flags)
     return compiled
 
-def eval_conditions_block(pd, df, conditions: List[Dict[str, str]], combine_mode: str, combine_threshold: float, write_audit: bool) -> Tuple:
+REGEX_ENGINES = ("re2", "hyperscan", "re")
+
+def translate_pattern(pattern: str, engine: str) -> Optional[str]:
     """
-    对一个数据块（DataFrame）执行条件评估（向量化）：
-    - 预编译 text contains 与 regex
-    - number/enum/boolean/code：广播比较或集合匹配
-    - fuzzy：优先 rapidfuzz；否则退化为 normalize+contains（相对更快）
-    - 组合：AND/OR/WEIGHTED，生成 _match_all 与 _score_all
-    - 审计列：可选输出每条件的命中与分数与描述，便于回溯
+    把 Python re 模式改写为目标引擎下语义一致的写法；无法保证一致时返回 None（该模式退回 re 逐条匹配）。
+    - 两个引擎：\\Z（绝对结尾）→ \\z
+    - re2：\\d/\\D → \\p{Nd}/\\P{Nd}（Unicode 数字，同 Python）；字符类外的 $ → \\n?\\z（同 Python 允许结尾换行）；
+      含 \\w \\W \\s \\S \\b \\B（re2 只认 ASCII）或字符类内 \\D 的模式不改写
+    """
+    out = []
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\" and i + 1 < len(pattern):
+            nxt = pattern[i + 1]
+            i += 2
+            if nxt == "Z":
+                out.append("\\z")
+            elif engine == "re2" and nxt in "wWsSbB":
+                return None
+            elif engine == "re2" and nxt == "d":
+                out.append("\\p{Nd}")
+            elif engine == "re2" and nxt == "D":
+                if in_class:
+                    return None
+                out.append("\\P{Nd}")
+            else:
+                out.append(ch + nxt)
+            continue
+        if in_class:
+            if ch == "]" and not (out and out[-1] in ("[", "[^")):
+                in_class = False
+            out.append(ch)
+        elif ch == "[":
+            in_class = True
+            if pattern.startswith("[^", i):
+                out.append("[^")
+                i += 2
+                continue
+            out.append(ch)
+        elif ch == "$" and engine == "re2":
+            out.append("(?:\\n?\\z)")
+        else:
+            out.append(ch)
+        i += 1
+    return "".join(out)
+
+class RegexSet:
+    """
+    同列多个 regex match 条件的多模式集合：对每个取值一次扫描返回命中的模式下标（“任意位置匹配”，同 re.search）。
+    - re2：Set（线性时间；模式经 translate_pattern 改写，\\w/\\s/\\b 等只认 ASCII 的写法退回 re）
+    - hyperscan：Database（UTF-8 + Unicode 字符类，\\d/\\w 与 Python re 一致），线性时间
+    - re：每 REGEX_SET_CHUNK 个无捕获组的模式合并为一个交替式做预筛，命中后再逐条确认；其余模式逐条匹配
+    引擎不支持的模式（如反向引用、环视）单独用 re 匹配；Python re 无法编译的模式永不命中（与逐条评估一致）。
+    """
+
+    def __init__(self, patterns: List[str], engine: Optional[str] = None):
+        self.patterns = list(patterns)
+        self.compiled = []
+        for p in self.patterns:
+            try:
+                self.compiled.append(re.compile(p))
+            except Exception:
+                self.compiled.append(None)
+        valid = [i for i, c in enumerate(self.compiled) if c is not None]
+        self.engine = "re"
+        self.native: List[int] = []
+        self._db = None
+        names = REGEX_ENGINES if (engine or REGEX_ENGINE) == "auto" else ((engine or REGEX_ENGINE),)
+        for name in names:
+            if name not in REGEX_ENGINES:
+                raise ValueError(f"未知正则引擎：{name}（可选：auto、{'、'.join(REGEX_ENGINES)}）")
+            if name == "re":
+                break
+            built = self._build_hyperscan(valid) if name == "hyperscan" else self._build_re2(valid)
+            if built is not None:
+                self.engine, (self._db, self.native) = name, built
+                break
+        native = set(self.native)
+        rest = [i for i in valid if i not in native]
+        # re 预筛：只合并无捕获组的模式（避免组号/组名冲突改变反向引用语义）；交替式编译失败的分组退回逐条匹配
+        self._chunks: List[Tuple] = []
+        simple = [i for i in rest if self.compiled[i].groups == 0]
+        for start in range(0, len(simple), max(1, REGEX_SET_CHUNK)):
+            ids = simple[start:start + max(1, REGEX_SET_CHUNK)]
+            alt = None
+            if len(ids) > 1:
+                try:
+                    alt = re.compile("|".join(f"(?:{self.patterns[i]})" for i in ids))
+                except Exception:
+                    alt = None
+            if alt is None:
+                self._chunks.extend((None, [i]) for i in ids)
+            else:
+                self._chunks.append((alt, ids))
+        self._chunks.extend((None, [i]) for i in rest if self.compiled[i].groups != 0)
+
+    def _build_hyperscan(self, ids: List[int]):
+        try:
+            import hyperscan  # type: ignore
+        except Exception:
+            return None
+        flags = hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP | hyperscan.HS_FLAG_SINGLEMATCH | hyperscan.HS_FLAG_ALLOWEMPTY
+        def compile_db(sel):
+            db = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+            db.compile(expressions=[translate_pattern(self.patterns[i], "hyperscan").encode("utf-8") for i in sel], ids=list(sel), elements=len(sel), flags=[flags] * len(sel))
+            return db
+        if not ids:
+            return None
+        try:
+            return compile_db(ids), list(ids)
+        except Exception:
+            pass
+        supported = []
+        for i in ids:
+            try:
+                compile_db([i])
+                supported.append(i)
+            except Exception:
+                continue
+        if not supported:
+            return None
+        try:
+            return compile_db(supported), supported
+        except Exception:
+            return None
+
+    def _build_re2(self, ids: List[int]):
+        try:
+            import re2  # type: ignore
+        except Exception:
+            return None
+        if not ids:
+            return None
+        options = re2.Options()
+        options.log_errors = False
+        rset = re2.Set.SearchSet(options)
+        native = []
+        for i in ids:
+            translated = translate_pattern(self.patterns[i], "re2")
+            if translated is None:
+                continue
+            try:
+                rset.Add(translated)
+            except Exception:
+                continue
+            native.append(i)
+        if not native:
+            return None
+        try:
+            rset.Compile()
+        except Exception:
+            return None
+        return rset, native
+
+    def matching_ids(self, value: str) -> List[int]:
+        """
+        单个取值命中的模式下标（升序）。
+        """
+        found: List[int] = []
+        if self.native:
+            if self.engine == "hyperscan":
+                self._db.scan(value.encode("utf-8"), match_event_handler=lambda i, frm, to, flags, ctx: found.append(i))
+            else:
+                # re2.Set 返回的是加入顺序下标，映射回模式下标
+                found.extend(self.native[k] for k in (self._db.Match(value) or ()))
+        for alt, ids in self._chunks:
+            if alt is not None and alt.search(value) is None:
+                continue
+            found.extend(i for i in ids if self.compiled[i].search(value) is not None)
+        return sorted(found)
+
+    def match(self, values: List[str]):
+        """
+        返回 numpy 布尔矩阵 [取值数, 模式数]：values[r] 是否命中 patterns[c]。
+        """
+        import numpy as np  # type: ignore
+        out = np.zeros((len(values), len(self.patterns)), dtype=bool)
+        for r, v in enumerate(values):
+            ids = self.matching_ids(v)
+            if ids:
+                out[r, ids] = True
+        return out
+
+def compile_regex_sets(conditions: List[Dict[str, str]]) -> Dict:
+    """
+    按列把 regex match 条件编入 RegexSet（见 REGEX_ENGINE）：
+      {列名: {"set": RegexSet, "slot": {条件id: 模式下标}}}
+    """
+    by_col: Dict[str, List[Dict[str, str]]] = {}
+    for cond in conditions:
+        if cond["type"] == "regex" and cond["operator"] == "match" and cond["value"]:
+            by_col.setdefault(cond["column"], []).append(cond)
+    sets = {}
+    for col, conds in by_col.items():
+        patterns: Dict[str, int] = {}
+        slot = {id(c): patterns.setdefault(c["value"], len(patterns)) for c in conds}
+        sets[col] = {"set": RegexSet(list(patterns)), "slot": slot}
+    return sets
+
+class AffixIndex:
+    """
+    同列多个 text startswith（或 endswith）条件的前缀索引：模式按长度分层（即前缀树按深度展开，每层的终止节点合成一个哈希索引），
+    对一组取值每层只做一次向量化截取（前 k 个字符，endswith 为后 k 个）与一次哈希查找，得到全部命中的模式下标；
+    遍历次数等于不同的模式长度数，与条件数无关。空模式总是命中（与 str.startswith("") 一致）。
+    """
+
+    def __init__(self, patterns: List[str], suffix: bool = False):
+        self.patterns = list(patterns)
+        self.suffix = suffix
+        self.levels: Dict[int, List[int]] = {}
+        for i, p in enumerate(self.patterns):
+            self.levels.setdefault(len(p), []).append(i)
+
+    def matrix(self, pd, values):
+        """
+        命中矩阵（bool，[取值数, 模式数]）；values 为字符串 Series。
+        """
+        import numpy as np  # type: ignore
+        m = np.zeros((len(values), len(self.patterns)), dtype=bool)
+        for k, slots in self.levels.items():
+            if k == 0:
+                m[:, slots] = True
+                continue
+            keys = values.str.slice(-k) if self.suffix else values.str.slice(0, k)
+            pos = pd.Index([self.patterns[j] for j in slots]).get_indexer(keys)
+            found = np.flatnonzero(pos >= 0)
+            m[found, np.asarray(slots)[pos[found]]] = True
+        return m
+
+def compile_affix_indexes(conditions: List[Dict[str, str]]) -> Dict:
+    """
+    按列把 text startswith/endswith 条件编入 AffixIndex（同列同运算符的条件数达到 AFFIX_INDEX_MIN_RULES 时；
+    区分大小写与 ignore_case 的条件各建一个索引，后者的模式与取值只转小写一次）：
+      {列名: {"indexes": {(运算符, 是否忽略大小写): AffixIndex}, "slot": {条件id: ((运算符, 是否忽略大小写), 模式下标)}}}
+    """
+    by_key: Dict[Tuple[str, str, bool], List[Dict[str, str]]] = {}
+    for cond in conditions:
+        if cond["type"] == "text" and cond["operator"] in ("startswith", "endswith"):
+            ic = parse_options(cond.get("options", "")).get("ignore_case", "").lower() == "true"
+            by_key.setdefault((cond["column"], cond["operator"], ic), []).append(cond)
+    per_col: Dict[Tuple[str, str], int] = {}
+    for (col, op, _), conds in by_key.items():
+        per_col[(col, op)] = per_col.get((col, op), 0) + len(conds)
+    groups: Dict[str, Dict] = {}
+    for (col, op, ic), conds in by_key.items():
+        if per_col[(col, op)] < max(AFFIX_INDEX_MIN_RULES, 1):
+            continue
+        patterns: Dict[str, int] = {}
+        slot = {id(c): patterns.setdefault(c["value"].lower() if ic else c["value"], len(patterns)) for c in conds}
+        group = groups.setdefault(col, {"indexes": {}, "slot": {}})
+        group["indexes"][(op, ic)] = AffixIndex(list(patterns), suffix=(op == "endswith"))
+        group["slot"].update({k: ((op, ic), j) for k, j in slot.items()})
+    return groups
+
+SCORER_ALIASES = {"jw": "jaro_winkler", "jarowinkler": "jaro_winkler", "cosine": "ngram", "ngram_cosine": "ngram", "sequence_matcher": "difflib"}
+SCORER_NAMES = ("token_set_ratio", "ratio", "partial_ratio", "jaro_winkler", "indel", "ngram", "difflib")
+NGRAM_SIZES = (2, 3)
+_SCORERS: Dict[str, Tuple] = {}
+
+def ngram_vector(s: str) -> Dict[str, int]:
+    """
+    字符 n-gram 计数（稀疏向量，NGRAM_SIZES 各长度合并）；短于最小长度的文本以整体作为一个 gram。
+    """
+    vec: Dict[str, int] = {}
+    for n in NGRAM_SIZES:
+        for i in range(len(s) - n + 1):
+            g = s[i:i+n]
+            vec[g] = vec.get(g, 0) + 1
+    if not vec and s:
+        vec[s] = 1
+    return vec
+
+def ngram_cosine_batch(values: List[str], target: str, cutoff: float = 0.0) -> List[float]:
+    """
+    字符 n-gram 余弦相似度（批量）：目标向量只计算一次，逐个取值与其做稀疏点积。
+    """
+    tv = ngram_vector(target)
+    tn = sum(c * c for c in tv.values()) ** 0.5
+    out = []
+    for v in values:
+        vv = ngram_vector(v)
+        if not tn or not vv:
+            out.append(0.0)
+            continue
+        dot = sum(c * tv.get(g, 0) for g, c in vv.items())
+        sim = dot / (tn * sum(c * c for c in vv.values()) ** 0.5) if dot else 0.0
+        out.append(sim if sim >= cutoff else 0.0)
+    return out
+
+def difflib_batch(values: List[str], target: str, cutoff: float = 0.0) -> List[float]:
+    """
+    difflib.SequenceMatcher 相似度（批量，目标侧只建索引一次）；cutoff>0 时先用 quick_ratio 上界提前排除。
+    """
+    from difflib import SequenceMatcher
+    sm = SequenceMatcher()
+    sm.set_seq2(target)
+    out = []
+    for v in values:
+        sm.set_seq1(v)
+        if cutoff > 0 and (sm.real_quick_ratio() < cutoff or sm.quick_ratio() < cutoff):
+            out.append(0.0)
+            continue
+        r = sm.ratio()
+        out.append(r if r >= cutoff else 0.0)
+    return out
+
+def get_scorer(name: Optional[str] = None) -> Tuple[str, str, object]:
+    """
+    按名称取模糊评分器：(评分器ID, 指纹, 批量评分函数(取值列表, 目标, cutoff)→0~1 列表)
+    - token_set_ratio（默认，DEFAULT_SCORER）/ ratio / partial_ratio / jaro_winkler（jw）/ indel：rapidfuzz，
+      经 process.cdist 批量评分（多线程），cutoff>0 时传入 score_cutoff 提前退出（低于阈值记 0）
+    - ngram：字符 2~3-gram 余弦相似度（稀疏向量，纯Python）
+    - difflib：difflib.SequenceMatcher（GUI 旧版评分）
+    未安装 rapidfuzz 时，rapidfuzz 系评分器退化为 normalize+contains（命中记1.0，否则0.0）。
+    指纹包含实现版本与 NORMALIZE_VERSION，供相似度缓存判断失效；未知名称抛出 ValueError。
+    """
+    key = str(name or DEFAULT_SCORER).strip().lower()
+    key = SCORER_ALIASES.get(key, key)
+    if key not in SCORER_NAMES:
+        raise ValueError(f"未知评分器：{name}（可选：{'/'.join(SCORER_NAMES)}/jw）")
+    cached = _SCORERS.get(key)
+    if cached is not None:
+        return cached
+    if key == "ngram":
+        scorer = ("ngram", f"ngram-{'/'.join(map(str, NGRAM_SIZES))}-1|{NORMALIZE_VERSION}", ngram_cosine_batch)
+    elif key == "difflib":
+        scorer = ("difflib", f"difflib-1|{NORMALIZE_VERSION}", difflib_batch)
+    else:
+        try:
+            import numpy as np  # type: ignore
+            import rapidfuzz  # type: ignore
+            from rapidfuzz import fuzz, process  # type: ignore
+            from rapidfuzz.distance import Indel, JaroWinkler  # type: ignore
+            fn, scale = {
+                "token_set_ratio": (fuzz.token_set_ratio, 100.0),
+                "ratio": (fuzz.ratio, 100.0),
+                "partial_ratio": (fuzz.partial_ratio, 100.0),
+                "jaro_winkler": (JaroWinkler.normalized_similarity, 1.0),
+                "indel": (Indel.normalized_similarity, 1.0),
+            }[key]
+            def batch(values, target, cutoff=0.0, fn=fn, scale=scale):
+                if not values:
+                    return []
+                m = process.cdist(values, [target], scorer=fn, score_cutoff=(cutoff * scale) if cutoff > 0 else None, dtype=np.float64, workers=-1)
+                return (m[:, 0] / scale).tolist()
+            scorer = (key, f"rapidfuzz-{getattr(rapidfuzz, '__version__', '?')}|{NORMALIZE_VERSION}", batch)
+        except Exception:
+            scorer = ("contains", f"contains-1|{NORMALIZE_VERSION}", lambda values, target, cutoff=0.0: [1.0 if target in x else 0.0 for x in values])
+    _SCORERS[key] = scorer
+    return scorer
+
+def score_distinct(values: Iterable[str], target: str, memo: Optional[SimilarityMemo] = None, scorer: Optional[str] = None, cutoff: float = 0.0) -> Dict[str, float]:
+    """
+    对去重后的规范化取值计算与目标的相似度：先查相似度缓存，仅对未命中的取值批量评分并回写缓存。
+    - scorer：评分器名称（见 get_scorer），None 为 DEFAULT_SCORER
+    - cutoff：>0 时低于该值的相似度记 0（评分器可提前退出）；缓存按评分器与 cutoff 分开存放
     返回：
-      (更新后的df, 审计列名列表)
+      取值→相似度 字典
+    """
+    sid, fingerprint, batch = get_scorer(scorer)
+    if cutoff > 0:
+        sid = f"{sid}@{cutoff:g}"
+    values = list(values)
+    scores: Dict[str, float] = {}
+    if memo is not None:
+        memo.bind(sid, fingerprint)
+        scores = memo.get_many(sid, target, values)
+    missing = [v for v in values if v not in scores]
+    if missing:
+        fresh = dict(zip(missing, batch(missing, target, cutoff)))
+        scores.update(fresh)
+        if memo is not None:
+            memo.put_many(sid, target, fresh)
+    return scores
+
+def condition_scorer(opts: Dict[str, str], th: float) -> Tuple[Optional[str], float]:
+    """
+    fuzzy 条件的评分设置：options 中 scorer=<名称> 选择评分器；cutoff=true 时以阈值作为 score_cutoff
+    （低于阈值的相似度记 0，评分更快；WEIGHTED 模式下会降低未达阈值行的总分）。
+    """
+    return (opts.get("scorer") or None), (th if opts.get("cutoff", "").lower() == "true" else 0.0)
+
+class NgramTfidfIndex:
+    """
+    目标文本的字符 n-gram（NGRAM_SIZES）TF-IDF 稀疏矩阵索引，用于大批目标的候选召回（需要 scipy）：
+    - 目标矩阵按 gram 计数 × 平滑 IDF 构造并按行 L2 归一化；查询取值按同一词表向量化（词表外的 gram 与任何目标都不重合）
+    - top_k：按块做稀疏矩阵乘法（每块约 TFIDF_BLOCK_CELLS 个相似度），每个取值取余弦最高的 k 个目标
+    """
+    BLOCK_CELLS = 4000000
+
+    def __init__(self, targets: List[str]):
+        import numpy as np  # type: ignore
+        self.targets = list(targets)
+        self.vocab: Dict[str, int] = {}
+        counts = self._counts(self.targets, grow=True)
+        df = np.bincount(counts.indices, minlength=counts.shape[1])
+        self.idf = np.log((1.0 + counts.shape[0]) / (1.0 + df)) + 1.0
+        self.matrix = self._weigh(counts).T.tocsr()
+
+    def _counts(self, texts: List[str], grow: bool = False):
+        import numpy as np  # type: ignore
+        from scipy import sparse  # type: ignore
+        indptr, indices, data = [0], [], []
+        for t in texts:
+            for g, c in ngram_vector(t).items():
+                j = self.vocab.get(g)
+                if j is None:
+                    if not grow:
+                        continue
+                    j = self.vocab[g] = len(self.vocab)
+                indices.append(j)
+                data.append(c)
+            indptr.append(len(indices))
+        return sparse.csr_matrix((np.asarray(data, dtype=np.float64), np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)), shape=(len(texts), max(len(self.vocab), 1)))
+
+    def _weigh(self, counts):
+        import numpy as np  # type: ignore
+        from scipy import sparse  # type: ignore
+        m = counts @ sparse.diags(self.idf)
+        norms = np.sqrt(np.asarray(m.multiply(m).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return sparse.diags(1.0 / norms) @ m
+
+    def top_k(self, values: List[str], k: int) -> Tuple:
+        """
+        返回 (候选目标下标数组 [取值数, k], 余弦相似度数组 [取值数, k])；无任何共同 gram 的候选相似度为 0。
+        """
+        import numpy as np  # type: ignore
+        k = max(1, min(int(k), len(self.targets)))
+        out_idx = np.zeros((len(values), k), dtype=np.int64)
+        out_sim = np.zeros((len(values), k), dtype=np.float64)
+        block = max(1, self.BLOCK_CELLS // max(len(self.targets), 1))
+        for start in range(0, len(values), block):
+            q = self._weigh(self._counts(values[start:start + block]))
+            sims = (q @ self.matrix).toarray()
+            idx = np.argpartition(-sims, k - 1, axis=1)[:, :k] if k < sims.shape[1] else np.tile(np.arange(sims.shape[1]), (sims.shape[0], 1))
+            out_idx[start:start + len(sims)] = idx
+            out_sim[start:start + len(sims)] = np.take_along_axis(sims, idx, axis=1)
+        return out_idx, out_sim
+
+    def candidates(self, values: List[str], k: int) -> List[List[int]]:
+        """
+        每个目标的候选取值下标列表（余弦 > 0 的 top-k 召回结果按目标分组）。
+        """
+        import numpy as np  # type: ignore
+        per_target: List[List[int]] = [[] for _ in self.targets]
+        if not values:
+            return per_target
+        idx, sims = self.top_k(values, k)
+        mask = sims > 0
+        rows = np.nonzero(mask)[0]
+        cols = idx[mask]
+        order = np.argsort(cols, kind="stable")
+        rows, cols = rows[order], cols[order]
+        bounds = np.flatnonzero(np.diff(cols)) + 1
+        for r, c in zip(np.split(rows, bounds), np.split(cols, bounds)):
+            if len(c):
+                per_target[int(c[0])] = r.tolist()
+        return per_target
+
+def fuzzy_recall_allowed(cond: Dict[str, str], weighted: bool) -> bool:
+    """
+    该 fuzzy 条件能否只对 TF-IDF 召回的候选评分（非候选记 0 分）：
+    - cutoff=true：逐一评分时低于阈值本就记 0，召回不改变分数（auto 与 tfidf）
+    - FUZZY_MATCHER=tfidf 且组合模式为 AND/OR：命中不依赖低分，但 _score_all 少计非候选的低分（显式开启）
+    WEIGHTED 下总分依赖低分，未设 cutoff 的条件始终逐一评分。
+    """
+    if parse_options(cond.get("options", "")).get("cutoff", "").lower() == "true":
+        return True
+    return str(FUZZY_MATCHER).lower() == "tfidf" and not weighted
+
+def compile_fuzzy_groups(conditions: List[Dict[str, str]], weighted: bool = False) -> Dict:
+    """
+    同列可召回（fuzzy_recall_allowed）的 fuzzy 条件数达到 TFIDF_MIN_TARGETS（且 FUZZY_MATCHER 不为 exact、已安装 scipy）时，
+    为该列构造 TF-IDF 候选索引：
+      {列名: {"index": NgramTfidfIndex, "slot": {条件id: 目标下标}}}
+    """
+    if str(FUZZY_MATCHER).lower() == "exact" or not module_installed("scipy"):
+        return {}
+    by_col: Dict[str, List[Dict[str, str]]] = {}
+    for cond in conditions:
+        if cond["type"] == "fuzzy" and cond["operator"] == "similar" and fuzzy_recall_allowed(cond, weighted):
+            by_col.setdefault(cond["column"], []).append(cond)
+    groups = {}
+    for col, conds in by_col.items():
+        if len(conds) < TFIDF_MIN_TARGETS:
+            continue
+        targets: Dict[str, int] = {}
+        slot = {id(c): targets.setdefault(normalize_text(c["value"]), len(targets)) for c in conds}
+        groups[col] = {"index": NgramTfidfIndex(list(targets)), "slot": slot}
+    return groups
+
+def fuzzy_candidate_scores(group: Dict, conditions: List[Dict[str, str]], values: List[str], memo: Optional[SimilarityMemo] = None) -> Dict[int, Tuple]:
+    """
+    对一列的去重规范化取值做 TF-IDF top-k 召回，再只对候选按各条件的评分器（scorer/cutoff）精确评分。
+    返回：
+      条件id → (候选取值下标数组, 相似度数组)；非候选取值相似度按 0 计
+    """
+    import numpy as np  # type: ignore
+    index = group["index"]
+    per_target = index.candidates(values, TFIDF_TOP_K)
+    out = {}
+    for cond in conditions:
+        j = group["slot"].get(id(cond))
+        if j is None or id(cond) in out:
+            continue
+        th_raw = cond.get("threshold", "")
+        th = (float(th_raw[:-1]) / 100.0 if th_raw.endswith("%") else float(th_raw)) if th_raw else 0.0
+        scorer, cutoff = condition_scorer(parse_options(cond.get("options", "")), th)
+        pos = per_target[j]
+        scores = score_distinct([values[i] for i in pos], index.targets[j], memo, scorer, cutoff)
+        out[id(cond)] = (np.asarray(pos, dtype=np.int64), np.asarray([scores[values[i]] for i in pos], dtype=np.float64))
+    return out
+
+def number_interval(op: str, val: str) -> Tuple[float, float]:
+    """
+    number 条件对应的闭区间 [下界, 上界]：between→[lo, hi]，min→[lo, +inf]，max→[-inf, hi]，equals→[eq, eq]。
+    取值非法时抛出异常（与逐条评估时相同）。
+    """
+    if op == "between":
+        parts = val.replace(" ","").split("-")
+        return float(parts[0]), float(parts[1])
+    if op == "min":
+        return float(val), float("inf")
+    if op == "max":
+        return float("-inf"), float(val)
+    if op == "equals":
+        return float(val), float(val)
+    raise ValueError(f"未知 number 运算符：{op}")
+
+def compile_numeric_intervals(conditions: List[Dict[str, str]]) -> Dict:
+    """
+    把同列全部 number 条件合并为一次有序区间查找：
+    - 各条件区间的端点去重排序为 points；取值按 searchsorted 落到“某端点上”（编码 2i+1）或“两端点之间的开区间”（编码 2i）
+    - 同一编码内所有取值对每个条件的真值相同，预先算好真值表 table[编码, 条件]；最后一行全 False，供非数值（NaN）使用
+    - 取值非法的条件不纳入（评估时按原逻辑报错并跳过）
+    返回：
+      {列名: {"points": 端点数组, "table": 真值表, "slot": {条件id: 真值表列号}}}
+    """
+    import numpy as np  # type: ignore
+    by_col: Dict[str, List[Tuple[int, float, float]]] = {}
+    for cond in conditions:
+        if cond["type"] != "number":
+            continue
+        try:
+            lo, hi = number_interval(cond["operator"], cond["value"])
+        except Exception:
+            continue
+        by_col.setdefault(cond["column"], []).append((id(cond), lo, hi))
+    out = {}
+    for col, items in by_col.items():
+        points = np.unique(np.array([b for _, lo, hi in items for b in (lo, hi)], dtype=np.float64))
+        # 每个编码取一个代表值：端点本身，或紧邻端点的开区间内部点
+        reps = np.empty(2 * len(points) + 1, dtype=np.float64)
+        reps[1::2] = points
+        reps[0] = np.nextafter(points[0], -np.inf)
+        reps[2::2] = np.nextafter(points, np.inf)
+        table = np.zeros((len(reps) + 1, len(items)), dtype=bool)
+        for j, (_, lo, hi) in enumerate(items):
+            table[:-1, j] = (reps >= lo) & (reps <= hi)
+        out[col] = {"points": points, "table": table, "slot": {cid: j for j, (cid, _, _) in enumerate(items)}}
+    return out
+
+def numeric_interval_codes(values, points):
+    """
+    float64 取值数组 → 区间编码（见 compile_numeric_intervals）；NaN 编为真值表最后一行。
+    """
+    import numpy as np  # type: ignore
+    i = np.searchsorted(points, values, side="left")
+    on_point = np.zeros(len(values), dtype=bool)
+    inside = i < len(points)
+    on_point[inside] = points[i[inside]] == values[inside]
+    codes = 2 * i + on_point
+    codes[np.isnan(values)] = 2 * len(points) + 1
+    return codes
+
+def compile_condition_plan(conditions: List[Dict[str, str]]) -> Dict:
+    """
+    预编译条件计划（与数据块无关，可在多个块/多个任务间复用）：
+    - contains：同列 text contains 合并后的大regex（见 compile_text_operations）
+    - regex：regex match 条件的预编译结果（按条件对象 id 索引；非法正则记为 None）
+    - regex_sets：同列 regex match 条件的多模式集合（见 compile_regex_sets；首次 pandas 评估时才构建）
+    - affix：同列 text startswith/endswith 条件的前缀/后缀索引（见 compile_affix_indexes；首次 pandas 评估时才构建）
+    - numeric：同列 number 条件合并的有序区间真值表（见 compile_numeric_intervals；首次 pandas 评估时才构建）
+    - fuzzy_groups：同列大批 fuzzy 条件的 TF-IDF 候选索引（按是否 WEIGHTED 分别缓存，见 compile_fuzzy_groups；首次 pandas 评估时才构建）
+    - optimized：按组合模式缓存的条件优化结果（见 optimized_condition_plan；首次执行任务时才写入）
+    返回：
+      {"conditions": 条件列表, "contains": {...}, "regex": {...}, "regex_sets": {...}, "numeric": {...}, "fuzzy_groups": {...}}
     """
-    # 预编译contains大regex
-    contains_compiled = compile_text_operations(pd, df, conditions)
-    # 预编译regex匹配
     regex_compiled = {}
     for cond in conditions:
         if cond["type"]=="regex" and cond["operator"]=="match" and cond["value"]:
@@ -324,7 +1548,193 @@ def eval_conditions_block(pd, df, conditions: List[Dict[str, str]], combine_mode
                 regex_compiled[id(cond)] = re.compile(cond["value"])
             except Exception:
                 regex_compiled[id(cond)] = None
-    # 抽取编码列（如有）
+    return {
+        "conditions": conditions,
+        "contains": compile_text_operations(None, None, conditions),
+        "regex": regex_compiled,
+        "regex_sets": None,
+        "affix": None,
+        "numeric": None,
+        "fuzzy_groups": None,
+    }
+
+# 条件优化（OPTIMIZE_CONDITIONS）的相对成本：每行、每条条件的大致评估开销（fuzzy 需逐值评分，最贵），用于优化前后的成本估算
+CONDITION_COSTS = {"fuzzy": 40.0, "regex": 4.0, "text/contains": 4.0, "text": 2.0, "code": 1.0, "number": 1.0, "enum": 1.0, "boolean": 1.0}
+# 取值为 true/false 的选项：缺省即 false，折叠时去掉值为 false 的项
+BOOLEAN_OPTIONS = ("ignore_case", "normalize", "code_prefer")
+
+def condition_cost(cond: Dict[str, str]) -> float:
+    return CONDITION_COSTS.get(f"{cond['type']}/{cond['operator']}", CONDITION_COSTS.get(cond["type"], 1.0))
+
+def fold_condition(cond: Dict[str, str]) -> Dict[str, str]:
+    """
+    折叠条件中的常量写法（不改变评估结果）：
+    - options：布尔选项统一为小写 true，值为 false 的去掉（与缺省相同），其余键按名称排序
+    - threshold：百分数写法（如 85%）换算为小数
+    返回新的条件字典（未变化时返回原对象）。
+    """
+    opts = parse_options(cond.get("options", ""))
+    for k in BOOLEAN_OPTIONS:
+        if k in opts:
+            if opts[k].lower() == "true":
+                opts[k] = "true"
+            elif opts[k].lower() == "false":
+                del opts[k]
+    options = ";".join(f"{k}={opts[k]}" for k in sorted(opts))
+    th = cond.get("threshold", "")
+    if th.endswith("%"):
+        try:
+            th = repr(float(th[:-1]) / 100.0)
+        except ValueError:
+            th = cond.get("threshold", "")
+    if options == cond.get("options", "") and th == cond.get("threshold", ""):
+        return cond
+    return dict(cond, options=options, threshold=th)
+
+def optimize_conditions(conditions: List[Dict[str, str]], combine_mode: str) -> Tuple[List[Dict[str, str]], Dict]:
+    """
+    执行前对条件集做静态优化（命中结果与原条件集一致）：
+    - 折叠常量选项（fold_condition），使等价写法的条件可以合并
+    - 合并重复条件（列、类型、运算符、取值、阈值、选项均相同）：AND/OR 下只保留第一条；WEIGHTED 下权重累加到第一条
+    - 移除被覆盖的条件（同列、编码相同）：OR 下 code/equals 已被 code_prefer 的 fuzzy 覆盖（后者编码相同即命中），移除 code/equals；
+      AND 下 code/equals 比该 fuzzy 更严格，移除 fuzzy
+    - AND/OR 下同列、同选项的全部 text contains 本就按“任一词命中”合并评估，合为一条，词表（去重）记在 _tokens
+    WEIGHTED 下不移除、不合并 contains（各条件分数都计入总分）。AND/OR 下被合并/移除的条件不再计入 _score_all（分数可能变小），因此默认不启用。
+    返回：
+      (优化后的条件列表（无变化时为原列表）, 报告 {"before","after","cost_before","cost_after","folded","duplicates","subsumed","contains_merged"})
+    """
+    mode = str(combine_mode or "OR").upper()
+    weighted = mode not in ("AND", "OR")
+    report = {"before": len(conditions), "cost_before": sum(condition_cost(c) for c in conditions), "folded": 0, "duplicates": 0, "subsumed": 0, "contains_merged": 0}
+    folded = [fold_condition(c) for c in conditions]
+    report["folded"] = sum(1 for a, b in zip(conditions, folded)
+                           if a.get("threshold", "") != b.get("threshold", "") or parse_options(a.get("options", "")) != parse_options(b.get("options", "")))
+    # 重复条件
+    out: List[Dict[str, str]] = []
+    seen: Dict[Tuple, int] = {}
+    for cond in folded:
+        key = tuple(cond.get(k, "") for k in ("column", "type", "operator", "value", "threshold", "options"))
+        j = seen.get(key)
+        if j is None:
+            seen[key] = len(out)
+            out.append(cond)
+            continue
+        if weighted and cond["type"] == "text" and cond["operator"] == "contains":
+            out.append(cond)
+            continue
+        report["duplicates"] += 1
+        if weighted:
+            w = float(out[j].get("weight", "1") or "1") + float(cond.get("weight", "1") or "1")
+            out[j] = dict(out[j], weight=repr(w))
+    if not weighted:
+        # 编码覆盖：(列, 编码) → 条件
+        codes = {(c["column"], re.sub(r"[^0-9]", "", c["value"])) for c in out if c["type"] == "code" and c["operator"] == "equals"}
+        preferred = {(c["column"], extract_code(c["value"])) for c in out
+                     if c["type"] == "fuzzy" and c["operator"] == "similar" and parse_options(c.get("options", "")).get("code_prefer") == "true"}
+        covered = {k for k in codes & preferred if k[1]}
+        def subsumed(c: Dict[str, str]) -> bool:
+            if mode == "OR":
+                return c["type"] == "code" and c["operator"] == "equals" and (c["column"], re.sub(r"[^0-9]", "", c["value"])) in covered
+            return (c["type"] == "fuzzy" and c["operator"] == "similar" and parse_options(c.get("options", "")).get("code_prefer") == "true"
+                    and (c["column"], extract_code(c["value"])) in covered)
+        kept = [c for c in out if not subsumed(c)]
+        report["subsumed"] = len(out) - len(kept)
+        # 同列 contains 合并（该列只有一组选项、且词均非空时）
+        by_col: Dict[str, List[Dict[str, str]]] = {}
+        for c in kept:
+            if c["type"] == "text" and c["operator"] == "contains":
+                by_col.setdefault(c["column"], []).append(c)
+        first = {}
+        for col, conds in by_col.items():
+            if len(conds) < 2 or len({c.get("options", "") for c in conds}) > 1 or not all(c["value"] for c in conds):
+                continue
+            tokens = list(dict.fromkeys(t for c in conds for t in (c.get("_tokens") or [c["value"]])))
+            first[id(conds[0])] = dict(conds[0], _tokens=tokens)
+            report["contains_merged"] += len(conds) - 1
+            for c in conds[1:]:
+                first[id(c)] = None
+        out = [first.get(id(c), c) for c in kept if first.get(id(c), c) is not None]
+    report["after"] = len(out)
+    report["cost_after"] = sum(condition_cost(c) for c in out)
+    if not (report["folded"] or report["duplicates"] or report["subsumed"] or report["contains_merged"]):
+        return conditions, report
+    return out, report
+
+def describe_condition_optimization(report: Dict) -> str:
+    before, after = report["cost_before"], report["cost_after"]
+    if report["before"] == report["after"] and not report["folded"] and not report["duplicates"]:
+        return f"条件优化：无可合并或移除的条件（{report['before']} 条，估算成本 {before:g} 单位/行）"
+    saved = f"（-{(before - after) / before:.0%}）" if before > 0 and after < before else ""
+    return (f"条件优化：{report['before']} → {report['after']} 条，估算成本 {before:g} → {after:g} 单位/行{saved}；"
+            f"合并重复 {report['duplicates']}，移除被覆盖 {report['subsumed']}，合并 contains {report['contains_merged']}，折叠选项 {report['folded']}")
+
+def optimized_condition_plan(conditions: List[Dict[str, str]], plan: Optional[Dict], combine_mode: str, write_audit: bool = False, log=print) -> Tuple[List[Dict[str, str]], Optional[Dict]]:
+    """
+    按组合模式取优化后的条件列表与预编译计划（optimize_conditions）；结果缓存在 plan 中（按组合模式），跨任务复用的计划只优化一次。
+    写出审计列时审计列按原条件编号输出，不做优化。
+    """
+    if write_audit:
+        log("提示：写出审计列时按原条件编号输出，不做条件优化")
+        return conditions, plan
+    mode = str(combine_mode or "OR").upper()
+    cache = plan.setdefault("optimized", {}) if plan is not None else {}
+    entry = cache.get(mode)
+    if entry is None:
+        reduced, report = optimize_conditions(conditions, mode)
+        entry = cache[mode] = (reduced, plan if reduced is conditions else compile_condition_plan(reduced), report)
+    reduced, reduced_plan, report = entry
+    log(describe_condition_optimization(report))
+    return reduced, reduced_plan
+
+def text_column(pd, df, column: str):
+    """
+    取出用于文本比较的列：已是字符串类型（如 pyarrow 后端产出的 Arrow 字符串列）时直接使用，
+    否则按原逻辑 astype(str)；缺列返回空串列。
+    """
+    if column not in df.columns:
+        return pd.Series([""]*len(df))
+    s = df[column]
+    if isinstance(s.dtype, pd.StringDtype):
+        return s.fillna("")
+    return s.astype(str).fillna("")
+
+def eval_conditions_block(pd, df, conditions: List[Dict[str, str]], combine_mode: str, combine_threshold: float, write_audit: bool, memo: Optional[SimilarityMemo] = None, plan: Optional[Dict] = None) -> Tuple:
+    """
+    对一个数据块（DataFrame）执行条件评估（向量化）：
+    - 预编译 text contains 与 regex（传入 plan 时直接复用，见 compile_condition_plan）
+    - number/enum/boolean/code：广播比较或集合匹配
+    - fuzzy：优先 rapidfuzz；否则退化为 normalize+contains（相对更快）；
+      仅对块内去重后的规范化取值评分，并通过 memo（相似度缓存）跨运行复用结果
+    - 组合：AND/OR/WEIGHTED，生成 _match_all 与 _score_all
+    - 审计列：可选输出每条件的命中与分数与描述，便于回溯
+    返回：
+      (更新后的df, 审计列名列表)
+    """
+    # 预编译contains大regex与regex匹配（未传入计划时按当前条件即时编译）
+    if plan is None or plan.get("conditions") is not conditions:
+        plan = compile_condition_plan(conditions)
+    contains_compiled = plan["contains"]
+    regex_sets = plan.get("regex_sets")
+    if regex_sets is None:
+        regex_sets = plan["regex_sets"] = compile_regex_sets(conditions)
+    regex_hits = {}  # 列 → (取值编码, 命中矩阵)（同列全部 regex 条件对去重取值一次扫描，每块每列只算一次）
+    affix = plan.get("affix")
+    if affix is None:
+        affix = plan["affix"] = compile_affix_indexes(conditions)
+    affix_values = {}  # 列 → [取值编码, 去重取值, 转小写的去重取值]（每块每列只去重、转小写一次）
+    affix_hits = {}  # (列, (运算符, 是否忽略大小写)) → 命中矩阵（同列同运算符的全部条件一次得到）
+    numeric = plan.get("numeric")
+    if numeric is None:
+        numeric = plan["numeric"] = compile_numeric_intervals(conditions)
+    numeric_hits = {}  # 列 → 命中矩阵 [行数, 条件数]（每块每列只解析一次数值、做一次 searchsorted）
+    weighted = combine_mode not in ("AND", "OR")
+    if plan.get("fuzzy_groups") is None:
+        plan["fuzzy_groups"] = {}
+    fuzzy_groups = plan["fuzzy_groups"].get(weighted)
+    if fuzzy_groups is None:
+        fuzzy_groups = plan["fuzzy_groups"][weighted] = compile_fuzzy_groups(conditions, weighted)
+    fuzzy_candidates = {}  # 列 → (取值编码, 去重取值数, 条件id → 候选评分)（TF-IDF 召回 + 精确复评，每块每列只算一次）
+    # 抽取编码列（如有）
     code_cache = {}
     def get_code_series(column: str):
         s = code_cache.get(column)
@@ -332,6 +1742,14 @@ def eval_conditions_block(pd, df, conditions: List[Dict[str, str]], combine_mode
             s = df[column].astype(str).fillna("").map(extract_code) if column in df.columns else pd.Series([""]*len(df))
             code_cache[column] = s
         return s
+    # 规范化列缓存（同列多条fuzzy条件只规范化一次）
+    norm_cache = {}
+    def get_norm_series(column: str, series):
+        s = norm_cache.get(column)
+        if s is None:
+            s = series.map(normalize_text)
+            norm_cache[column] = s
+        return s
     # 分数与命中
     total_score = pd.Series([0.0]*len(df))
     any_hit = pd.Series([False]*len(df))
@@ -347,7 +1765,7 @@ def eval_conditions_block(pd, df, conditions: List[Dict[str, str]], combine_mode
         th_raw = cond.get("threshold","")
         w = float(cond.get("weight","1") or "1")
         opts = parse_options(cond.get("options",""))
-        series = df[col].astype(str).fillna("") if col in df.columns else pd.Series([""]*len(df))
+        series = text_column(pd, df, col)
         hit = pd.Series([False]*len(df))
         score = pd.Series([0.0]*len(df))
         try:
@@ -365,6 +1783,19 @@ def eval_conditions_block(pd, df, conditions: List[Dict[str, str]], combine_mode
                     else:
                         hit = series.str.contains(re.escape(val), case=not opts.get("ignore_case","").lower()=="true", na=False)
                         score = hit.astype(float)
+                elif op in ("startswith", "endswith") and id(cond) in affix.get(col, {}).get("slot", {}):
+                    key, j = affix[col]["slot"][id(cond)]
+                    matrix = affix_hits.get((col, key))
+                    values = affix_values.get(col)
+                    if values is None:
+                        codes, uniques = pd.factorize(series)
+                        values = affix_values[col] = [codes, pd.Series(uniques), None]
+                    if matrix is None:
+                        if key[1] and values[2] is None:
+                            values[2] = values[1].str.lower()
+                        matrix = affix_hits[(col, key)] = affix[col]["indexes"][key].matrix(pd, values[2] if key[1] else values[1])
+                    hit = pd.Series(matrix[values[0], j], index=df.index)
+                    score = hit.astype(float)
                 elif op == "startswith":
                     scomp = series if not opts.get("ignore_case","").lower()=="true" else series.str.lower()
                     target = val if not opts.get("ignore_case","").lower()=="true" else val.lower()
@@ -379,6 +1810,14 @@ def eval_conditions_block(pd, df, conditions: List[Dict[str, str]], combine_mode
                 items = [x.strip() for x in val.split(";") if x.strip()]
                 hit = series.isin(items)
                 score = hit.astype(float)
+            elif typ == "number" and id(cond) in numeric.get(col, {}).get("slot", {}):
+                group = numeric[col]
+                matrix = numeric_hits.get(col)
+                if matrix is None:
+                    values = pd.to_numeric(series, errors="coerce").to_numpy(dtype="float64", na_value=float("nan"))
+                    matrix = numeric_hits[col] = group["table"][numeric_interval_codes(values, group["points"])]
+                hit = pd.Series(matrix[:, group["slot"][id(cond)]], index=df.index)
+                score = hit.astype(float)
             elif typ == "number":
                 s_num = pd.to_numeric(series, errors="coerce")
                 if op == "between":
@@ -398,9 +1837,14 @@ def eval_conditions_block(pd, df, conditions: List[Dict[str, str]], combine_mode
                 hit = (s_bool == truth)
                 score = hit.astype(float)
             elif typ == "regex" and op == "match":
-                creg = regex_compiled.get(id(cond))
-                if creg:
-                    hit = series.str.contains(creg, na=False)
+                rset = regex_sets.get(col)
+                if rset is not None and id(cond) in rset["slot"]:
+                    cached = regex_hits.get(col)
+                    if cached is None:
+                        codes, uniques = pd.factorize(series)
+                        cached = regex_hits[col] = (codes, rset["set"].match(list(uniques)))
+                    codes, matrix = cached
+                    hit = pd.Series(matrix[:, rset["slot"][id(cond)]][codes], index=df.index)
                     score = hit.astype(float)
             elif typ == "code" and op == "equals":
                 s_code = get_code_series(col)
@@ -422,21 +1866,28 @@ def eval_conditions_block(pd, df, conditions: List[Dict[str, str]], combine_mode
                     need_sim = (~hit_code)
                 else:
                     need_sim = pd.Series([True]*len(df))
-                # 相似：优先使用rapidfuzz，否则退化为normalize+contains
-                try:
-                    from rapidfuzz import fuzz  # type: ignore
-                    s_norm = series.map(normalize_text)
-                    tgt_norm = normalize_text(val)
-                    sim = s_norm.map(lambda x: (fuzz.token_set_ratio(x, tgt_norm)/100.0))
-                    hit_sim = sim >= th
-                    score = (score.where(~need_sim, sim)).fillna(sim)
-                    hit = hit | hit_sim
-                except Exception:
-                    s_norm = series.map(normalize_text)
-                    tgt_norm = normalize_text(val)
-                    hit_sim = s_norm.str.contains(re.escape(tgt_norm), na=False)
-                    score = (score.where(~need_sim, hit_sim.astype(float))).fillna(hit_sim.astype(float))
-                    hit = hit | hit_sim
+                # 相似：优先使用rapidfuzz，否则退化为normalize+contains；按去重取值评分并查缓存
+                s_norm = get_norm_series(col, series)
+                tgt_norm = normalize_text(val)
+                group = fuzzy_groups.get(col)
+                if group is not None and id(cond) in group["slot"]:
+                    import numpy as np  # type: ignore
+                    cached = fuzzy_candidates.get(col)
+                    if cached is None:
+                        codes, uniques = pd.factorize(s_norm)
+                        uniques = list(uniques)
+                        cached = fuzzy_candidates[col] = (codes, len(uniques), fuzzy_candidate_scores(group, conditions, uniques, memo))
+                    codes, n_uniques, cand = cached
+                    pos, scores = cand[id(cond)]
+                    sim_by_value = np.zeros(n_uniques, dtype=np.float64)
+                    sim_by_value[pos] = scores
+                    sim = pd.Series(sim_by_value[codes], index=df.index)
+                else:
+                    scorer, cutoff = condition_scorer(opts, th)
+                    sim = s_norm.map(score_distinct(s_norm.unique(), tgt_norm, memo, scorer, cutoff))
+                hit_sim = sim >= th
+                score = (score.where(~need_sim, sim)).fillna(sim)
+                hit = hit | hit_sim
             # 组合
             any_hit = any_hit | hit
             all_hit = all_hit & hit
@@ -454,155 +1905,4338 @@ def eval_conditions_block(pd, df, conditions: List[Dict[str, str]], combine_mode
     elif combine_mode == "OR":
         match_all = any_hit
     else:
-        match_all = total_score >= COMBINE_THRESHOLD
+        match_all = total_score >= combine_threshold
     df["_match_all"] = match_all
     df["_score_all"] = total_score.round(4)
     return df, audit_cols
 
-def write_output(pd, df, out_path: str, append: bool, dedup: bool, dedup_key: Optional[str], major_col: str) -> str:
+def excel_writer_backend(name: Optional[str] = None) -> str:
+    """
+    解析 Excel 写出方式：auto → 已安装 xlsxwriter 时用 xlsxwriter，否则 openpyxl。
+    """
+    name = (name or EXCEL_WRITER or "auto").lower()
+    if name == "auto":
+        return "xlsxwriter" if module_installed("xlsxwriter") else "openpyxl"
+    if name not in ("xlsxwriter", "openpyxl"):
+        raise ValueError(f"未知的 Excel 写出方式：{name}")
+    return name
+
+def excel_part_path(out_path: str, part: int) -> str:
+    """
+    按文件续写时第 part 个分卷的路径：第1卷为 out_path，其后为 <名称>_part2.xlsx、<名称>_part3.xlsx…
+    """
+    if part <= 1:
+        return out_path
+    stem, ext = os.path.splitext(out_path)
+    return f"{stem}_part{part}{ext}"
+
+class ExcelSink:
+    """
+    流式 Excel 写出：按块接收 DataFrame 并逐行写入（xlsxwriter 常量内存模式 / openpyxl 只写模式），内存只与块大小有关。
+    - 列在构造时确定，表头只写一次；后续块按列名对齐，缺列留空
+    - 列格式（日期时间）在每个工作表上按列设置一次，单元格不再逐个带格式
+    - 单表达到 max_rows（含表头）时自动续写：split="sheet" 新增工作表 Sheet1_part2…；split="file" 新文件 <名称>_part2.xlsx…
+    - close() 返回写出的文件列表（首个为 out_path）；按文件续写时删除上次遗留的多余分卷
+    """
+    SHEET = "Sheet1"
+    DATETIME_FORMAT = "yyyy-mm-dd hh:mm:ss"
+
+    def __init__(self, out_path: str, columns: List, split: Optional[str] = None, max_rows: Optional[int] = None, backend: Optional[str] = None):
+        self.out_path = out_path
+        self.columns = list(columns)
+        self.split = (split or EXCEL_SPLIT or "sheet").lower()
+        self.max_rows = max(int(max_rows or EXCEL_MAX_ROWS), 2)
+        self.backend = excel_writer_backend(backend)
+        self.files: List[str] = []
+        self.part = 0
+        self.rows = 0
+        self.book = None
+        self.sheet = None
+        self.row = 0
+        self.formats = None
+        self.datetime_cols = set()
+
+    def _close_book(self) -> None:
+        if self.book is None:
+            return
+        if self.backend == "xlsxwriter":
+            self.book.close()
+        else:
+            self.book.save(self.files[-1])
+        self.book = None
+
+    def _new_part(self) -> None:
+        self.part += 1
+        if self.book is None or self.split == "file":
+            self._close_book()
+            path = excel_part_path(self.out_path, self.part if self.split == "file" else 1)
+            if self.backend == "xlsxwriter":
+                import xlsxwriter  # type: ignore
+                self.book = xlsxwriter.Workbook(path, {
+                    "constant_memory": True, "strings_to_formulas": False, "strings_to_urls": False,
+                    "strings_to_numbers": False, "nan_inf_to_errors": True, "default_date_format": self.DATETIME_FORMAT,
+                })
+                self.formats = {
+                    "header": self.book.add_format({"bold": True, "border": 1, "align": "center"}),
+                    "datetime": self.book.add_format({"num_format": self.DATETIME_FORMAT}),
+                }
+            else:
+                from openpyxl import Workbook  # type: ignore
+                self.book = Workbook(write_only=True)
+            self.files.append(path)
+        name = self.SHEET if self.split == "file" or self.part == 1 else f"{self.SHEET}_part{self.part}"
+        header = [str(c) for c in self.columns]
+        if self.backend == "xlsxwriter":
+            self.sheet = self.book.add_worksheet(name)
+            for c in self.datetime_cols:
+                self.sheet.set_column(c, c, 19, self.formats["datetime"])
+            self.sheet.write_row(0, 0, header, self.formats["header"])
+        else:
+            from openpyxl.cell import WriteOnlyCell  # type: ignore
+            from openpyxl.styles import Font  # type: ignore
+            self.sheet = self.book.create_sheet(name)
+            cells = []
+            for h in header:
+                cell = WriteOnlyCell(self.sheet, value=h)
+                cell.font = Font(bold=True)
+                cells.append(cell)
+            self.sheet.append(cells)
+        self.row = 1
+
+    def _column_values(self, pd, s):
+        # 返回 (类型, 值列表)；空值为 None（数值列保留 NaN，写出时跳过）
+        if not pd.api.types.is_extension_array_dtype(s) and s.dtype.kind == "f":
+            inf = s.isin([float("inf"), float("-inf")])
+            if inf.any():
+                # 与 to_excel 的 inf_rep 一致：无穷大写为文本 inf / -inf
+                s = s.astype(object).where(~inf, s.map(lambda v: "inf" if v > 0 else "-inf"))
+        if self.backend == "xlsxwriter":
+            if not pd.api.types.is_extension_array_dtype(s) and s.dtype.kind == "b":
+                return "bool", s.tolist()
+            if not pd.api.types.is_extension_array_dtype(s) and s.dtype.kind in "fiu":
+                return "number", s.tolist()
+            if pd.api.types.is_datetime64_any_dtype(s):
+                if getattr(s.dt, "tz", None) is not None:
+                    s = s.dt.tz_localize(None)
+                # 1900-03-01 之后的日期直接换算为 Excel 序列值（按列格式显示），更早的日期交给 write_datetime 处理闰年差异
+                if not (s.min() < pd.Timestamp("1900-03-01")):
+                    return "datetime", ((s - pd.Timestamp("1899-12-30")) / pd.Timedelta(days=1)).tolist()
+                return "datetime_obj", s.astype(object).where(s.notna(), None).tolist()
+        vals = s.astype(object).where(s.notna(), None).tolist()
+        if self.backend == "openpyxl" and (s.dtype.kind in "OU" or pd.api.types.is_string_dtype(s)):
+            # openpyxl 会把 "=" 开头的文本当作公式写出，需逐个改为文本单元格
+            if any(isinstance(v, str) and v.startswith("=") for v in vals):
+                return "text_eq", vals
+        return "any", vals
+
+    def _writers(self, kinds):
+        ws = self.sheet
+        def write_any(r, c, v):
+            try:
+                ws.write(r, c, v)
+            except TypeError:
+                ws.write_string(r, c, str(v))
+        dt_fmt = self.formats["datetime"]
+        out = []
+        for c, kind in enumerate(kinds):
+            if kind == "number":
+                out.append(ws.write_number)
+            elif kind == "bool":
+                out.append(ws.write_boolean)
+            elif kind == "datetime":
+                out.append(ws.write_number if c in self.datetime_cols else (lambda r, c, v: ws.write_number(r, c, v, dt_fmt)))
+            elif kind == "datetime_obj":
+                out.append(ws.write_datetime if c in self.datetime_cols else (lambda r, c, v: ws.write_datetime(r, c, v, dt_fmt)))
+            else:
+                out.append(write_any)
+        return out
+
+    def write(self, pd, df) -> None:
+        """
+        写入一个块（按构造时的列对齐）。
+        """
+        if list(df.columns) != self.columns:
+            df = df.reindex(columns=self.columns)
+        kinds, cols = [], []
+        for i in range(len(self.columns)):
+            kind, vals = self._column_values(pd, df.iloc[:, i])
+            kinds.append(kind)
+            cols.append(vals)
+        if self.book is None:
+            # 日期时间列格式按首块确定，每个工作表设置一次
+            self.datetime_cols = {c for c, kind in enumerate(kinds) if kind in ("datetime", "datetime_obj")}
+            self._new_part()
+        n = len(df)
+        pos = 0
+        while pos < n:
+            if self.row >= self.max_rows:
+                self._new_part()
+            take = min(n - pos, self.max_rows - self.row)
+            rows = zip(*(col[pos:pos + take] for col in cols)) if cols else ((),) * take
+            if self.backend == "xlsxwriter":
+                writers = self._writers(kinds)
+                r = self.row
+                for vals in rows:
+                    for c, v in enumerate(vals):
+                        if v is not None and v == v:
+                            writers[c](r, c, v)
+                    r += 1
+            else:
+                append = self.sheet.append
+                eq_cols = [c for c, kind in enumerate(kinds) if kind == "text_eq"]
+                if eq_cols:
+                    from openpyxl.cell import WriteOnlyCell  # type: ignore
+                for vals in rows:
+                    vals = list(vals)
+                    for c in eq_cols:
+                        v = vals[c]
+                        if isinstance(v, str) and v.startswith("="):
+                            cell = WriteOnlyCell(self.sheet, value=v)
+                            cell.data_type = "s"
+                            vals[c] = cell
+                    append(vals)
+            self.row += take
+            self.rows += take
+            pos += take
+
+    def close(self) -> List[str]:
+        """
+        完成写出，返回写出的文件列表。
+        """
+        if self.book is None:
+            self._new_part()
+        self._close_book()
+        if self.split == "file":
+            k = len(self.files) + 1
+            while os.path.exists(excel_part_path(self.out_path, k)):
+                os.remove(excel_part_path(self.out_path, k))
+                k += 1
+        return list(self.files)
+
+    def discard(self) -> None:
+        """
+        放弃写出：未完成的工作簿不落盘（原文件保持不变），删除已完成的分卷（写出失败降级 CSV 时调用）。
+        """
+        book, self.book = self.book, None
+        done = self.files[:-1] if book is not None else self.files
+        if book is not None and self.backend == "xlsxwriter":
+            book.fileclosed = True
+        for path in done:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def write_excel(pd, df, out_path: str, chunk_rows: Optional[int] = None, backend: Optional[str] = None) -> List[str]:
+    """
+    以 ExcelSink 分块写出整个 DataFrame（超出单表上限时自动续写），返回写出的文件列表；失败时清理已写分卷并抛出异常。
+    """
+    sink = ExcelSink(out_path, list(df.columns), backend=backend)
+    step = max(int(chunk_rows or CHUNK_SIZE or 50000), 1)
+    try:
+        for i in range(0, len(df), step):
+            sink.write(pd, df.iloc[i:i + step])
+        return sink.close()
+    except BaseException:
+        sink.discard()
+        raise
+
+def apply_output_format(path: str, fmt: Optional[str] = None) -> str:
+    """
+    按输出格式（默认 OUTPUT_FORMAT）替换输出文件扩展名：out.xlsx + csv.zst → out.csv.zst；未指定格式时原样返回。
+    """
+    fmt = (fmt if fmt is not None else OUTPUT_FORMAT) or ""
+    fmt = fmt.strip().lstrip(".").lower()
+    if not fmt:
+        return path
+    return os.path.splitext(split_compression(path)[0])[0] + "." + fmt
+
+def open_output_binary(path: str, codec: Optional[str]):
+    """
+    以二进制写方式打开输出文件，按编解码器流式压缩：
+    - zstd：zstandard 多线程压缩（ZSTD_LEVEL / ZSTD_THREADS），未安装时用 pyarrow 单线程压缩
+    - gzip / xz：标准库（单线程）
+    """
+    if codec == "zstd":
+        if module_installed("zstandard"):
+            import zstandard  # type: ignore
+            cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=ZSTD_THREADS or -1)
+            return cctx.stream_writer(open(path, "wb"))
+        import pyarrow as pa  # type: ignore
+        return pa.CompressedOutputStream(path, "zstd")
+    if codec == "gzip":
+        import gzip
+        return gzip.open(path, "wb")
+    if codec == "xz":
+        import lzma
+        return lzma.open(path, "wb")
+    return open(path, "wb")
+
+class CsvSink:
+    """
+    CSV 输出流式写入器（接口同 ExcelSink）：逐块追加，支持 .csv.gz / .csv.zst / .csv.xz 边写边压缩。
+    - 先写到 <输出>.part，close() 时替换目标文件，中途失败不会留下半个文件
+    - 编码 utf-8-sig（与整体 to_csv 的输出逐字节一致）
+    """
+    def __init__(self, out_path: str, columns: List[str]):
+        self.out_path = out_path
+        self.columns = list(columns)
+        self.tmp_path = out_path + ".part"
+        self.fh = open_output_binary(self.tmp_path, split_compression(out_path)[1])
+        self.started = False
+
+    def write(self, pd, df) -> None:
+        if df is None or (len(df) == 0 and self.started):
+            return
+        text = df.to_csv(index=False, header=not self.started)
+        self.fh.write(text.encode("utf-8" if self.started else "utf-8-sig"))
+        self.started = True
+
+    def close(self) -> List[str]:
+        if not self.started:
+            import pandas as pd  # type: ignore
+            self.write(pd, pd.DataFrame(columns=self.columns))
+        fh, self.fh = self.fh, None
+        fh.close()
+        os.replace(self.tmp_path, self.out_path)
+        return [self.out_path]
+
+    def discard(self) -> None:
+        fh, self.fh = self.fh, None
+        if fh is not None:
+            try:
+                fh.close()
+            except Exception:
+                pass
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+class ParquetSink:
+    """
+    Parquet 输出流式写入器（接口同 ExcelSink）：每块写为一个行组，列压缩为 zstd（ZSTD_LEVEL）。
+    - 表结构取自首块：全空列记为字符串；之后的块按该结构转换（字符串列中的数字等转为文本）
+    - 先写到 <输出>.part，close() 时替换目标文件
+    """
+    def __init__(self, out_path: str, columns: List[str]):
+        self.out_path = out_path
+        self.columns = [str(c) for c in columns]
+        self.tmp_path = out_path + ".part"
+        self.writer = None
+        self.schema = None
+
+    def _table(self, pd, df):
+        import pyarrow as pa  # type: ignore
+        df = df.copy()
+        df.columns = [str(c) for c in df.columns]
+        for c in df.columns:
+            field = self.schema.field(c) if self.schema is not None and c in self.schema.names else None
+            if field is not None:
+                textual = pa.types.is_string(field.type) or pa.types.is_large_string(field.type)
+            else:
+                textual = df[c].dtype == object
+            if textual:
+                df[c] = df[c].where(df[c].isna(), df[c].astype(str))
+        if self.schema is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            fields = [pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in table.schema]
+            self.schema = pa.schema(fields)
+            return table.cast(self.schema)
+        return pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+
+    def write(self, pd, df) -> None:
+        if df is None or (len(df) == 0 and self.writer is not None):
+            return
+        import pyarrow.parquet as pq  # type: ignore
+        table = self._table(pd, df)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.tmp_path, self.schema, compression="zstd", compression_level=ZSTD_LEVEL)
+        self.writer.write_table(table)
+
+    def close(self) -> List[str]:
+        if self.writer is None:
+            import pandas as pd  # type: ignore
+            self.write(pd, pd.DataFrame({c: pd.Series(dtype=object) for c in self.columns}))
+        writer, self.writer = self.writer, None
+        writer.close()
+        os.replace(self.tmp_path, self.out_path)
+        return [self.out_path]
+
+    def discard(self) -> None:
+        writer, self.writer = self.writer, None
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception:
+                pass
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+def open_table_sink(out_path: str, columns: List[str]):
+    """
+    按输出扩展名选择流式写入器：.xlsx→ExcelSink，.parquet→ParquetSink，其余（含 .csv.gz/.csv.zst/.csv.xz）→CsvSink；
+    .xls 不支持流式写入，返回 None（由调用方整体 to_excel）。
+    """
+    ext = os.path.splitext(split_compression(out_path)[0])[1].lower()
+    if ext == ".xlsx":
+        return ExcelSink(out_path, columns)
+    if ext == ".xls":
+        return None
+    if ext == ".parquet":
+        return ParquetSink(out_path, columns)
+    return CsvSink(out_path, columns)
+
+def write_table(pd, df, out_path: str, chunk_rows: Optional[int] = None) -> List[str]:
+    """
+    以 open_table_sink 选出的写入器分块写出整个 DataFrame，返回写出的文件列表；失败时清理并抛出异常。
+    """
+    sink = open_table_sink(out_path, list(df.columns))
+    if sink is None:
+        df.to_excel(out_path, index=False)
+        return [out_path]
+    step = max(int(chunk_rows or CHUNK_SIZE or 50000), 1)
+    try:
+        for i in range(0, len(df), step):
+            sink.write(pd, df.iloc[i:i + step])
+        return sink.close()
+    except BaseException:
+        sink.discard()
+        raise
+
+def read_output(pd, path: str):
+    """
+    读取既有输出（追加模式）：CSV（含压缩 CSV）与 Parquet 直接读取；Excel 读取首个工作表及续写的 <表名>_partN 工作表，
+    以及 <名称>_partN.xlsx 分卷，按顺序纵向合并。
+    """
+    ext = os.path.splitext(split_compression(path)[0])[1].lower()
+    if ext == ".parquet":
+        return pd.read_parquet(path)
+    if ext not in (".xlsx", ".xls"):
+        with open_input_binary(path) as fh:
+            return pd.read_csv(fh)
+    frames = []
+    part = 1
+    while os.path.exists(excel_part_path(path, part)):
+        sheets = pd.read_excel(excel_part_path(path, part), sheet_name=None)
+        names = list(sheets)
+        if not names:
+            break
+        frames.append(sheets[names[0]])
+        k = 2
+        while f"{names[0]}_part{k}" in sheets:
+            frames.append(sheets[f"{names[0]}_part{k}"])
+            k += 1
+        part += 1
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+def write_output(pd, df, out_path: str, append: bool, dedup: bool, dedup_key: Optional[str], major_col: str, metrics: Optional["RunMetrics"] = None, key: Optional[str] = None, staging_dir: Optional[str] = None) -> str:
     """
     写出结果（逐文件或合并）：
-    - 优先写 Excel（xlsx/xls），失败降级 CSV（utf-8-sig）
+    - 输出格式由扩展名决定，OUTPUT_FORMAT 可统一改写（见 apply_output_format）；写出失败降级 CSV（utf-8-sig）
+    - xlsx 经 ExcelSink 流式写出，超出单表行数上限时续写到 _part2…；CSV/压缩 CSV/Parquet 经 CsvSink/ParquetSink 分块写出
     - 去重：
       · 指定 DEDUP_KEY 且存在：按该列去重
       · 否则回退“规范化 Major + 编码”组合键（旧逻辑兼容）
     - 追加：
-      · APPEND=True 且文件存在：读取旧结果，与新结果合并后写出
+      · APPEND=True 且文件存在：读取旧结果（含续写分卷，见 read_output），与新结果合并后写出
+    - metrics/key：运行指标与对应的输入文件（合并输出为 None），去重与写出分别记为 dedup/write 阶段
+    - staging_dir：指定时（检查点任务）写入该暂存目录而不动原输出，由 JobCheckpoint.publish 移入输出目录
     返回：
-      最终写出的文件路径
+      最终写出的文件路径（暂存时为移入后的路径）
     """
-    out_path = resolve_path(out_path)
-    ext = os.path.splitext(out_path)[1].lower()
+    out_path = apply_output_format(resolve_path(out_path))
+    if staging_dir:
+        reset_staging_dir(staging_dir)
+    target = os.path.join(staging_dir, os.path.basename(out_path)) if staging_dir else out_path
     try:
         if dedup:
-            if dedup_key and dedup_key in df.columns:
-                df = df.drop_duplicates(subset=[dedup_key]).copy()
-            else:
-                key_series = df[major_col].astype(str).fillna("").map(normalize_text) if major_col in df.columns else pd.Series([""]*len(df))
-                code_series = df.get("_matched_code", pd.Series([""]*len(df)))
-                df["_dedup_key"] = key_series + "|" + code_series.astype(str)
-                df = df.drop_duplicates(subset=["_dedup_key"]).copy()
-                df.drop(columns=["_dedup_key"], inplace=True, errors="ignore")
-        if append and os.path.exists(out_path):
-            if ext in (".xlsx",".xls"):
-                old = pd.read_excel(out_path)
-            else:
-                old = pd.read_csv(out_path)
-            df = pd.concat([old, df], ignore_index=True)
-        if ext in (".xlsx",".xls"):
-            df.to_excel(out_path, index=False)
-        else:
-            df.to_csv(out_path, index=False, encoding="utf-8-sig")
+            with metric_span(metrics, "dedup", key, rows=len(df)):
+                if dedup_key and dedup_key in df.columns:
+                    df = df.drop_duplicates(subset=[dedup_key]).copy()
+                else:
+                    key_series = df[major_col].astype(str).fillna("").map(normalize_text) if major_col in df.columns else pd.Series([""]*len(df))
+                    code_series = df.get("_matched_code", pd.Series([""]*len(df)))
+                    df["_dedup_key"] = key_series + "|" + code_series.astype(str)
+                    df = df.drop_duplicates(subset=["_dedup_key"]).copy()
+                    df.drop(columns=["_dedup_key"], inplace=True, errors="ignore")
+        with metric_span(metrics, "write", key, rows=len(df)):
+            if append and os.path.exists(out_path):
+                old = read_output(pd, out_path)
+                df = pd.concat([old, df], ignore_index=True)
+            write_table(pd, df, target)
         return out_path
     except Exception:
-        csv_path = os.path.splitext(out_path)[0] + ".csv"
-        df.to_csv(csv_path, index=False, encoding="utf-8-sig")
+        csv_path = os.path.splitext(split_compression(out_path)[0])[0] + ".csv"
+        if staging_dir:
+            reset_staging_dir(staging_dir)
+        df.to_csv(os.path.join(staging_dir, os.path.basename(csv_path)) if staging_dir else csv_path, index=False, encoding="utf-8-sig")
         return csv_path
 
-def process_files():
+def default_job() -> Dict:
     """
-    主流程：
-    - 读取条件（CSV），为空则回退旧版（仅 Major）逻辑
-    - 遍历输入文件：
-      · 构造（文件, 工作表）帧列表
-      · 按帧分块读取（Excel/CSV）
-      · 对块执行条件评估并收集命中结果
-    - 写出逐文件结果与（可选）全量合并结果
-    - 输出总计处理行数与耗时
+    以顶部“配置区域”的常量构造一个筛选任务（字典），供 process_files 与服务模式使用。
+    字段：files, sheet, conditions, combine_mode, combine_threshold, out_dir, merge_out,
+          append, dedup, dedup_key, chunk_size, progress_step, write_audit, major_col, engine,
+          checkpoint, resume, sheet_column, events_out, metrics_out, trace_out,
+          profile_memory, memory_report, chunk_memory_mb, optimize_conditions
     """
-    pd = ensure_pandas()
-    # 条件加载或回退
-    conditions = []
-    if CONDITIONS_CSV:
+    return {
+        "files": list(EXCEL_FILES),
+        "sheet": SHEET,
+        "conditions": CONDITIONS_CSV,
+        "combine_mode": COMBINE_MODE,
+        "combine_threshold": COMBINE_THRESHOLD,
+        "out_dir": OUT_DIR,
+        "merge_out": MERGE_OUT,
+        "append": APPEND,
+        "dedup": DEDUP,
+        "dedup_key": DEDUP_KEY,
+        "chunk_size": CHUNK_SIZE,
+        "progress_step": PROGRESS_STEP,
+        "write_audit": WRITE_AUDIT_COLUMNS,
+        "major_col": MAJOR_COL,
+        "engine": ENGINE,
+        "checkpoint": CHECKPOINT,
+        "resume": RESUME,
+        "sheet_column": SHEET_COLUMN,
+        "events_out": METRICS_EVENTS,
+        "metrics_out": METRICS_PROM,
+        "trace_out": TRACE_FILE,
+        "profile_memory": PROFILE_MEMORY,
+        "memory_report": MEMORY_REPORT,
+        "chunk_memory_mb": CHUNK_MEMORY_MB,
+        "optimize_conditions": OPTIMIZE_CONDITIONS,
+    }
+
+def validate_job(job: Dict) -> List[str]:
+    """
+    在导入 pandas 之前校验任务配置（只做文件系统与取值检查，不读取数据）。
+    返回：
+      问题描述列表；为空表示可以执行（部分输入文件缺失仅在运行时跳过，全部缺失才报错）
+    """
+    errors = []
+    files = job.get("files") or []
+    if not files:
+        errors.append("未指定输入文件")
+    elif not any(os.path.exists(resolve_path(p)) for p in files):
+        errors.append("输入文件均不存在：" + ", ".join(files))
+    cond = job.get("conditions")
+    if cond and not os.path.exists(resolve_path(cond)):
+        errors.append(f"条件文件不存在：{resolve_path(cond)}")
+    if str(job.get("combine_mode") or "").upper() not in ("AND", "OR", "WEIGHTED"):
+        errors.append(f"不支持的组合模式：{job.get('combine_mode')}")
+    try:
+        th = float(job.get("combine_threshold", 0.8))
+        if not th >= 0.0:  # WEIGHTED 总分为 Σ score·weight（未归一化），大于 1 的阈值同样有效
+            errors.append(f"COMBINE_THRESHOLD 不能为负数：{th}")
+    except (TypeError, ValueError):
+        errors.append(f"COMBINE_THRESHOLD 不是数值：{job.get('combine_threshold')}")
+    try:
+        if int(job.get("chunk_size") or 0) <= 0:
+            errors.append("CHUNK_SIZE 必须为正整数")
+    except (TypeError, ValueError):
+        errors.append(f"CHUNK_SIZE 不是整数：{job.get('chunk_size')}")
+    if str(job.get("engine") or ENGINE).lower() not in ENGINES:
+        errors.append(f"不支持的执行引擎：{job.get('engine')}（可选：{'/'.join(ENGINES)}）")
+    elif str(job.get("engine") or ENGINE).lower() == "cluster" and cluster_exposure_error(CLUSTER_HOST, cluster_token()):
+        errors.append(cluster_exposure_error(CLUSTER_HOST, cluster_token()))
+    out_dir = job.get("out_dir")
+    if out_dir and not os.path.isdir(resolve_path(out_dir)):
+        errors.append(f"输出目录不存在：{resolve_path(out_dir)}")
+    return errors
+
+def estimate_total_rows(pth: str, sheet: str) -> int:
+    """
+    预估单个输入文件的总行数（用于进度占比）：CSV 统计行数；Excel 按工作表设置求和。
+    压缩 CSV 返回 0（不为计数解压整个文件），处理中按已读取的压缩字节占比外推。
+    """
+    try:
+        if input_format(pth) == "csv":
+            return 0 if split_compression(pth)[1] else total_rows_csv(pth)
+        if input_format(pth) == "parquet":
+            import pyarrow.parquet as pq  # type: ignore
+            return pq.ParquetFile(pth).metadata.num_rows
+        # 多帧时占比计算按全部帧求和
+        if sheet == "*" or (sheet and "," not in sheet and sheet.strip() != ""):
+            return total_rows_excel(pth, sheet if sheet else None)
+        # 多工作表名：逐名求和
+        sum_rows = 0
+        names = [x.strip() for x in sheet.split(",") if x.strip()] if sheet else [None]
+        for nm in names:
+            sum_rows += total_rows_excel(pth, nm)
+        return sum_rows
+    except Exception:
+        return 0
+
+def iter_file_chunks(pd, fp: str, sh: Optional[str], chunk_size: int) -> Iterable:
+    """
+    按文件类型选择分块读取器（CSV / Parquet / Excel），逐块产出 DataFrame。
+    """
+    if input_format(fp) == "csv":
+        return chunk_generator_from_csv(pd, fp, chunk_size)
+    if input_format(fp) == "parquet":
+        return chunk_generator_from_parquet(pd, fp, chunk_size)
+    return chunk_generator_from_excel(pd, fp, sh, chunk_size)
+
+def _prefetch_process_worker(q, fp: str, sh: Optional[str], chunk_size: int, settings: Tuple[str, str]) -> None:
+    """
+    预读子进程入口：按与主进程相同的CSV设置分块读取，经队列回传（队列满时阻塞，实现背压）。
+    """
+    global CSV_BACKEND, CSV_ENCODING
+    CSV_BACKEND, CSV_ENCODING = settings
+    try:
+        pd = ensure_pandas()
+        for block in iter_file_chunks(pd, fp, sh, chunk_size):
+            q.put(("block", block))
+        q.put(("end", None))
+    except BaseException as e:
+        q.put(("error", f"{type(e).__name__}: {e}"))
+
+def prefetch_in_thread(source: Iterable, depth: int) -> Iterable:
+    """
+    线程预读：后台线程迭代 source，主线程评估当前块时下一块已在解析（适合释放GIL的 pyarrow 读取）。
+    消费方提前结束（中止/异常）时后台线程随之退出并关闭 source。
+    """
+    import threading
+    import queue
+    q = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    def _run():
         try:
-            conditions = read_conditions_csv(pd, CONDITIONS_CSV)
-            print(f"已加载条件 {len(conditions)} 条")
-        except Exception as e:
-            print(f"条件文件读取失败：{e}")
-            conditions = []
-    # 旧版回退标记
-    use_major_only = (len(conditions) == 0)
-    total_written = []
-    merged_parts = []
-    t0 = time.time()
-    total_rows = 0
-    for pth in EXCEL_FILES:
-        pth = resolve_path(pth)
-        if not os.path.exists(pth):
-            print(f"文件不存在：{pth}（跳过）")
-            continue
-        frames = build_sheet_frames(pd, pth, SHEET)
-        out_dir = OUT_DIR or os.path.dirname(pth)
-        base = os.path.splitext(os.path.basename(pth))[0]
-        out_path = os.path.join(out_dir, f"{base}_filtered.xlsx")
-        print(f"开始处理：{os.path.basename(pth)}")
-        written_this = []
-        processed_rows = 0
-        file_total_rows = 0
-        file_start = time.time()
-        file_matched_rows = 0
-        # 预估总行数（用于进度占比）
+            for block in source:
+                if not put(("block", block)):
+                    return
+            put(("end", None))
+        except BaseException as e:
+            put(("error", e))
+        finally:
+            close = getattr(source, "close", None)
+            if close:
+                close()
+    t = threading.Thread(target=_run, name="prefetch-reader", daemon=True)
+    t.start()
+    try:
+        while True:
+            kind, item = q.get()
+            if kind == "end":
+                return
+            if kind == "error":
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+class PrefetchProcess:
+    """
+    进程预读：子进程解析一个（文件, 工作表）帧（openpyxl 为纯Python解析，线程无法与评估并行），分块经有界队列回传。
+    创建即启动子进程；迭代结束、消费方提前结束或调用 close() 时终止子进程。
+    """
+    def __init__(self, fp: str, sh: Optional[str], chunk_size: int, depth: int):
+        import multiprocessing as mp
+        ctx = mp.get_context("spawn")
+        self._q = ctx.Queue(maxsize=max(int(depth), 1))
+        self._proc = ctx.Process(target=_prefetch_process_worker, args=(self._q, fp, sh, chunk_size, (CSV_BACKEND, CSV_ENCODING)), name="prefetch-reader", daemon=True)
+        self._proc.start()
+        self._closed = False
+
+    def __iter__(self):
         try:
-            if pth.lower().endswith(".csv"):
-                file_total_rows = total_rows_csv(pth)
-            else:
-                # 多帧时占比计算按全部帧求和
-                if SHEET == "*" or (SHEET and "," not in SHEET and SHEET.strip() != ""):
-                    file_total_rows = total_rows_excel(pth, SHEET if SHEET else None)
-                else:
-                    # 多工作表名：逐名求和
-                    sum_rows = 0
-                    names = [x.strip() for x in SHEET.split(",") if x.strip()] if SHEET else [None]
-                    for nm in names:
-                        sum_rows += total_rows_excel(pth, nm)
-                    file_total_rows = sum_rows
-        except Exception:
-            file_total_rows = 0
+            while True:
+                try:
+                    kind, item = self._q.get(timeout=1.0)
+                except Exception:
+                    if not self._proc.is_alive():
+                        raise RuntimeError(f"预读进程异常退出（退出码 {self._proc.exitcode}）")
+                    continue
+                if kind == "end":
+                    return
+                if kind == "error":
+                    raise RuntimeError(f"预读失败：{item}")
+                yield item
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._proc.is_alive():
+            self._proc.terminate()
+        self._proc.join(timeout=5)
+        self._q.close()
+
+def prefetch_in_process(fp: str, sh: Optional[str], chunk_size: int, depth: int) -> PrefetchProcess:
+    """
+    进程预读一个帧（见 PrefetchProcess）。
+    """
+    return PrefetchProcess(fp, sh, chunk_size, depth)
+
+def prefetch_supported_in_process() -> bool:
+    """
+    子进程以 spawn 启动时会重新导入主模块：仅在本脚本作为主程序运行（主模块有 __main__ 保护）时使用进程预读；
+    被其他程序导入（GUI、服务调用方等）时退回线程预读。
+    """
+    return __name__ == "__main__"
+
+def prefetching_reader(reader=None, depth: Optional[int] = None, mode: Optional[str] = None):
+    """
+    包装分块读取器，使“解析下一块”与“评估当前块”重叠：
+    - depth：有界队列深度（最多提前解析的块数，默认 PREFETCH_DEPTH）；<=0 时原样返回 reader
+    - mode：auto（默认读取器读Excel用进程，其余用线程；单核机器不预读）| process | thread
+    自定义读取器（如服务模式的读取缓存）与不满足 prefetch_supported_in_process 时只用线程预读。
+    """
+    base = reader or iter_file_chunks
+    depth = PREFETCH_DEPTH if depth is None else depth
+    mode = (mode or PREFETCH_MODE or "auto").lower()
+    if depth <= 0 or (mode == "auto" and (os.cpu_count() or 1) < 2):
+        return base
+    def wrapped(pd, fp, sh, chunk_size):
+        use_process = reader is None and mode != "thread" and prefetch_supported_in_process()
+        if mode == "auto":
+            use_process = use_process and input_format(fp) == "excel"
+        if use_process:
+            return prefetch_in_process(fp, sh, chunk_size, depth)
+        return prefetch_in_thread(base(pd, fp, sh, chunk_size), depth)
+    return wrapped
+
+def sheet_workers(frames: List[Tuple[str, Optional[str]]], custom_reader: bool = False) -> int:
+    """
+    多工作表并行解析的进程数（SHEET_WORKERS）：仅默认读取器读取同一 Excel 的多个工作表、
+    且满足 prefetch_supported_in_process 时并行，否则为 1（逐表顺序读取）。
+    """
+    if custom_reader or len(frames) < 2 or SHEET_WORKERS == 1 or not prefetch_supported_in_process():
+        return 1
+    if input_format(frames[0][0]) != "excel":
+        return 1
+    return max(1, min(len(frames), SHEET_WORKERS or (os.cpu_count() or 1)))
+
+def frame_sources(pd, reader, frames: List[Tuple[str, Optional[str]]], chunk_size: int, workers: int = 1) -> Iterable:
+    """
+    按帧顺序产出各帧的分块迭代器：
+    - workers<=1：逐帧调用 reader（开始迭代时才解析）
+    - workers>1：每个工作表由独立子进程打开文件并解析，当前帧之后最多提前启动 workers-1 个帧；
+      分块仍按帧顺序消费，输出顺序与逐表读取一致（去重保留首条的结果不变）
+    """
+    if workers <= 1:
         for fp, sh in frames:
-            # 分块读取
-            if fp.lower().endswith(".csv"):
-                chunks = chunk_generator_from_csv(pd, fp, CHUNK_SIZE)
-            else:
-                chunks = chunk_generator_from_excel(pd, fp, sh, CHUNK_SIZE)
-            for block in chunks:
-                processed_rows += len(block)
-                total_rows += len(block)
-                if use_major_only:
-                    # 旧版：仅Major列（向量化）
-                    s_major = block[MAJOR_COL].astype(str).fillna("") if MAJOR_COL in block.columns else pd.Series([""]*len(block))
-                    s_norm = s_major.map(normalize_text)
-                    # 简化近似：直接按阈值做normalize+contains（可调整为编码优先）
-                    target_norm = ""  # 无具体目标，这里留空 -> 不筛选；旧版需基于require.txt才能生效
-                    block["_match_all"] = s_norm.str.len() > 0  # 占位：如需旧版，建议提供CONDITIONS_CSV
-                    block["_score_all"] = 1.0
-                    audit_cols = []
-                else:
-                    block, audit_cols = eval_conditions_block(pd, block, conditions, COMBINE_MODE, COMBINE_THRESHOLD, WRITE_AUDIT_COLUMNS)
-                out_df = block[block["_match_all"]==True].copy()
-                if len(out_df) > 0:
-                    written_this.append(out_df)
-                    file_matched_rows += len(out_df)
-                if PROGRESS_STEP and processed_rows % PROGRESS_STEP == 0:
-                    elapsed_file = time.time() - file_start
-                    bar = render_progress(processed_rows, file_total_rows)
-                    print(f"{bar} 已处理 {processed_rows}/{file_total_rows if file_total_rows>0 else '?'} 行 | 已运行 {format_time(elapsed_file)} | 命中 {file_matched_rows} 行")
-        # 写出当前文件结果
-        if written_this:
-            df_all = pd.concat(written_this, ignore_index=True)
-            saved = write_output(pd, df_all, out_path, APPEND, DEDUP, DEDUP_KEY, MAJOR_COL)
-            print(f"已写出：{saved}（{len(df_all)} 行）")
-            total_written.append(saved)
-            merged_parts.append(df_all)
-        else:
-            print("无命中结果，跳过写出")
-    # 合并写出
-    if merged_parts:
-        df_merged = pd.concat(merged_parts, ignore_index=True)
-        m_out = MERGE_OUT or os.path.join(os.path.dirname(EXCEL_FILES[0]) if EXCEL_FILES else os.getcwd(), "merged_filtered.xlsx")
-        saved = write_output(pd, df_merged, m_out, APPEND, DEDUP, DEDUP_KEY, MAJOR_COL)
-        print(f"合并写出：{saved}（{len(df_merged)} 行）")
-    t1 = time.time()
-    print(f"完成：总计处理 {total_rows} 行，耗时 {int(t1-t0)} 秒")
+            yield reader(pd, fp, sh, chunk_size)
+        return
+    from collections import deque
+    depth = max(PREFETCH_DEPTH, 1)
+    pending = deque(frames)
+    started = deque()
+    try:
+        while pending or started:
+            while pending and len(started) < workers:
+                fp, sh = pending.popleft()
+                started.append(prefetch_in_process(fp, sh, chunk_size, depth))
+            yield started.popleft()
+    finally:
+        for src in started:
+            src.close()
+
+def frame_sheet_label(fp: str, sh: Optional[str]) -> str:
+    """
+    来源工作表列（SHEET_COLUMN）的取值：Excel 为工作表名（未指定时为首个工作表），CSV/Parquet 为空串。
+    """
+    if input_format(fp) != "excel":
+        return ""
+    return sh if sh else excel_sheet_names(fp)[0]
+
+class BackgroundWriter:
+    """
+    后台写出：单线程按提交顺序执行写出任务（逐文件结果），主线程继续读取与评估下一个文件。
+    enabled=False 时在调用线程同步执行。
+    """
+    def __init__(self, enabled: bool = True):
+        from concurrent.futures import ThreadPoolExecutor
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer") if enabled else None
+        self._futures = []
+
+    def submit(self, fn, *args, **kwargs) -> None:
+        """
+        提交写出任务；写出异常在 wait() 时抛出。
+        """
+        if self._pool is None:
+            fn(*args, **kwargs)
+            return
+        self._futures.append(self._pool.submit(fn, *args, **kwargs))
+
+    def wait(self) -> None:
+        """
+        等待已提交的写出全部完成。
+        """
+        futures, self._futures = self._futures, []
+        for f in futures:
+            f.result()
+
+    def close(self) -> None:
+        """
+        等待剩余写出并关闭线程。
+        """
+        try:
+            self.wait()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+
+MERGED_KEY = "<merged>"  # 检查点中合并输出的键（与输入文件的绝对路径不冲突）
+
+def output_staging_dir(out_path: str) -> str:
+    """
+    输出文件的暂存目录：与输出同目录（保证 os.replace 不跨文件系统），名为 .<文件名>.staging。
+    """
+    out_path = resolve_path(out_path)
+    return os.path.join(os.path.dirname(out_path), f".{os.path.basename(out_path)}.staging")
+
+def reset_staging_dir(staging_dir: str) -> None:
+    """
+    清空并重建暂存目录（丢弃上次中断遗留的半成品）。
+    """
+    import shutil
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir, exist_ok=True)
+
+def publish_staged(staging_dir: str, target_dir: str) -> None:
+    """
+    把暂存目录中的文件（含 xlsx 续写分卷）逐个 os.replace 到输出目录，随后删除暂存目录；
+    可重复调用：中断后再次调用只移入尚未移入的文件。
+    """
+    if not os.path.isdir(staging_dir):
+        return
+    for name in sorted(os.listdir(staging_dir)):
+        os.replace(os.path.join(staging_dir, name), os.path.join(target_dir, name))
+    os.rmdir(staging_dir)
+
+class JobCheckpoint:
+    """
+    任务检查点：目录内 state.json 记录每个输入文件、每个工作表帧已完成的行数，命中行按分块溢写为 pickle 文件。
+    - signature：任务签名（输入与条件文件的大小/修改时间、组合设置等），不一致的旧状态视为无效
+    - 先写溢写文件再原子替换 state.json，中断时最多丢失最后一个分块的进度
+    - 逐文件/合并输出先写入暂存目录，经 publish 两阶段提交（记录 → 移入 → 标记完成），追加模式继续时不会重复追加
+    - 方法可在写出线程中调用（内部加锁）
+    """
+    def __init__(self, directory: str, signature: Dict):
+        import threading
+        self.directory = directory
+        self.signature = signature
+        self._lock = threading.Lock()
+        self.state = {"signature": signature, "files": {}, "next_part": 0}
+
+    def load(self) -> bool:
+        """
+        读取已有状态；签名一致时返回 True（可继续），否则保持空状态。
+        """
+        import json
+        try:
+            with open(os.path.join(self.directory, "state.json"), "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if state.get("signature") != self.signature:
+            return False
+        self.state = state
+        for key in list(state.get("staged", {})):
+            self._commit(key)  # 上次中断于移入输出目录时：补完移入并标记完成
+        return True
+
+    def reset(self) -> None:
+        """
+        清空检查点目录并从空状态开始。
+        """
+        self.clear()
+        self.state = {"signature": self.signature, "files": {}, "next_part": 0}
+
+    def clear(self) -> None:
+        """
+        删除检查点目录（任务完整结束后调用）。
+        """
+        import shutil
+        shutil.rmtree(self.directory, ignore_errors=True)
+        try:
+            os.rmdir(os.path.dirname(self.directory))  # 检查点根目录为空时一并删除
+        except OSError:
+            pass
+
+    def _file(self, pth: str) -> Dict:
+        return self.state["files"].setdefault(pth, {"frames": {}, "parts": [], "rows": 0, "done": False, "output": None})
+
+    def _save(self) -> None:
+        import json
+        os.makedirs(self.directory, exist_ok=True)
+        self.state["updated"] = time.time()
+        tmp = os.path.join(self.directory, "state.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.directory, "state.json"))
+
+    def offset(self, pth: str, frame: int) -> int:
+        """
+        该文件第 frame 个工作表帧已完成的行数。
+        """
+        return int(self.state["files"].get(pth, {}).get("frames", {}).get(str(frame), 0))
+
+    def rows_done(self, pth: str) -> int:
+        return int(self.state["files"].get(pth, {}).get("rows", 0))
+
+    def done_output(self, pth: str) -> Tuple[bool, Optional[str]]:
+        """
+        返回（该文件是否已完成并写出, 逐文件输出路径）；pth 为 MERGED_KEY 时对应合并输出。
+        """
+        st = self.state.get("merged", {}) if pth == MERGED_KEY else self.state["files"].get(pth, {})
+        return bool(st.get("done")), st.get("output")
+
+    def spill(self, pth: str, frame: int, offset: int, df) -> None:
+        """
+        记录一个分块完成：命中行 df（可为空）溢写到新文件，随后更新该帧的行偏移。
+        """
+        with self._lock:
+            st = self._file(pth)
+            if df is not None and len(df) > 0:
+                os.makedirs(self.directory, exist_ok=True)
+                name = f"part{self.state['next_part']:06d}.pkl"
+                self.state["next_part"] += 1
+                df.to_pickle(os.path.join(self.directory, name))
+                st["parts"].append(name)
+            st["rows"] += offset - int(st["frames"].get(str(frame), 0))
+            st["frames"][str(frame)] = offset
+            self._save()
+
+    def load_parts(self, pd, pth: str) -> List:
+        """
+        读回该文件已溢写的命中行（按写入顺序）。
+        """
+        names = self.state["files"].get(pth, {}).get("parts", [])
+        return [pd.read_pickle(os.path.join(self.directory, n)) for n in names]
+
+    def mark_done(self, pth: str, output: Optional[str]) -> None:
+        """
+        标记文件已写出逐文件结果（继续时不再重写，避免追加模式重复追加）；pth 为 MERGED_KEY 时标记合并输出。
+        """
+        with self._lock:
+            st = self.state.setdefault("merged", {}) if pth == MERGED_KEY else self._file(pth)
+            st["done"] = True
+            st["output"] = output
+            self.state.get("staged", {}).pop(pth, None)
+            self._save()
+
+    def publish(self, pth: str, staging_dir: str, output: str) -> None:
+        """
+        提交 write_output 写入暂存目录的结果：先在 state.json 记录（暂存目录, 输出路径），再移入输出目录并标记完成。
+        中断于记录之前：原输出未动，继续时重写；中断于记录之后：load 补完移入并标记完成，不再重写。
+        """
+        with self._lock:
+            self.state.setdefault("staged", {})[pth] = {"dir": staging_dir, "output": output}
+            self._save()
+        self._commit(pth)
+
+    def _commit(self, pth: str) -> None:
+        ent = self.state["staged"][pth]
+        publish_staged(ent["dir"], os.path.dirname(ent["output"]))
+        self.mark_done(pth, ent["output"])
+
+def file_signature(path: Optional[str]) -> Optional[List]:
+    """
+    文件签名（绝对路径、大小、修改时间），用于判断检查点是否仍对应同一输入。
+    """
+    if not path:
+        return None
+    path = resolve_path(path)
+    try:
+        st = os.stat(path)
+        return [path, st.st_size, st.st_mtime_ns]
+    except OSError:
+        return [path, None, None]
+
+def open_job_checkpoint(job: Dict, log=print, extra: Optional[Dict] = None) -> Optional[JobCheckpoint]:
+    """
+    按任务构造检查点：job["checkpoint"] 为假时返回 None。
+    - job["resume"] 为真且存在签名一致的状态时继续，否则清空旧状态从头开始
+    - 目录：CHECKPOINT_DIR（或合并输出所在目录）/.filter_checkpoint/<签名摘要>；extra 参与签名（GUI 区分自身的评估方式）
+    """
+    if not job.get("checkpoint"):
+        return None
+    import hashlib
+    import json
+    files = job.get("files") or []
+    signature = {
+        "files": [file_signature(p) for p in files],
+        "sheet": job.get("sheet") or "",
+        "conditions": file_signature(job.get("conditions")),
+        "combine_mode": str(job.get("combine_mode") or "").upper(),
+        "combine_threshold": float(job.get("combine_threshold") or 0.0),
+        "write_audit": bool(job.get("write_audit")),
+        "major_col": job.get("major_col") or "",
+        "sheet_column": job.get("sheet_column") or None,
+        "outputs": sorted(job_outputs(job)),
+        "extra": extra or {},
+    }
+    digest = hashlib.sha1(json.dumps(signature, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+    m_out = job.get("merge_out") or os.path.join(os.path.dirname(files[0]) if files else os.getcwd(), "merged_filtered.xlsx")
+    root = CHECKPOINT_DIR or os.path.join(os.path.dirname(resolve_path(m_out)), ".filter_checkpoint")
+    ckpt = JobCheckpoint(os.path.join(resolve_path(root), digest), signature)
+    if job.get("resume"):
+        if ckpt.load():
+            done = sum(1 for st in ckpt.state["files"].values() if st.get("done"))
+            rows = sum(int(st.get("rows", 0)) for st in ckpt.state["files"].values())
+            log(f"从检查点继续：已完成 {done} 个文件，已处理 {rows} 行（{ckpt.directory}）")
+            return ckpt
+        log("未找到与当前任务一致的检查点，从头开始")
+    ckpt.reset()
+    return ckpt
+
+def current_rss() -> Tuple[int, str]:
+    """
+    当前进程常驻内存（字节）与来源：psutil（已安装时）→ /proc/self/statm（Linux）→ ru_maxrss（历史峰值，仅作近似）。
+    """
+    if module_installed("psutil"):
+        import psutil  # type: ignore
+        return psutil.Process().memory_info().rss, "psutil"
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE"), "proc"
+    except (OSError, ValueError, AttributeError, IndexError):
+        pass
+    try:
+        import resource
+        import sys
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return (rss if sys.platform == "darwin" else rss * 1024), "rusage"
+    except ImportError:
+        return 0, "none"
+
+class MemoryProfiler:
+    """
+    内存剖析（--profile-memory）：按阶段与分块记录峰值 RSS 与 Python 分配增长，定期做 tracemalloc 快照，结束时写出报告。
+    - 后台线程每 MEMORY_SAMPLE_INTERVAL 秒采样一次 RSS，得到每个阶段区间内的峰值
+    - tracemalloc 记录每个阶段相对开始时的分配峰值增长（numpy/pandas 的数组计入；pyarrow 内存池与子进程不计入）
+    - 每隔 TRACEMALLOC_INTERVAL 秒（在阶段结束时检查）与结束时各做一次快照，保留前 TRACEMALLOC_TOP 个分配位置及按模块汇总
+    - 归因：reader（读取阶段）、evaluator（条件评估）、output_buffers（累计保留的命中行，直到合并写出）、dedup（去重）、write（写出）
+    - 报告中的每行内存（读取+评估）供 AdaptiveChunkSizer 换算分块行数（CHUNK_MEMORY_MB）
+    由 RunMetrics 在每个阶段区间开始/结束时调用（reset/record），不单独使用。
+    """
+    PARTS = {"read": "reader", "evaluate": "evaluator", "dedup": "dedup", "write": "write"}
+
+    def __init__(self, report_path: Optional[str], top: int = 10, interval: float = 30.0, sample_interval: float = 0.05, chunk_memory_mb: Optional[float] = None, log=print):
+        import threading
+        import tracemalloc
+        self.report_path = report_path
+        self.top = max(int(top), 1)
+        self.interval = float(interval)
+        self.chunk_memory_mb = chunk_memory_mb
+        self.log = log
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        self.t0 = time.time()
+        rss, self.rss_source = current_rss()
+        self.baseline = rss
+        self.peak = rss
+        self._phase_peak = rss
+        self._traced0 = tracemalloc.get_traced_memory()[0]
+        self._last_snapshot = time.time()
+        self._buffers = 0
+        self._rows_from_eval = False
+        self.phases: Dict[str, Dict] = {}
+        self.chunks: List[Dict] = []
+        self.snapshots: List[Dict] = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._sample_interval = max(float(sample_interval), 0.005)
+        self._sampler = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+        self._sampler.start()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self._sample_interval):
+            rss = current_rss()[0]
+            with self._lock:
+                self._phase_peak = max(self._phase_peak, rss)
+                self.peak = max(self.peak, rss)
+
+    def reset(self) -> None:
+        """
+        开始一个阶段区间：清零区间峰值（RSS 与 tracemalloc）。
+        """
+        import tracemalloc
+        rss = current_rss()[0]
+        with self._lock:
+            self._phase_peak = rss
+        tracemalloc.reset_peak()
+        self._traced0 = tracemalloc.get_traced_memory()[0]
+
+    def record(self, phase: str, key: Optional[str], rows: Optional[int] = None) -> Dict:
+        """
+        结束一个阶段区间（自上次 reset/record 起）：记录峰值 RSS 与分配增长，读取阶段开始一个新的分块记录；随后开始下一个区间。
+        """
+        import tracemalloc
+        rss = current_rss()[0]
+        with self._lock:
+            rss_peak = max(self._phase_peak, rss)
+            self.peak = max(self.peak, rss_peak)
+        traced_now, traced_peak = tracemalloc.get_traced_memory()
+        grown = max(traced_peak - self._traced0, 0)
+        st = self.phases.setdefault(phase, {"count": 0, "rss_peak": 0, "alloc_peak": 0, "rows": 0})
+        st["count"] += 1
+        st["rss_peak"] = max(st["rss_peak"], rss_peak)
+        st["alloc_peak"] = max(st["alloc_peak"], grown)
+        st["rows"] += int(rows or 0)
+        entry = {"phase": phase, "rss_peak": rss_peak, "alloc_peak": grown}
+        if phase == "read":
+            self.chunks.append({"file": key or "", "chunk": sum(1 for c in self.chunks if c["file"] == (key or "")), "rows": int(rows or 0),
+                                "read_rss_peak": rss_peak, "read_alloc": grown})
+            self._rows_from_eval = not rows
+        elif phase == "evaluate" and self.chunks and self.chunks[-1]["file"] == (key or ""):
+            # 一个分块可分多段评估（GUI 逐行评估按进度步长分段）：取各段峰值；读取时未知行数的按评估行数累计
+            c = self.chunks[-1]
+            c.update(evaluate_rss_peak=max(c.get("evaluate_rss_peak", 0), rss_peak), evaluate_alloc=max(c.get("evaluate_alloc", 0), grown), buffers=self._buffers)
+            if self._rows_from_eval:
+                c["rows"] += int(rows or 0)
+        if self.interval > 0 and time.time() - self._last_snapshot >= self.interval:
+            self.snapshot(phase, key)
+        self.reset()
+        return entry
+
+    def hold(self, df) -> None:
+        """
+        记录一块被保留到合并写出的命中行（输出缓冲）。
+        """
+        self._buffers += int(df.memory_usage(index=True, deep=True).sum())
+        st = self.phases.setdefault("buffers", {"count": 0, "rss_peak": 0, "alloc_peak": 0, "rows": 0})
+        st["count"] += 1
+        st["rows"] += len(df)
+        st["alloc_peak"] = max(st["alloc_peak"], self._buffers)
+
+    def chunk_bytes(self) -> Optional[Tuple[int, int]]:
+        """
+        最近一个分块的（行数, 读取+评估的分配增长字节数）；尚无完整分块时返回 None。
+        """
+        for c in reversed(self.chunks):
+            if "evaluate_alloc" in c and c["rows"]:
+                return c["rows"], c["read_alloc"] + c["evaluate_alloc"]
+        return None
+
+    def bytes_per_row(self) -> Optional[float]:
+        """
+        每行的分块工作内存（读取+评估分配增长 / 行数，取各分块最大值）。
+        """
+        vals = [(c["read_alloc"] + c["evaluate_alloc"]) / c["rows"] for c in self.chunks if "evaluate_alloc" in c and c["rows"]]
+        return max(vals) if vals else None
+
+    def snapshot(self, phase: str = "", key: Optional[str] = None) -> None:
+        """
+        tracemalloc 快照：前 TRACEMALLOC_TOP 个分配位置与按模块（第三方包/本脚本）汇总。
+        """
+        import tracemalloc
+        snap = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ])
+        top = [{"where": f"{st.traceback[0].filename}:{st.traceback[0].lineno}", "mb": round(st.size / 1048576, 3), "count": st.count}
+               for st in snap.statistics("lineno")[:self.top]]
+        modules: Dict[str, int] = {}
+        for st in snap.statistics("filename"):
+            fn = st.traceback[0].filename.replace("\\", "/")
+            parts = fn.split("/site-packages/", 1)
+            mod = parts[1].split("/", 1)[0] if len(parts) == 2 else os.path.splitext(os.path.basename(fn))[0]
+            modules[mod] = modules.get(mod, 0) + st.size
+        by_module = sorted(modules.items(), key=lambda kv: -kv[1])[:self.top]
+        self.snapshots.append({"t": round(time.time() - self.t0, 3), "phase": phase, "file": key or "", "rss_mb": round(current_rss()[0] / 1048576, 1),
+                               "traced_mb": round(tracemalloc.get_traced_memory()[0] / 1048576, 3), "top": top,
+                               "by_module": [{"module": m, "mb": round(v / 1048576, 3)} for m, v in by_module]})
+        self._last_snapshot = time.time()
+
+    def report(self, result: Optional[Dict] = None, error: Optional[str] = None) -> Dict:
+        mb = lambda v: round(v / 1048576, 3)
+        phases = {ph: {"count": st["count"], "rows": st["rows"], "rss_peak_mb": mb(st["rss_peak"]), "alloc_peak_mb": mb(st["alloc_peak"])}
+                  for ph, st in self.phases.items()}
+        attribution = {part: phases.get(ph, {}).get("alloc_peak_mb", 0.0) for ph, part in self.PARTS.items()}
+        attribution["output_buffers"] = phases.get("buffers", {}).get("alloc_peak_mb", 0.0)
+        per_row = self.bytes_per_row()
+        sizer = AdaptiveChunkSizer(self.chunk_memory_mb, per_row) if self.chunk_memory_mb else None
+        chunks = [{k: (mb(v) if k.endswith(("_peak", "_alloc")) or k == "buffers" else v) for k, v in c.items()} for c in self.chunks]
+        return {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"), "seconds": round(time.time() - self.t0, 3), "rss_source": self.rss_source,
+            "baseline_rss_mb": mb(self.baseline), "peak_rss_mb": mb(self.peak), "result": result, "error": error,
+            "phases": phases, "attribution_mb": attribution, "bytes_per_row": round(per_row, 1) if per_row else None,
+            "chunk_memory_mb": self.chunk_memory_mb, "recommended_chunk_size": sizer.chunk_size(None) if sizer else None,
+            "chunks": chunks, "snapshots": self.snapshots,
+        }
+
+    def close(self, result: Optional[Dict] = None, error: Optional[str] = None) -> Dict:
+        """
+        停止采样、做最后一次快照并写出报告（JSON，先写临时文件再替换），日志输出摘要。
+        """
+        import json
+        import tracemalloc
+        self._stop.set()
+        self._sampler.join()
+        self.snapshot("end")
+        rep = self.report(result, error)
+        if self._started_tracing:
+            tracemalloc.stop()
+        if self.report_path:
+            os.makedirs(os.path.dirname(self.report_path) or ".", exist_ok=True)
+            tmp = self.report_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(rep, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.report_path)
+        self.log(f"内存剖析：峰值 RSS {rep['peak_rss_mb']:.1f} MB（起始 {rep['baseline_rss_mb']:.1f} MB，来源 {rep['rss_source']}）")
+        for ph, st in rep["phases"].items():
+            if ph != "buffers":
+                self.log(f"  {ph:<9} 峰值 RSS {st['rss_peak_mb']:>9.1f} MB | 分配峰值 {st['alloc_peak_mb']:>9.1f} MB | {st['count']} 次")
+        self.log("  归因（分配峰值 MB）：" + "，".join(f"{k} {v:.1f}" for k, v in rep["attribution_mb"].items()))
+        if rep["bytes_per_row"]:
+            tail = f"，预算 {self.chunk_memory_mb} MB 建议分块 {rep['recommended_chunk_size']} 行" if rep["recommended_chunk_size"] else ""
+            self.log(f"  分块工作内存约 {rep['bytes_per_row'] / 1024:.2f} KB/行{tail}")
+        if self.report_path:
+            self.log(f"  报告：{self.report_path}")
+        return rep
+
+class AdaptiveChunkSizer:
+    """
+    自适应分块：按每行工作内存（内存剖析报告的 bytes_per_row，或剖析过程中实测）把内存预算 CHUNK_MEMORY_MB 换算为分块行数，
+    限制在 [CHUNK_MIN_ROWS, CHUNK_MAX_ROWS]，大于 1000 行时取整到千行。
+    """
+    def __init__(self, budget_mb: Optional[float], bytes_per_row: Optional[float] = None):
+        self.budget_mb = float(budget_mb or 0)
+        self.bytes_per_row = bytes_per_row
+
+    @classmethod
+    def from_report(cls, budget_mb: float, path: Optional[str]) -> "AdaptiveChunkSizer":
+        import json
+        per_row = None
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    per_row = json.load(f).get("bytes_per_row")
+            except (OSError, ValueError):
+                per_row = None
+        return cls(budget_mb, per_row)
+
+    def observe(self, rows: int, nbytes: int) -> None:
+        """
+        计入一个分块的实测值（保守取最大的每行内存）。
+        """
+        if rows > 0 and nbytes > 0:
+            self.bytes_per_row = max(self.bytes_per_row or 0.0, nbytes / rows)
+
+    def chunk_size(self, default: Optional[int]) -> Optional[int]:
+        if not self.bytes_per_row or self.budget_mb <= 0:
+            return default
+        rows = int(self.budget_mb * 1048576 / self.bytes_per_row)
+        rows = max(int(CHUNK_MIN_ROWS), min(int(CHUNK_MAX_ROWS), rows))
+        return rows // 1000 * 1000 if rows >= 1000 else rows
+
+def memory_report_path(job: Dict) -> str:
+    """
+    内存剖析报告路径：job["memory_report"]，未指定时为合并输出旁的 <合并输出名>.memprofile.json。
+    """
+    if job.get("memory_report"):
+        return resolve_path(job["memory_report"])
+    files = job.get("files") or []
+    m_out = resolve_path(job.get("merge_out") or os.path.join(os.path.dirname(files[0]) if files else os.getcwd(), "merged_filtered.xlsx"))
+    stem = os.path.splitext(split_compression(m_out)[0])[0]
+    return stem + ".memprofile.json"
+
+class RunMetrics:
+    """
+    运行指标：记录结构化事件、逐文件/分阶段耗时，任务结束时写出指标文件。
+    - events_path：JSON Lines 事件日志（追加写入，每行一个事件，含时间戳 ts 与任务名 job）；除 run_filter_job 的事件外，
+      每个文件结束时追加 file_metrics（行数、命中数、读取与评估耗时、含写出的总耗时、行/秒、各阶段耗时），任务结束时追加 run_metrics
+    - prom_path：Prometheus 文本格式指标（先写临时文件再替换，可供 node_exporter textfile collector 采集）
+    - trace_path：Chrome trace-event 文件（chrome://tracing 或 Perfetto 打开），每个分块的读取、评估、写出为一个区间
+    - memory：内存剖析（MemoryProfiler）；每个阶段区间同时记录峰值 RSS 与分配增长，trace 中追加 RSS 计数曲线
+    阶段：read（等待下一个分块，含预读排队）、evaluate（条件评估）、dedup（去重）、write（写出，含追加时读取旧结果）；
+    方法可在写出线程中调用（内部加锁；内存剖析时不使用后台写出）。
+    """
+    PHASES = ("read", "evaluate", "dedup", "write")
+
+    def __init__(self, name: str = "", events_path: Optional[str] = None, prom_path: Optional[str] = None, trace_path: Optional[str] = None, engine: str = "", memory: Optional[MemoryProfiler] = None):
+        import threading
+        self.name = name or "default"
+        self.memory = memory
+        self.engine = engine
+        self.events_path = events_path
+        self.prom_path = prom_path
+        self.trace_path = trace_path
+        self._lock = threading.Lock()
+        self._events = open(events_path, "a", encoding="utf-8") if events_path else None
+        self._trace = []
+        self._threads = {}
+        self._t0 = time.perf_counter()
+        self.started = time.time()
+        self.files: Dict[str, Dict] = {}
+        self.phases: Dict[Tuple[str, str], float] = {}
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+
+    def write_event(self, ev: Dict) -> None:
+        import json
+        if self._events is None:
+            return
+        line = json.dumps(dict(ev, ts=round(time.time(), 6), job=self.name), ensure_ascii=False, default=str)
+        with self._lock:
+            self._events.write(line + "\n")
+            self._events.flush()
+
+    def event(self, ev: Dict) -> None:
+        """
+        记录一个任务事件（file_start/progress/file_done/merged/done），同时更新逐文件统计。
+        """
+        kind = ev.get("type")
+        key = ev.get("file") or ""
+        with self._lock:
+            st = self.files.setdefault(key, {"rows": 0, "matched": 0, "chunks": 0, "start": time.time(), "scan_seconds": 0.0, "seconds": 0.0}) if kind in ("file_start", "progress", "file_done") else None
+            if kind == "file_start":
+                st["start"] = time.time()
+            elif kind == "progress":
+                st["rows"] = int(ev.get("rows") or 0)
+                st["matched"] = int(ev.get("matched") or 0)
+                st["chunks"] += 1
+                st["scan_seconds"] = time.time() - st["start"]
+            elif kind == "file_done":
+                st["matched"] = int(ev.get("rows") or 0)
+                st["seconds"] = time.time() - st["start"]
+            elif kind == "done":
+                self.result = {k: v for k, v in ev.items() if k != "type"}
+        self.write_event(ev)
+        if kind == "file_done":
+            self.write_event({"type": "file_metrics", "file": key, **self.file_summary(key)})
+
+    def observer(self, on_event=None):
+        """
+        包装事件回调：先记录，再转交 on_event。
+        """
+        def observe(ev):
+            self.event(ev)
+            if on_event:
+                on_event(ev)
+        return observe
+
+    def file_summary(self, key: str) -> Dict:
+        with self._lock:
+            st = dict(self.files.get(key) or {"rows": 0, "matched": 0, "chunks": 0, "scan_seconds": 0.0, "seconds": 0.0})
+            phases = {ph: round(sec, 6) for (f, ph), sec in self.phases.items() if f == key}
+        scan = st["scan_seconds"]
+        return {"rows": st["rows"], "matched": st["matched"], "chunks": st["chunks"], "scan_seconds": round(scan, 6), "seconds": round(st["seconds"], 6),
+                "rows_per_sec": round(st["rows"] / scan, 1) if scan > 0 else None, "phases": phases}
+
+    def add(self, phase: str, key: Optional[str], t_start: float, seconds: float, **args) -> None:
+        """
+        记录一段阶段耗时（t_start 为 time.perf_counter() 起点）。
+        """
+        import threading
+        with self._lock:
+            k = (key or "", phase)
+            self.phases[k] = self.phases.get(k, 0.0) + seconds
+            if self.trace_path:
+                tid = threading.get_ident()
+                if tid not in self._threads:
+                    self._threads[tid] = threading.current_thread().name
+                args = dict(args, file=os.path.basename(key) if key else "(merged)")
+                self._trace.append({"name": phase, "cat": "chunk", "ph": "X", "pid": os.getpid(), "tid": tid,
+                                    "ts": round((t_start - self._t0) * 1e6, 1), "dur": round(seconds * 1e6, 1), "args": args})
+        if self.memory is not None:
+            mem = self.memory.record(phase, key, args.get("rows"))
+            if self.trace_path:
+                with self._lock:
+                    self._trace.append({"name": "rss_mb", "ph": "C", "pid": os.getpid(), "ts": round((t_start + seconds - self._t0) * 1e6, 1),
+                                        "args": {"rss_mb": round(mem["rss_peak"] / 1048576, 1)}})
+
+    def span(self, phase: str, key: Optional[str] = None, **args):
+        """
+        上下文管理器：记录其中代码的耗时为一个阶段区间。
+        """
+        import contextlib
+        @contextlib.contextmanager
+        def _span():
+            if self.memory is not None:
+                self.memory.reset()
+            t = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.add(phase, key, t, time.perf_counter() - t, **args)
+        return _span()
+
+    def timed_blocks(self, source: Iterable, key: str) -> Iterable:
+        """
+        包装分块迭代器：每次取下一个分块的等待时间记为 read 阶段（开启预读时为读取未被评估掩盖的部分）。
+        """
+        it = iter(source)
+        n = 0
+        while True:
+            if self.memory is not None:
+                self.memory.reset()
+            t = time.perf_counter()
+            try:
+                block = next(it)
+            except StopIteration:
+                return
+            self.add("read", key, t, time.perf_counter() - t, chunk=n, rows=len(block))
+            n += 1
+            yield block
+
+    def fail(self, error: BaseException) -> None:
+        self.error = f"{type(error).__name__}: {error}"
+        self.write_event({"type": "failed", "error": self.error})
+
+    def prometheus_text(self) -> str:
+        """
+        生成 Prometheus 文本格式指标（本次运行的取值，标签 job/file/phase）。
+        """
+        def esc(v) -> str:
+            return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        def labels(**kv) -> str:
+            return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in kv.items()) + "}"
+        res = self.result or {}
+        seconds = float(res.get("seconds") or (time.time() - self.started))
+        rows = int(res.get("rows") or 0)
+        run = [
+            ("filter_run_success", "本次运行是否成功完成（1/0）", 0 if (self.error or res.get("stopped") or self.result is None) else 1),
+            ("filter_run_timestamp_seconds", "本次运行结束时间（Unix 时间戳）", round(time.time(), 3)),
+            ("filter_run_seconds", "本次运行总耗时（秒）", round(seconds, 6)),
+            ("filter_run_rows", "本次运行处理的数据行数", rows),
+            ("filter_run_matched_rows", "本次运行命中的数据行数", int(res.get("matched") or 0)),
+            ("filter_run_rows_per_second", "本次运行吞吐（行/秒）", round(rows / seconds, 3) if seconds > 0 else 0),
+        ]
+        out = []
+        job = labels(job=self.name, engine=self.engine)
+        for name, help_text, value in run:
+            out += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name}{job} {value}"]
+        if self.memory is not None:
+            out += ["# HELP filter_run_peak_rss_bytes 本次运行的峰值常驻内存（字节，内存剖析）", "# TYPE filter_run_peak_rss_bytes gauge",
+                    f"filter_run_peak_rss_bytes{job} {self.memory.peak}"]
+        per_file = [("filter_file_rows", "逐文件处理的数据行数", "rows"), ("filter_file_matched_rows", "逐文件命中的数据行数", "matched"),
+                    ("filter_file_chunks", "逐文件处理的分块数", "chunks"), ("filter_file_scan_seconds", "逐文件读取与评估耗时（秒，开始处理到最后一个分块）", "scan_seconds"),
+                    ("filter_file_seconds", "逐文件耗时（秒，开始处理到结果写出，含排队等待后台写出）", "seconds"),
+                    ("filter_file_rows_per_second", "逐文件吞吐（行/秒，按读取与评估耗时）", "rows_per_sec")]
+        summaries = {f: self.file_summary(f) for f in self.files if f}
+        for name, help_text, field in per_file:
+            out += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            out += [f"{name}{labels(job=self.name, file=f)} {s[field] or 0}" for f, s in summaries.items()]
+        out += ["# HELP filter_phase_seconds 各阶段累计耗时（秒；file 为空表示合并输出）", "# TYPE filter_phase_seconds gauge"]
+        with self._lock:
+            phases = sorted(self.phases.items())
+        out += [f"filter_phase_seconds{labels(job=self.name, file=f, phase=ph)} {round(sec, 6)}" for (f, ph), sec in phases]
+        return "\n".join(out) + "\n"
+
+    def close(self) -> None:
+        """
+        写出 run_metrics 事件、Prometheus 指标与 trace 文件，关闭事件日志；剖析内存时同时写出内存报告。
+        """
+        import json
+        if self.memory is not None:
+            rep = self.memory.close(self.result, self.error)
+            self.write_event({"type": "memory_profile", "report": self.memory.report_path, "peak_rss_mb": rep["peak_rss_mb"],
+                              "attribution_mb": rep["attribution_mb"], "recommended_chunk_size": rep["recommended_chunk_size"]})
+        totals = {}
+        with self._lock:
+            for (_, ph), sec in self.phases.items():
+                totals[ph] = round(totals.get(ph, 0.0) + sec, 6)
+        self.write_event({"type": "run_metrics", "engine": self.engine, "result": self.result, "error": self.error, "phases": totals})
+        if self.prom_path:
+            tmp = self.prom_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp, self.prom_path)
+        if self.trace_path:
+            meta = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": nm}} for tid, nm in self._threads.items()]
+            with open(self.trace_path, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": meta + self._trace, "displayTimeUnit": "ms", "otherData": {"job": self.name, "engine": self.engine}}, f, ensure_ascii=False)
+        if self._events is not None:
+            self._events.close()
+            self._events = None
+
+def metric_span(metrics: Optional[RunMetrics], phase: str, key: Optional[str] = None, **args):
+    """
+    metrics 为 None 时不记录（空上下文），否则同 RunMetrics.span。
+    """
+    if metrics is None:
+        import contextlib
+        return contextlib.nullcontext()
+    return metrics.span(phase, key, **args)
+
+def open_run_metrics(job: Dict, log=print) -> Optional[RunMetrics]:
+    """
+    按任务的 events_out/metrics_out/trace_out 构造运行指标，profile_memory 为真时附带内存剖析（报告见 memory_report_path）；
+    均未设置时返回 None。
+    """
+    paths = [job.get(k) for k in ("events_out", "metrics_out", "trace_out")]
+    profile = bool(job.get("profile_memory"))
+    if not any(paths) and not profile:
+        return None
+    for p in paths:
+        if p and os.path.dirname(resolve_path(p)):
+            os.makedirs(os.path.dirname(resolve_path(p)), exist_ok=True)
+    events, prom, trace = [resolve_path(p) if p else None for p in paths]
+    memory = None
+    if profile:
+        memory = MemoryProfiler(memory_report_path(job), TRACEMALLOC_TOP, TRACEMALLOC_INTERVAL, MEMORY_SAMPLE_INTERVAL, job.get("chunk_memory_mb"), log)
+    return RunMetrics(job.get("name") or "", events, prom, trace, str(job.get("engine") or ENGINE).lower(), memory)
+
+def run_filter_job(pd, job: Dict, conditions: List[Dict[str, str]], plan: Optional[Dict] = None, memo: Optional[SimilarityMemo] = None, log=print, on_event=None, should_stop=None, reader=None, row_counter=None, metrics: Optional[RunMetrics] = None) -> Dict:
+    """
+    执行一个筛选任务：
+    - 遍历输入文件：构造（文件, 工作表）帧列表 → 分块读取 → 条件评估 → 收集命中
+    - 写出逐文件结果与（可选）全量合并结果
+    参数：
+      job：任务字典（见 default_job）
+      conditions：已读取的条件列表；为空则回退旧版（仅 Major）逻辑
+      plan/memo：预编译条件计划与相似度缓存（可跨任务复用）
+      log：文本日志回调；on_event：结构化事件回调（dict）；should_stop：返回True时中止
+      reader/row_counter：可替换的分块读取器与行数预估（服务模式用于复用读取缓存）
+      metrics：运行指标（未传入时按 job 的 events_out/metrics_out/trace_out 打开，任务结束或失败时写出，见 RunMetrics）
+    job["checkpoint"] 为真时每个分块结束后记录检查点（见 JobCheckpoint）；job["resume"] 为真时跳过已完成的文件与分块。
+    读取经 prefetching_reader 后台预读（PREFETCH_DEPTH），逐文件结果交给 BackgroundWriter 写出（BACKGROUND_WRITE）；
+    剖析内存（job["profile_memory"]）时三者均关闭，使各阶段的内存互不重叠。
+    job["chunk_memory_mb"] 设置时按内存剖析报告的每行内存换算分块行数（AdaptiveChunkSizer），剖析中逐文件按实测修正。
+    job["optimize_conditions"] 为真时各引擎执行优化后的条件集（见 optimize_conditions）。
+    返回：
+      {"outputs": 逐文件输出路径, "merged": 合并输出路径或None, "rows": 处理行数, "matched": 命中行数, "seconds": 耗时, "stopped": 是否中止}
+    """
+    if metrics is None:
+        metrics = open_run_metrics(job, log)
+        if metrics is not None:
+            try:
+                return run_filter_job(pd, job, conditions, plan, memo, log, on_event, should_stop, reader, row_counter, metrics)
+            except BaseException as e:
+                metrics.fail(e)
+                raise
+            finally:
+                metrics.close()
+    else:
+        on_event = metrics.observer(on_event)
+    emit = on_event or (lambda ev: None)
+    memory = metrics.memory if metrics is not None else None
+    custom_reader = reader is not None
+    reader = prefetching_reader(reader, 0 if memory is not None else None)
+    row_counter = row_counter or estimate_total_rows
+    files = job.get("files") or []
+    sheet = job.get("sheet") or ""
+    combine_mode = job.get("combine_mode") or "OR"
+    combine_threshold = float(job.get("combine_threshold", 0.8))
+    chunk_size = int(job.get("chunk_size") or 50000)
+    progress_step = int(job.get("progress_step") or 0)
+    write_audit = bool(job.get("write_audit"))
+    major_col = job.get("major_col") or "Major"
+    append = bool(job.get("append"))
+    dedup = bool(job.get("dedup"))
+    dedup_key = job.get("dedup_key")
+    sheet_column = job.get("sheet_column") or None
+    # 旧版回退标记
+    use_major_only = (len(conditions) == 0)
+    if not use_major_only and job.get("optimize_conditions"):
+        conditions, plan = optimized_condition_plan(conditions, plan, combine_mode, write_audit, log)
+    engine = str(job.get("engine") or ENGINE).lower()
+    if memory is not None and engine in ("cluster", "duckdb", "polars") and not use_major_only:
+        log(f"提示：{engine} 引擎只记录本进程的整体峰值内存，逐阶段/逐分块内存剖析仅适用于 pandas 引擎")
+    if engine == "cluster" and not use_major_only:
+        if job.get("resume"):
+            log("提示：检查点仅适用于 pandas 引擎，cluster 引擎将从头执行")
+        return run_cluster_job(pd, job, conditions, log, on_event, should_stop)
+    if engine in ("duckdb", "polars") and not use_major_only:
+        if module_installed(engine):
+            run = run_duckdb_job if engine == "duckdb" else run_polars_job
+            if job.get("resume"):
+                log(f"提示：检查点仅适用于 pandas 引擎，{engine} 引擎将从头执行")
+            if sheet_column:
+                log(f"提示：来源工作表列仅适用于 pandas 引擎，{engine} 引擎不写出该列")
+            return run(pd, job, conditions, plan, memo, log, on_event, should_stop)
+        log(f"警告：未安装 {engine}，改用 pandas 引擎（pip install {engine}）")
+    if plan is None and not use_major_only:
+        plan = compile_condition_plan(conditions)
+    total_written = []
+    merged_parts = []
+    merged_saved = None
+    matched_total = 0
+    stopped = False
+    t0 = time.time()
+    total_rows = 0
+    ckpt = open_job_checkpoint(job, log)
+    writer = BackgroundWriter(BACKGROUND_WRITE and memory is None)
+    sizer = None
+    if job.get("chunk_memory_mb"):
+        sizer = AdaptiveChunkSizer.from_report(float(job["chunk_memory_mb"]), memory_report_path(job))
+        if sizer.bytes_per_row:
+            log(f"自适应分块：每行约 {sizer.bytes_per_row / 1024:.2f} KB，预算 {sizer.budget_mb:g} MB → {sizer.chunk_size(chunk_size)} 行")
+        elif memory is None:
+            log(f"提示：未找到内存剖析报告（{memory_report_path(job)}），先以 --profile-memory 运行一次；本次使用固定分块 {chunk_size} 行")
+    try:
+        for pth in files:
+            if should_stop and should_stop():
+                stopped = True
+                break
+            pth = resolve_path(pth)
+            if not os.path.exists(pth):
+                log(f"文件不存在：{pth}（跳过）")
+                continue
+            done, saved = ckpt.done_output(pth) if ckpt is not None else (False, None)
+            if done:
+                # 检查点中已写出：不再重写逐文件结果，命中行读回参与合并
+                parts = ckpt.load_parts(pd, pth)
+                rows = sum(len(x) for x in parts)
+                log(f"已完成（检查点）：{os.path.basename(pth)}（{rows} 行）")
+                emit({"type": "file_done", "file": pth, "output": saved, "rows": rows})
+                if saved:
+                    total_written.append(saved)
+                if parts:
+                    merged_parts.append(pd.concat(parts, ignore_index=True))
+                    matched_total += rows
+                continue
+            frames = build_sheet_frames(pd, pth, sheet)
+            out_dir = job.get("out_dir") or os.path.dirname(pth)
+            base = os.path.splitext(os.path.basename(split_compression(pth)[0]))[0]
+            out_path = os.path.join(out_dir, f"{base}_filtered.xlsx")
+            log(f"开始处理：{os.path.basename(pth)}")
+            # 继续时：读回已溢写的命中行，已完成的分块只读取不评估
+            written_this = ckpt.load_parts(pd, pth) if ckpt is not None else []
+            processed_rows = ckpt.rows_done(pth) if ckpt is not None else 0
+            file_start = time.time()
+            file_matched_rows = sum(len(x) for x in written_this)
+            # 预估总行数（用于进度占比）
+            file_total_rows = row_counter(pth, sheet)
+            emit({"type": "file_start", "file": pth, "total": file_total_rows})
+            workers = sheet_workers(frames, custom_reader) if memory is None else 1
+            if workers > 1:
+                log(f"并行解析 {len(frames)} 个工作表（{workers} 个进程）")
+            file_chunk = sizer.chunk_size(chunk_size) if sizer is not None else chunk_size
+            for fi, ((fp, sh), source) in enumerate(zip(frames, frame_sources(pd, reader, frames, file_chunk, workers))):
+                if metrics is not None:
+                    source = metrics.timed_blocks(source, pth)
+                skip = ckpt.offset(pth, fi) if ckpt is not None else 0
+                frame_rows = 0
+                label = frame_sheet_label(fp, sh) if sheet_column else None
+                # 分块读取
+                for block in source:
+                    if should_stop and should_stop():
+                        stopped = True
+                        break
+                    if frame_rows + len(block) <= skip:
+                        frame_rows += len(block)
+                        continue
+                    if frame_rows < skip:
+                        block = block.iloc[skip - frame_rows:].reset_index(drop=True)
+                        frame_rows = skip
+                    frame_rows += len(block)
+                    processed_rows += len(block)
+                    read_bytes, size_bytes = block.attrs.get("bytes_read"), block.attrs.get("bytes_total")
+                    if read_bytes and size_bytes:
+                        # 压缩输入：按已读取的压缩字节占比外推总行数
+                        file_total_rows = max(processed_rows, int(processed_rows * size_bytes / read_bytes))
+                    if sheet_column:
+                        block[sheet_column] = label
+                    total_rows += len(block)
+                    if use_major_only:
+                        # 旧版：仅Major列（向量化）
+                        s_major = block[major_col].astype(str).fillna("") if major_col in block.columns else pd.Series([""]*len(block))
+                        s_norm = s_major.map(normalize_text)
+                        # 简化近似：直接按阈值做normalize+contains（可调整为编码优先）
+                        target_norm = ""  # 无具体目标，这里留空 -> 不筛选；旧版需基于require.txt才能生效
+                        block["_match_all"] = s_norm.str.len() > 0  # 占位：如需旧版，建议提供CONDITIONS_CSV
+                        block["_score_all"] = 1.0
+                        audit_cols = []
+                    else:
+                        with metric_span(metrics, "evaluate", pth, rows=len(block)):
+                            block, audit_cols = eval_conditions_block(pd, block, conditions, combine_mode, combine_threshold, write_audit, memo, plan)
+                    out_df = block[block["_match_all"]==True].copy()
+                    if len(out_df) > 0:
+                        written_this.append(out_df)
+                        file_matched_rows += len(out_df)
+                        if memory is not None:
+                            memory.hold(out_df)
+                    if ckpt is not None:
+                        ckpt.spill(pth, fi, frame_rows, out_df)
+                    emit({"type": "progress", "file": pth, "rows": processed_rows, "total": file_total_rows, "matched": file_matched_rows, "elapsed": round(time.time() - file_start, 3)})
+                    if progress_step and processed_rows % progress_step == 0:
+                        elapsed_file = time.time() - file_start
+                        bar = render_progress(processed_rows, file_total_rows)
+                        log(f"{bar} 已处理 {processed_rows}/{file_total_rows if file_total_rows>0 else '?'} 行 | 已运行 {format_time(elapsed_file)} | 命中 {file_matched_rows} 行")
+                if stopped:
+                    break
+            if memo is not None:
+                memo.flush()
+            if sizer is not None and memory is not None and memory.chunk_bytes():
+                sizer.observe(*memory.chunk_bytes())
+            if stopped:
+                if ckpt is not None:
+                    log(f"已中止：进度已保存到检查点，使用 --resume 继续（{ckpt.directory}）")
+                else:
+                    log("已中止：当前文件结果未写出")
+                break
+            # 写出当前文件结果（后台线程写出，主线程继续下一个文件）
+            if written_this:
+                df_all = pd.concat(written_this, ignore_index=True)
+                def _write_file(df_all=df_all, out_path=out_path, pth=pth):
+                    if ckpt is not None:
+                        # 检查点任务：写入暂存目录后两阶段提交，中断后继续不会重复追加
+                        staging = output_staging_dir(out_path)
+                        saved = write_output(pd, df_all, out_path, append, dedup, dedup_key, major_col, metrics, pth, staging)
+                        ckpt.publish(pth, staging, saved)
+                    else:
+                        saved = write_output(pd, df_all, out_path, append, dedup, dedup_key, major_col, metrics, pth)
+                    log(f"已写出：{saved}（{len(df_all)} 行）")
+                    emit({"type": "file_done", "file": pth, "output": saved, "rows": len(df_all)})
+                    total_written.append(saved)
+                writer.submit(_write_file)
+                merged_parts.append(df_all)
+                matched_total += len(df_all)
+            else:
+                log("无命中结果，跳过写出")
+                emit({"type": "file_done", "file": pth, "output": None, "rows": 0})
+                if ckpt is not None:
+                    ckpt.mark_done(pth, None)
+        # 合并写出（等待逐文件写出完成）
+        writer.wait()
+        if merged_parts and not stopped:
+            df_merged = pd.concat(merged_parts, ignore_index=True)
+            m_out = job.get("merge_out") or os.path.join(os.path.dirname(files[0]) if files else os.getcwd(), "merged_filtered.xlsx")
+            done, merged_saved = ckpt.done_output(MERGED_KEY) if ckpt is not None else (False, None)
+            if done:
+                log(f"已完成（检查点）：合并输出 {merged_saved}")
+            else:
+                if ckpt is not None:
+                    staging = output_staging_dir(m_out)
+                    merged_saved = write_output(pd, df_merged, m_out, append, dedup, dedup_key, major_col, metrics, None, staging)
+                    ckpt.publish(MERGED_KEY, staging, merged_saved)
+                else:
+                    merged_saved = write_output(pd, df_merged, m_out, append, dedup, dedup_key, major_col, metrics)
+                log(f"合并写出：{merged_saved}（{len(df_merged)} 行）")
+            emit({"type": "merged", "output": merged_saved, "rows": len(df_merged)})
+        if ckpt is not None and not stopped:
+            ckpt.clear()
+    finally:
+        writer.close()
+    t1 = time.time()
+    log(f"完成：总计处理 {total_rows} 行，耗时 {int(t1-t0)} 秒")
+    result = {"outputs": total_written, "merged": merged_saved, "rows": total_rows, "matched": matched_total, "seconds": round(t1 - t0, 3), "stopped": stopped}
+    emit(dict(result, type="done"))
+    return result
+
+def load_job_conditions(pd, path: Optional[str], log=print) -> List[Dict[str, str]]:
+    """
+    读取任务的条件文件；读取失败时记录日志并返回空列表（回退旧版逻辑）。
+    """
+    if not path:
+        return []
+    try:
+        conditions = read_conditions_csv(pd, path)
+        log(f"已加载条件 {len(conditions)} 条")
+        return conditions
+    except Exception as e:
+        log(f"条件文件读取失败：{e}")
+        return []
+
+def sample_job_rows(pd, job: Dict, n: int, seed: Optional[int] = None, reader=None, should_stop=None) -> Dict:
+    """
+    对任务的全部输入（文件 × 工作表 × 分块）做一次读取，抽取 n 行均匀样本（不放回）：
+    每行赋一个均匀随机键，保留键最小的 n 行（bottom-k 抽样，与蓄水池抽样等价，可按块向量化）。
+    样本带 _preview_stratum 列（层下标，层为“文件/工作表”），用于分层汇报。
+    返回：
+      {"sample": 样本 DataFrame（按随机键排序，即随机顺序）, "strata": [{"file","sheet","rows"}], "rows": 总行数, "read_seconds": 读取耗时, "stopped": 是否中止}
+    """
+    import numpy as np  # type: ignore
+    rng = np.random.default_rng(seed)
+    reader = prefetching_reader(reader)
+    chunk_size = int(job.get("chunk_size") or 50000)
+    sheet = job.get("sheet") or ""
+    sample = None
+    strata = []
+    total = 0
+    stopped = False
+    t0 = time.time()
+    for pth in job.get("files") or []:
+        pth = resolve_path(pth)
+        if not os.path.exists(pth):
+            continue
+        frames = build_sheet_frames(pd, pth, sheet)
+        for (fp, sh), source in zip(frames, frame_sources(pd, reader, frames, chunk_size, 1)):
+            stratum = len(strata)
+            strata.append({"file": fp, "sheet": frame_sheet_label(fp, sh), "rows": 0})
+            for block in source:
+                if should_stop and should_stop():
+                    stopped = True
+                    break
+                strata[stratum]["rows"] += len(block)
+                total += len(block)
+                keys = rng.random(len(block))
+                if sample is not None and len(sample) >= n:
+                    keep = keys < sample["_preview_key"].iloc[-1]
+                    if not keep.any():
+                        continue
+                    block, keys = block[keep], keys[keep]
+                block = block.assign(_preview_key=keys, _preview_stratum=stratum)
+                sample = block if sample is None else pd.concat([sample, block], ignore_index=True)
+                sample = sample.sort_values("_preview_key", kind="stable").head(n).reset_index(drop=True)
+            if stopped:
+                break
+        if stopped:
+            break
+    if sample is None:
+        sample = pd.DataFrame({"_preview_key": [], "_preview_stratum": []})
+    return {"sample": sample.drop(columns=["_preview_key"]), "strata": strata, "rows": total, "read_seconds": time.time() - t0, "stopped": stopped}
+
+def proportion_interval(hits: int, n: int, population: int, confidence: float = PREVIEW_CONFIDENCE) -> Tuple[float, float]:
+    """
+    比例的 Wilson 置信区间（不放回抽样：有效样本量按有限总体校正放大；全量抽样时区间退化为点）。
+    """
+    from statistics import NormalDist
+    if n <= 0:
+        return 0.0, 1.0
+    p = hits / n
+    if population <= n:
+        return p, p
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    n_eff = n * (population - 1) / (population - n)
+    denom = 1 + z * z / n_eff
+    center = (p + z * z / (2 * n_eff)) / denom
+    half = z * ((p * (1 - p) / n_eff + z * z / (4 * n_eff * n_eff)) ** 0.5) / denom
+    return max(0.0, center - half), min(1.0, center + half)
+
+def preview_job(pd, job: Dict, conditions: List[Dict[str, str]], plan: Optional[Dict] = None, memo: Optional[SimilarityMemo] = None, log=print, reader=None, should_stop=None, n: Optional[int] = None, seed: Optional[int] = None, batches: int = 10) -> Dict:
+    """
+    抽样预览：抽取均匀样本（sample_job_rows）后按条件计划评估，估计：
+    - 命中行数（总体 × 样本命中率）及置信区间；各文件/工作表的样本命中率
+    - 各条件选择率（样本中命中的比例）及置信区间；fuzzy 条件另给出不同阈值下的选择率
+    - WEIGHTED 模式下不同 COMBINE_THRESHOLD 的命中估计
+    - 全量耗时：实测读取耗时 + 评估耗时；评估耗时由样本按大小递增的批次计时，拟合“每块固定开销 + 每行开销”，
+      按总块数与总行数外推并给出区间（样本中重复取值少，fuzzy 评估耗时估计偏保守）
+    样本经 pandas 引擎评估；相似度缓存照常写入，全量运行可复用。
+    返回：
+      报告字典（同时以日志输出）
+    """
+    import numpy as np  # type: ignore
+    from statistics import NormalDist
+    n = int(n or PREVIEW_ROWS)
+    combine_mode = job.get("combine_mode") or "OR"
+    combine_threshold = float(job.get("combine_threshold", 0.8))
+    if plan is None:
+        plan = compile_condition_plan(conditions)
+    drawn = sample_job_rows(pd, job, n, seed if seed is not None else PREVIEW_SEED, reader, should_stop)
+    sample, population = drawn["sample"], drawn["rows"]
+    report = {"rows": population, "sample_rows": len(sample), "read_seconds": round(drawn["read_seconds"], 3), "stopped": drawn["stopped"]}
+    log(f"抽样：总计 {population} 行，样本 {len(sample)} 行（读取耗时 {drawn['read_seconds']:.1f} 秒）")
+    if drawn["stopped"] or len(sample) == 0 or not conditions:
+        if not conditions:
+            log("抽样预览需要条件文件")
+        return report
+    strata = sample.pop("_preview_stratum").astype(int).to_numpy()
+    write_audit = bool(job.get("write_audit"))
+    # 先评估一行，完成计划中延迟构建的部分（regex 集合、数值区间、TF-IDF 索引），不计入耗时
+    eval_conditions_block(pd, sample.iloc[:1].copy(), conditions, combine_mode, combine_threshold, False, memo, plan)
+    # 计时：批次大小按 1:2:…:batches 递增（与全量运行相同的审计设置），用于拟合固定开销与每行开销
+    weights = np.arange(1, max(1, batches) + 1, dtype=np.float64)
+    bounds = np.unique(np.round(np.cumsum(weights) / weights.sum() * len(sample)).astype(int))
+    sizes, seconds = [], []
+    start = 0
+    for stop in bounds:
+        if stop <= start:
+            continue
+        t = time.perf_counter()
+        eval_conditions_block(pd, sample.iloc[start:stop].reset_index(drop=True), conditions, combine_mode, combine_threshold, write_audit, memo, plan)
+        seconds.append(time.perf_counter() - t)
+        sizes.append(stop - start)
+        start = stop
+    # 统计：整份样本带审计列评估一次（不计时）
+    evaluated, _ = eval_conditions_block(pd, sample.copy(), conditions, combine_mode, combine_threshold, True, memo, plan)
+    evaluated = evaluated.assign(_preview_stratum=strata)
+    if memo is not None:
+        memo.flush()
+    k = len(evaluated)
+    hits = int(evaluated["_match_all"].sum())
+    lo, hi = proportion_interval(hits, k, population)
+    conf = f"{int(PREVIEW_CONFIDENCE * 100)}%"
+    report["matched"] = {"estimate": round(population * hits / k), "low": int(population * lo), "high": int(-(-population * hi // 1)), "rate": hits / k}
+    log(f"预计命中：{report['matched']['estimate']} 行（{conf} 区间 {report['matched']['low']} ~ {report['matched']['high']}，样本命中率 {hits / k:.2%}）")
+    report["strata"] = []
+    for i, st in enumerate(drawn["strata"]):
+        sel = evaluated["_preview_stratum"] == i
+        m = int(sel.sum())
+        h = int(evaluated.loc[sel, "_match_all"].sum())
+        report["strata"].append(dict(st, sample_rows=m, sample_matched=h))
+        if len(drawn["strata"]) > 1:
+            label = os.path.basename(st["file"]) + (f"[{st['sheet']}]" if st["sheet"] else "")
+            log(f"  {label}：{st['rows']} 行，样本 {m} 行，样本命中率 {(h / m if m else 0.0):.2%}")
+    report["conditions"] = []
+    for i, cond in enumerate(conditions, start=1):
+        desc = f"{cond['column']}:{cond['type']}/{cond['operator']}={cond['value']}"
+        col = f"_cond_{i}_match"
+        if col not in evaluated.columns:
+            report["conditions"].append({"index": i, "desc": desc, "error": True})
+            log(f"  条件{i} {desc}：评估出错")
+            continue
+        h = int(evaluated[col].sum())
+        c_lo, c_hi = proportion_interval(h, k, population)
+        item = {"index": i, "desc": desc, "selectivity": h / k, "low": c_lo, "high": c_hi}
+        line = f"  条件{i} {desc}：选择率 {h / k:.2%}（{c_lo:.2%} ~ {c_hi:.2%}）"
+        if cond["type"] == "fuzzy":
+            scores = evaluated[f"_cond_{i}_score"]
+            item["by_threshold"] = {t: float((scores >= t).mean()) for t in (0.6, 0.7, 0.8, 0.9)}
+            line += "；按阈值 " + " ".join(f"{t:g}:{r:.1%}" for t, r in item["by_threshold"].items())
+        report["conditions"].append(item)
+        log(line)
+    if combine_mode == "WEIGHTED":
+        sweep = sorted({round(combine_threshold, 4), *(round(combine_threshold + d, 4) for d in (-0.2, -0.1, 0.1, 0.2))})
+        report["by_combine_threshold"] = {t: round(population * float((evaluated["_score_all"] >= t).mean())) for t in sweep if t >= 0}
+        log("按 COMBINE_THRESHOLD 预计命中：" + " ".join(f"{t:g}:{c}" for t, c in report["by_combine_threshold"].items()))
+    # 评估耗时 ≈ 块数 × 每块固定开销 + 行数 × 每行开销（最小二乘；批次不足时只估每行开销）
+    chunk_size = int(job.get("chunk_size") or 50000)
+    chunks = sum(-(-st["rows"] // chunk_size) for st in drawn["strata"])
+    X = np.column_stack([np.ones(len(sizes)), np.asarray(sizes, dtype=np.float64)])
+    y = np.asarray(seconds)
+    if len(sizes) >= 3:
+        coef, *_ = np.linalg.lstsq(X, y, rcond=None)
+        coef = np.maximum(coef, 0.0)
+        dof = len(sizes) - 2
+        sigma2 = float(((y - X @ coef) ** 2).sum()) / dof
+        target = np.array([chunks, population], dtype=np.float64)
+        var = sigma2 * float(target @ np.linalg.pinv(X.T @ X) @ target)
+    else:
+        coef = np.array([0.0, y.sum() / max(sum(sizes), 1)])
+        var = 0.0
+    eval_seconds = float(coef[0] * chunks + coef[1] * population)
+    z = NormalDist().inv_cdf(0.5 + PREVIEW_CONFIDENCE / 2)
+    half = z * var ** 0.5
+    est = drawn["read_seconds"] + eval_seconds
+    report["projected_seconds"] = {
+        "estimate": round(est, 1), "low": round(drawn["read_seconds"] + max(eval_seconds - half, 0.0), 1), "high": round(est + half, 1),
+        "read": round(drawn["read_seconds"], 3), "eval_per_chunk_ms": round(float(coef[0]) * 1000, 3), "eval_per_row_ms": round(float(coef[1]) * 1000, 4),
+    }
+    log(f"预计全量耗时：{format_time(est)}（{conf} 区间 {format_time(report['projected_seconds']['low'])} ~ {format_time(report['projected_seconds']['high'])}；"
+        f"读取 {drawn['read_seconds']:.1f} 秒，评估每块固定 {coef[0] * 1000:.1f} ms + 每行 {coef[1] * 1000:.4f} ms，共 {chunks} 块）")
+    return report
+
+def preview_jobs(pd, jobs: List[Dict], n: Optional[int] = None, seed: Optional[int] = None, log=print) -> List[Dict]:
+    """
+    对每个任务做抽样预览（见 preview_job），条件集在任务间共享；不写出任何结果。
+    """
+    registry = ConditionSets(pd, use_memo=SIM_MEMO)
+    reports = []
+    try:
+        for k, job in enumerate(jobs, start=1):
+            name = job.get("name") or f"job{k}"
+            job_log = (lambda msg, name=name: log(f"[{name}] {msg}")) if len(jobs) > 1 else log
+            entry = registry.resolve(job.get("conditions"))
+            if entry is None:
+                job_log("抽样预览需要条件文件（跳过）")
+                continue
+            reports.append(dict(preview_job(pd, job, entry["conditions"], entry["plan"], entry["memo"], job_log, n=n, seed=seed), name=name))
+    finally:
+        registry.close()
+    return reports
+
+def process_files():
+    """
+    主流程：按顶部配置构造任务并执行（见 run_filter_job）
+    - 读取条件（CSV），为空则回退旧版（仅 Major）逻辑
+    - 写出逐文件结果与（可选）全量合并结果
+    - 输出总计处理行数与耗时
+    """
+    job = default_job()
+    preload_modules()
+    errors = validate_job(job)
+    if errors:
+        for e in errors:
+            print(f"配置错误：{e}")
+        return None
+    pd = ensure_pandas()
+    conditions = load_job_conditions(pd, job["conditions"])
+    memo = open_similarity_memo(job["conditions"]) if (SIM_MEMO and needs_similarity_memo(conditions)) else None
+    try:
+        return run_filter_job(pd, job, conditions, memo=memo)
+    finally:
+        if memo is not None:
+            memo.close()
+
+# ===================== DuckDB 后端 =====================
+# 可选执行引擎（ENGINE / --engine）
+ENGINES = ("pandas", "duckdb", "polars", "cluster")
+
+def sql_literal(s: str) -> str:
+    """
+    生成SQL字符串字面量（单引号转义）。
+    """
+    return "'" + str(s).replace("'", "''") + "'"
+
+def sql_ident(name: str) -> str:
+    """
+    生成SQL标识符（列名含中文/空格/引号时同样安全）。
+    """
+    return '"' + str(name).replace('"', '""') + '"'
+
+def arrow_text(arr):
+    """
+    UDF 输入统一为单块 Arrow 字符串数组（合并分块；Polars 的 string_view 转为 large_string，便于字典编码）。
+    """
+    import pyarrow as pa  # type: ignore
+    if isinstance(arr, pa.ChunkedArray):
+        arr = arr.combine_chunks()
+    if hasattr(pa.types, "is_string_view") and pa.types.is_string_view(arr.type):
+        arr = arr.cast(pa.large_string())
+    return arr
+
+def make_fuzzy_udf(target_norm: str, memo: Optional[SimilarityMemo] = None, scorer: Optional[str] = None, cutoff: float = 0.0):
+    """
+    构造 fuzzy 条件的向量化UDF（DuckDB arrow 类型函数）：
+    - 每次调用接收一批取值（Arrow数组），字典编码去重后只对不同取值规范化并评分（经相似度缓存）
+    - 闭包内保留已评分结果，同一查询的后续批次不再重复查询缓存
+    - polars 引擎经 map_batches 复用同一函数（见 polars_batch）
+    """
+    import pyarrow as pa  # type: ignore
+    import pyarrow.compute as pc  # type: ignore
+    get_scorer(scorer)  # 未知评分器在编译阶段报错
+    known: Dict[str, float] = {}
+    def udf(arr):
+        enc = pc.dictionary_encode(arrow_text(arr))
+        norms = [normalize_text(v or "") for v in enc.dictionary.to_pylist()]
+        missing = {n for n in norms if n not in known}
+        if missing:
+            known.update(score_distinct(missing, target_norm, memo, scorer, cutoff))
+        return pc.take(pa.array([known[n] for n in norms], pa.float64()), enc.indices)
+    return udf
+
+def make_regex_udf(creg):
+    """
+    构造 regex 条件的向量化UDF：用于 RE2 不支持的 Python 正则（如前后查找），语义同 re.search。
+    """
+    import pyarrow as pa  # type: ignore
+    import pyarrow.compute as pc  # type: ignore
+    def udf(arr):
+        enc = pc.dictionary_encode(arrow_text(arr))
+        hits = [bool(creg.search(v or "")) for v in enc.dictionary.to_pylist()]
+        return pc.take(pa.array(hits, pa.bool_()), enc.indices)
+    return udf
+
+def make_normalize_udf():
+    """
+    构造 normalize_text 的向量化UDF（回退去重键“规范化Major”使用）。
+    """
+    import pyarrow as pa  # type: ignore
+    import pyarrow.compute as pc  # type: ignore
+    def udf(arr):
+        enc = pc.dictionary_encode(arrow_text(arr))
+        return pc.take(pa.array([normalize_text(v or "") for v in enc.dictionary.to_pylist()], pa.string()), enc.indices)
+    return udf
+
+def compile_conditions_sql(con, conditions: List[Dict[str, str]], columns: List[str], combine_mode: str, combine_threshold: float, write_audit: bool, memo: Optional[SimilarityMemo] = None, plan: Optional[Dict] = None, log=print, udfs: Optional[set] = None, types: Optional[Dict[str, str]] = None) -> Dict:
+    """
+    将条件集编译为 DuckDB 表达式（语义与 eval_conditions_block 一致）：
+    - 列统一按文本比较：coalesce(CAST(列 AS VARCHAR), '')；缺列按空串。types（列名 → DuckDB 类型）中的
+      BOOLEAN 列按 True/False 转文本，与 pandas 引擎 astype(str) 一致
+    - text/enum/boolean/code/number：SQL谓词（contains 按列合并词组，number 用 TRY_CAST）
+    - regex：translate_pattern 能改写为 RE2 下语义一致的写法（\\d→Unicode 数字、$ 允许结尾换行；含只认 ASCII 的 \\w \\s \\b 等时不能）
+      且 DuckDB 可编译时用 regexp_matches，否则注册 Python UDF（与 pandas/Polars 引擎一致按 Unicode 匹配）
+    - fuzzy：注册向量化UDF（见 make_fuzzy_udf），code_prefer 编码命中记 1.0
+    - udfs：该连接上已注册的UDF名集合（同一任务逐文件编译时传入同一个集合，每个UDF只注册一次）
+    - 取值非法（如 number 阈值不是数值）的条件同 pandas 引擎一样记录日志并跳过；其他编译错误（如注册UDF失败）直接抛出，不静默丢弃条件
+    返回：
+      {"sim": [(列名, 表达式)], "cond": [(命中列, 分数列, 命中表达式, 分数表达式)],
+       "match": 总命中表达式, "score": 总分表达式, "audit": [(列名, 表达式)], "internal": 内部列名列表}
+    """
+    if plan is None or plan.get("conditions") is not conditions:
+        plan = compile_condition_plan(conditions)
+    groups = contains_token_groups(conditions)
+    present = set(columns)
+    if udfs is None:
+        udfs = set()
+    def register(name: str, make, arg_types, return_type):
+        # UDF只依赖条件本身（与列集合无关），同一连接上按名称注册一次，后续文件直接复用
+        if name not in udfs:
+            con.create_function(name, make(), arg_types, return_type, type="arrow")
+            udfs.add(name)
+        return name
+    types = types or {}
+    def text_expr(column: str) -> str:
+        if column not in present:
+            return "''"
+        q = sql_ident(column)
+        if types.get(column) == "BOOLEAN":
+            return f"CASE WHEN {q} THEN 'True' WHEN NOT {q} THEN 'False' ELSE '' END"
+        return f"coalesce(CAST({q} AS VARCHAR), '')"
+    def code_expr(column: str) -> str:
+        return f"regexp_replace(regexp_extract({text_expr(column)}, '(\\d{{4,6}}[A-Z]{{0,3}})', 1), '[^0-9]', '', 'g')"
+    sim_cols = []
+    cond_cols = []
+    audit = []
+    hits = []
+    weighted = []
+    for idx, cond in enumerate(conditions, start=1):
+        col = cond["column"]
+        typ = cond["type"]
+        op = cond["operator"]
+        val = cond["value"]
+        th_raw = cond.get("threshold","")
+        opts = parse_options(cond.get("options",""))
+        ic = opts.get("ignore_case","").lower()=="true"
+        t = text_expr(col)
+        hit = "FALSE"
+        score = None
+        try:
+            w = float(cond.get("weight","1") or "1")
+            if typ == "text":
+                tc = f"lower({t})" if ic else t
+                target = val.lower() if ic else val
+                if op == "equals":
+                    hit = f"{tc} = {sql_literal(target)}"
+                elif op == "contains":
+                    group = groups.get(col)
+                    if group:
+                        tokens, g_ic = group
+                        gc = f"lower({t})" if g_ic else t
+                        hit = "(" + " OR ".join(f"contains({gc}, {sql_literal(x.lower() if g_ic else x)})" for x in tokens) + ")"
+                    else:
+                        hit = f"contains({tc}, {sql_literal(target)})"
+                elif op == "startswith":
+                    hit = f"starts_with({tc}, {sql_literal(target)})"
+                elif op == "endswith":
+                    hit = f"suffix({tc}, {sql_literal(target)})"
+            elif typ == "enum" and op == "in":
+                items = [x.strip() for x in val.split(";") if x.strip()]
+                hit = f"{t} IN ({', '.join(sql_literal(x) for x in items)})" if items else "FALSE"
+            elif typ == "number":
+                num = f"TRY_CAST({t} AS DOUBLE)"
+                if op == "between":
+                    parts = val.replace(" ","").split("-")
+                    lo = float(parts[0]); hi = float(parts[1])
+                    hit = f"coalesce({num} BETWEEN {lo!r} AND {hi!r}, FALSE)"
+                elif op == "min":
+                    hit = f"coalesce({num} >= {float(val)!r}, FALSE)"
+                elif op == "max":
+                    hit = f"coalesce({num} <= {float(val)!r}, FALSE)"
+                elif op == "equals":
+                    hit = f"coalesce({num} = {float(val)!r}, FALSE)"
+            elif typ == "boolean" and op == "is":
+                truth = val.lower() in ("true","1","yes","y","t")
+                hit = f"(lower({t}) IN ('true','1','yes','y','t')) = {'TRUE' if truth else 'FALSE'}"
+            elif typ == "regex" and op == "match":
+                creg = plan["regex"].get(id(cond))
+                if creg:
+                    # 只有改写后与 Python re 语义一致的模式才下推给 DuckDB 的 RE2，其余以 Python UDF 执行
+                    translated = translate_pattern(val, "re2")
+                    if translated is not None:
+                        try:
+                            con.execute(f"SELECT regexp_matches('', {sql_literal(translated)})")
+                        except Exception:
+                            translated = None
+                    if translated is not None:
+                        hit = f"regexp_matches({t}, {sql_literal(translated)})"
+                    else:
+                        name = register(f"__regex_{idx}", lambda: make_regex_udf(creg), ["VARCHAR"], "BOOLEAN")
+                        hit = f"{name}({t})"
+            elif typ == "code" and op == "equals":
+                hit = f"{code_expr(col)} = {sql_literal(re.sub(r'[^0-9]', '', val))}"
+            elif typ == "fuzzy" and op == "similar":
+                th = 0.0
+                if th_raw:
+                    th = float(th_raw[:-1])/100.0 if th_raw.endswith("%") else float(th_raw)
+                name = register(f"__fuzzy_{idx}", lambda: make_fuzzy_udf(normalize_text(val), memo, *condition_scorer(opts, th)), ["VARCHAR"], "DOUBLE")
+                sim_col = f"__sim_{idx}"
+                sim_cols.append((sim_col, f"{name}({t})"))
+                sim = sql_ident(sim_col)
+                if opts.get("code_prefer","").lower()=="true" and extract_code(val):
+                    hit_code = f"({code_expr(col)} = {sql_literal(extract_code(val))})"
+                    score = f"CASE WHEN {hit_code} THEN 1.0 ELSE {sim} END"
+                    hit = f"({hit_code} OR {sim} >= {th!r})"
+                else:
+                    score = sim
+                    hit = f"{sim} >= {th!r}"
+        except (ValueError, IndexError) as e:
+            log(f"条件评估错误（跳过）：{col}:{typ}/{op} -> {e}")
+            continue
+        h_col, s_col = f"__hit_{idx}", f"__score_{idx}"
+        cond_cols.append((h_col, s_col, f"coalesce({hit}, FALSE)", score or f"CAST({sql_ident(h_col)} AS DOUBLE)"))
+        hits.append(sql_ident(h_col))
+        weighted.append(f"{sql_ident(s_col)} * {w!r}")
+        if write_audit:
+            audit.append((f"_cond_{idx}_match", sql_ident(h_col)))
+            audit.append((f"_cond_{idx}_score", f"round({sql_ident(s_col)}, 4)"))
+            audit.append((f"_cond_{idx}_desc", sql_literal(f"{col}:{typ}/{op}={val}")))
+    total = " + ".join(weighted) if weighted else "0.0"
+    if combine_mode == "AND":
+        match = " AND ".join(hits) if hits else "TRUE"
+    elif combine_mode == "OR":
+        match = " OR ".join(hits) if hits else "FALSE"
+    else:
+        match = f"({total}) >= {float(combine_threshold)!r}"
+    internal = [c for c, _ in sim_cols] + [c for h, s, _, _ in cond_cols for c in (h, s)]
+    return {"sim": sim_cols, "cond": cond_cols, "match": match, "score": total, "audit": audit, "internal": internal}
+
+def excel_to_parquet_parts(pd, excel_path: str, sheet: str, chunk_size: int, tmp_dir: str) -> Tuple[List[str], int]:
+    """
+    将 Excel 输入（按 SHEET 规则）流式转换为临时 Parquet 文件，供 duckdb/polars 引擎查询：
+    - openpyxl 分块读取，列按文本存储（同 pandas 引擎 astype(str) 的写法），空值保留为 null
+    - 列名变化（多工作表表头不同）时另起一个文件，查询时按列名合并
+    返回：
+      (Parquet 文件路径列表, 总行数)
+    """
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+    parts = []
+    writer = None
+    names = None
+    rows = 0
+    try:
+        for f, sh in build_sheet_frames(pd, excel_path, sheet):
+            for block in chunk_generator_from_excel(pd, f, sh, chunk_size):
+                cols = [str(c) for c in block.columns]
+                table = pa.table({c: pa.array(block[c].astype(str).where(block[c].notna()), pa.string(), from_pandas=True) for c in block.columns})
+                if writer is None or cols != names:
+                    if writer is not None:
+                        writer.close()
+                    parts.append(os.path.join(tmp_dir, f"excel_{len(parts):04d}.parquet"))
+                    writer = pq.ParquetWriter(parts[-1], table.schema, compression="zstd")
+                    names = cols
+                writer.write_table(table)
+                rows += len(block)
+    finally:
+        if writer is not None:
+            writer.close()
+    return parts, rows
+
+# pandas.read_csv 默认识别为缺失值的字符串（duckdb/polars 引擎读取 CSV 时按 pandas 引擎的规则处理，见 csv_pandas_kind）
+PANDAS_NA_VALUES = ("", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+                    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null")
+# 按 pandas 引擎的推断规则判断整列类型：整数 / 浮点数（含 inf）/ 布尔（True/TRUE/true、False/FALSE/false）
+CSV_INT_PATTERN = r"[+-]?[0-9]+"
+CSV_FLOAT_PATTERN = r"[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?|[+-]?(?:inf|Inf|INF|infinity|Infinity)"
+CSV_BOOL_VALUES = ("True", "TRUE", "true", "False", "FALSE", "false")
+
+# duckdb/polars 引擎 CSV 列类型（按 引擎+路径+修改时间+大小 缓存）：每个文件只统计一次
+_CSV_ENGINE_TYPES: Dict[Tuple, Dict[str, str]] = {}
+
+def csv_arrow_backend() -> bool:
+    """
+    pandas 引擎读取 CSV 是否使用 pyarrow 后端（CSV_BACKEND 为 auto/pyarrow 且已安装 pyarrow，见 chunk_generator_from_csv）。
+    """
+    return (CSV_BACKEND or "auto").lower() in ("auto", "pyarrow") and module_installed("pyarrow")
+
+def csv_pandas_kind(non_null: int, is_int: bool, is_float: bool, is_bool: bool) -> str:
+    """
+    由整列统计（缺失值 PANDAS_NA_VALUES 不计）得到 pandas 引擎读取后的列类型："int" / "float" / "bool" / "str"：
+    - 全部为 int64 范围内的整数 → int（含缺失时 pandas 为 float64，值不变）；全部为数值 → float（超出 int64 的整数同样为 float）
+    - 全部为布尔字面量 → bool；全部缺失或其余 → str
+    """
+    if non_null == 0:
+        return "str"
+    if is_int:
+        return "int"
+    if is_float:
+        return "float"
+    if is_bool:
+        return "bool"
+    return "str"
+
+def duckdb_csv_source(con, path: str, key: str) -> str:
+    """
+    CSV 的 DuckDB 数据源，列类型与 pandas 引擎一致（而不是全部按文本）：
+    - 先全部按文本读取，一次聚合统计每列的非缺失值是否全为整数/数值/布尔（见 csv_pandas_kind），再按结果 CAST
+      （如 Zip=00123 → 123，text equals 123 与 pandas 引擎同样命中；全数字的编码列同样变为整数）
+    - 数值/布尔列中的 PANDAS_NA_VALUES 记为缺失；文本列在 pandas 后端下同样记为缺失，pyarrow 后端下保留原文（与 pandas 引擎一致）
+    key：缓存键中的源文件（转码前的输入路径）
+    """
+    raw = f"read_csv({sql_literal(path)}, header=true, all_varchar=true, delim=',', quote='\"')"
+    na = ", ".join(sql_literal(x) for x in PANDAS_NA_VALUES)
+    arrow = csv_arrow_backend()
+    st = os.stat(key)
+    ck = ("duckdb", os.path.abspath(key), st.st_mtime_ns, st.st_size)
+    kinds = _CSV_ENGINE_TYPES.get(ck)
+    if kinds is None:
+        columns = [r[0] for r in con.execute(f"DESCRIBE SELECT * FROM {raw}").fetchall()]
+        aggs = []
+        for c in columns:
+            q = sql_ident(c)
+            valid = f"FILTER (WHERE {q} IS NOT NULL AND {q} NOT IN ({na}))"
+            aggs += [f"count(*) {valid}",
+                     f"coalesce(bool_and(regexp_full_match({q}, {sql_literal(CSV_INT_PATTERN)}) AND TRY_CAST({q} AS BIGINT) IS NOT NULL) {valid}, FALSE)",
+                     f"coalesce(bool_and(regexp_full_match({q}, {sql_literal(CSV_FLOAT_PATTERN)})) {valid}, FALSE)",
+                     f"coalesce(bool_and({q} IN ({', '.join(sql_literal(x) for x in CSV_BOOL_VALUES)})) {valid}, FALSE)"]
+        stats = con.execute(f"SELECT {', '.join(aggs)} FROM {raw}").fetchone() if aggs else ()
+        kinds = _CSV_ENGINE_TYPES[ck] = {c: csv_pandas_kind(*stats[4 * i:4 * i + 4]) for i, c in enumerate(columns)}
+    sql_types = {"int": "BIGINT", "float": "DOUBLE", "bool": "BOOLEAN"}
+    cols = []
+    for c, k in kinds.items():
+        q = sql_ident(c)
+        if k in sql_types:
+            cols.append(f"CAST(CASE WHEN {q} IN ({na}) THEN NULL ELSE {q} END AS {sql_types[k]}) AS {q}")
+        elif not arrow:
+            cols.append(f"CASE WHEN {q} IN ({na}) THEN NULL ELSE {q} END AS {q}")
+        else:
+            cols.append(q)
+    return f"(SELECT {', '.join(cols)} FROM {raw})" if cols else raw
+
+def duckdb_source(con, pd, fp: str, sheet: str, chunk_size: int, tmp_dir: str) -> Tuple[str, int]:
+    """
+    生成输入文件的 DuckDB 数据源（FROM 子句）与行数：
+    - Parquet：read_parquet（列裁剪与行数来自元数据）
+    - CSV：read_csv 后按 pandas 的规则推断并转换列类型（见 duckdb_csv_source）；gzip/zstd 压缩由 DuckDB 直接解压，非UTF-8或 xz 压缩文件先转码一次（见 transcode_to_utf8）
+    - Excel：先转换为临时 Parquet（见 excel_to_parquet_parts），再以 read_parquet 读取
+    """
+    fmt = input_format(fp)
+    if fmt == "parquet":
+        src = f"read_parquet({sql_literal(fp)})"
+        return src, con.execute(f"SELECT count(*) FROM {src}").fetchone()[0]
+    if fmt == "csv":
+        encoding = detect_csv_encoding(fp)
+        native = encoding in ("utf-8", "utf-8-sig") and split_compression(fp)[1] in (None, "gzip", "zstd")
+        path = fp if native else transcode_to_utf8(fp, encoding)
+        return duckdb_csv_source(con, path, fp), total_rows_csv(fp)
+    parts, rows = excel_to_parquet_parts(pd, fp, sheet, chunk_size, tmp_dir)
+    if not parts:
+        return "(SELECT NULL AS __empty WHERE FALSE)", 0
+    return f"read_parquet([{', '.join(sql_literal(x) for x in parts)}], union_by_name=true)", rows
+
+def engine_output_path(out_path: str) -> str:
+    """
+    duckdb/polars 引擎的输出路径：
+    - 指定了 OUTPUT_FORMAT（xlsx 除外）时按其替换扩展名
+    - 否则扩展名为 .parquet/.csv（含 .csv.gz/.csv.zst/.csv.xz）时保留，其余替换为 ENGINE_OUTPUT_FORMAT
+    """
+    out_path = resolve_path(out_path)
+    if OUTPUT_FORMAT and OUTPUT_FORMAT.lower().lstrip(".") != "xlsx":
+        return apply_output_format(out_path)
+    base, codec = split_compression(out_path)
+    stem, ext = os.path.splitext(base)
+    if ext.lower() == ".csv" or ext.lower() == ".parquet" and not codec:
+        return out_path
+    return stem + "." + (ENGINE_OUTPUT_FORMAT or "parquet").lower().lstrip(".")
+
+def compress_file(src: str, dst: str, codec: Optional[str]) -> None:
+    """
+    将已写好的文件流式压缩为 dst（见 open_output_binary），完成后删除 src。
+    """
+    with open(src, "rb") as fin, open_output_binary(dst, codec) as fout:
+        while True:
+            block = fin.read(1 << 22)
+            if not block:
+                break
+            fout.write(block)
+    os.remove(src)
+
+def duckdb_write(con, query: str, columns: List[str], out_path: str, append: bool, dedup: bool, dedup_key: Optional[str], major_col: str) -> Tuple[str, int]:
+    """
+    将结果查询写出为 Parquet/CSV（语义同 write_output）：
+    - 去重：dedup_key 存在按该列保留首行，否则按“规范化Major|编码”回退键
+    - 追加：旧结果在前、本次结果在后，先写临时文件再替换
+    参数：
+      query：结果查询（需含 __order 排序列，写出时剔除）
+    返回：
+      (写出路径, 写出行数)
+    """
+    out_path = engine_output_path(out_path)
+    base, codec = split_compression(out_path)
+    is_csv = base.lower().endswith(".csv")
+    body = f"SELECT * FROM ({query})"
+    if dedup:
+        if dedup_key and dedup_key in columns:
+            key = sql_ident(dedup_key)
+        else:
+            key = f"__normalize(coalesce(CAST({sql_ident(major_col)} AS VARCHAR), '')) || '|'" if major_col in columns else "''"
+        body += f" QUALIFY row_number() OVER (PARTITION BY {key} ORDER BY __order) = 1"
+    body = f"SELECT * EXCLUDE (__order) FROM ({body} ORDER BY __order)"
+    if append and os.path.exists(out_path):
+        old_path = out_path if codec in (None, "gzip", "zstd") else transcode_to_utf8(out_path, "utf-8")
+        old = f"read_csv({sql_literal(old_path)}, header=true, all_varchar=true)" if is_csv else f"read_parquet({sql_literal(out_path)})"
+        body = f"SELECT * EXCLUDE (__part) FROM (SELECT *, 0 AS __part FROM {old} UNION ALL BY NAME SELECT *, 1 AS __part FROM ({body})) ORDER BY __part"
+    tmp = out_path + ".part"
+    fmt = "FORMAT CSV, HEADER" if is_csv else "FORMAT PARQUET, COMPRESSION ZSTD"
+    if is_csv and codec in ("gzip", "zstd"):
+        fmt += f", COMPRESSION {codec.upper()}"
+    n = con.execute(f"COPY ({body}) TO {sql_literal(tmp)} ({fmt})").fetchone()[0]
+    if is_csv and codec == "xz":
+        # DuckDB 不支持 xz 写出：先写未压缩 CSV，再流式压缩
+        compress_file(tmp, tmp + ".xz", codec)
+        tmp += ".xz"
+    os.replace(tmp, out_path)
+    return out_path, int(n)
+
+def run_duckdb_job(pd, job: Dict, conditions: List[Dict[str, str]], plan: Optional[Dict] = None, memo: Optional[SimilarityMemo] = None, log=print, on_event=None, should_stop=None) -> Dict:
+    """
+    以 DuckDB 执行一个筛选任务（ENGINE="duckdb"）：
+    - 每个输入文件：条件编译为一条查询，命中行（含 _match_all/_score_all 与可选审计列）落入临时表
+    - 逐文件写出 Parquet/CSV，再按文件顺序合并写出；并行、溢写与列裁剪由 DuckDB 负责
+    - 事件与返回值同 run_filter_job；should_stop 返回True时中断正在执行的查询
+    """
+    import duckdb  # type: ignore
+    import tempfile
+    import threading
+    emit = on_event or (lambda ev: None)
+    files = job.get("files") or []
+    sheet = job.get("sheet") or ""
+    combine_mode = job.get("combine_mode") or "OR"
+    combine_threshold = float(job.get("combine_threshold", 0.8))
+    chunk_size = int(job.get("chunk_size") or 50000)
+    write_audit = bool(job.get("write_audit"))
+    major_col = job.get("major_col") or "Major"
+    append = bool(job.get("append"))
+    dedup = bool(job.get("dedup"))
+    dedup_key = job.get("dedup_key")
+    total_written = []
+    merged_saved = None
+    matched_total = 0
+    total_rows = 0
+    stopped = False
+    t0 = time.time()
+    with tempfile.TemporaryDirectory(prefix="filter_duckdb_") as tmp_dir:
+        con = duckdb.connect()
+        con.execute(f"SET temp_directory = {sql_literal(tmp_dir)}")
+        if DUCKDB_MEMORY_LIMIT:
+            con.execute(f"SET memory_limit = {sql_literal(DUCKDB_MEMORY_LIMIT)}")
+        if DUCKDB_THREADS:
+            con.execute(f"SET threads = {int(DUCKDB_THREADS)}")
+        con.create_function("__normalize", make_normalize_udf(), ["VARCHAR"], "VARCHAR", type="arrow")
+        udfs = set()
+        done = threading.Event()
+        def _watch():
+            while not done.wait(0.2):
+                if should_stop and should_stop():
+                    con.interrupt()
+                    return
+        watcher = threading.Thread(target=_watch, name="duckdb-stop-watch", daemon=True)
+        watcher.start()
+        results = []
+        try:
+            for pth in files:
+                if should_stop and should_stop():
+                    stopped = True
+                    break
+                pth = resolve_path(pth)
+                if not os.path.exists(pth):
+                    log(f"文件不存在：{pth}（跳过）")
+                    continue
+                out_dir = job.get("out_dir") or os.path.dirname(pth)
+                base = os.path.splitext(os.path.basename(split_compression(pth)[0]))[0]
+                log(f"开始处理：{os.path.basename(pth)}")
+                file_start = time.time()
+                src, file_rows = duckdb_source(con, pd, pth, sheet, chunk_size, tmp_dir)
+                emit({"type": "file_start", "file": pth, "total": file_rows})
+                types = {r[0]: r[1] for r in con.execute(f"DESCRIBE SELECT * FROM {src}").fetchall()}
+                columns = list(types)
+                q = compile_conditions_sql(con, conditions, columns, combine_mode, combine_threshold, write_audit, memo, plan, log, udfs, types)
+                rel = f"SELECT * FROM {src}"
+                if q["sim"]:
+                    rel = f"SELECT *, {', '.join(f'{e} AS {sql_ident(c)}' for c, e in q['sim'])} FROM ({rel})"
+                if q["cond"]:
+                    rel = f"SELECT *, {', '.join(f'{h} AS {sql_ident(hc)}' for hc, _, h, _ in q['cond'])} FROM ({rel})"
+                    rel = f"SELECT *, {', '.join(f'{s} AS {sql_ident(sc)}' for _, sc, _, s in q['cond'])} FROM ({rel})"
+                extra = "".join(f", {e} AS {sql_ident(c)}" for c, e in q["audit"])
+                exclude = f" EXCLUDE ({', '.join(sql_ident(c) for c in q['internal'])})" if q["internal"] else ""
+                table = f"__result_{len(results)}"
+                con.execute(
+                    f"CREATE TEMP TABLE {table} AS SELECT *{exclude}{extra}, ({q['match']}) AS _match_all, round({q['score']}, 4) AS _score_all "
+                    f"FROM ({rel}) WHERE {q['match']}"
+                )
+                if memo is not None:
+                    memo.flush()
+                total_rows += file_rows
+                matched = con.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+                emit({"type": "progress", "file": pth, "rows": file_rows, "total": file_rows, "matched": matched, "elapsed": round(time.time() - file_start, 3)})
+                if matched:
+                    out_cols = [r[0] for r in con.execute(f"DESCRIBE {table}").fetchall()]
+                    saved, _ = duckdb_write(con, f"SELECT *, rowid AS __order FROM {table}", out_cols, os.path.join(out_dir, f"{base}_filtered"), append, dedup, dedup_key, major_col)
+                    log(f"已写出：{saved}（{matched} 行）")
+                    emit({"type": "file_done", "file": pth, "output": saved, "rows": matched})
+                    total_written.append(saved)
+                    results.append((table, out_cols))
+                    matched_total += matched
+                else:
+                    log("无命中结果，跳过写出")
+                    emit({"type": "file_done", "file": pth, "output": None, "rows": 0})
+                    con.execute(f"DROP TABLE {table}")
+            if results and not stopped:
+                union = " UNION ALL BY NAME ".join(
+                    f"SELECT *, ({i} * 4294967296 + rowid) AS __order FROM {table}" for i, (table, _) in enumerate(results)
+                )
+                columns = list(dict.fromkeys(c for _, cols in results for c in cols))
+                m_out = job.get("merge_out") or os.path.join(os.path.dirname(files[0]) if files else os.getcwd(), "merged_filtered.xlsx")
+                merged_saved, merged_rows = duckdb_write(con, union, columns, m_out, append, dedup, dedup_key, major_col)
+                log(f"合并写出：{merged_saved}（{matched_total} 行）")
+                emit({"type": "merged", "output": merged_saved, "rows": merged_rows})
+        except (duckdb.InterruptException, KeyboardInterrupt):
+            stopped = True
+            log("已中止：当前文件结果未写出")
+        finally:
+            done.set()
+            con.close()
+    t1 = time.time()
+    log(f"完成：总计处理 {total_rows} 行，耗时 {int(t1-t0)} 秒")
+    result = {"outputs": total_written, "merged": merged_saved, "rows": total_rows, "matched": matched_total, "seconds": round(t1 - t0, 3), "stopped": stopped}
+    emit(dict(result, type="done"))
+    return result
+
+# ===================== Polars 后端 =====================
+def polars_batch(pl, udf, dtype):
+    """
+    将 Arrow 向量化UDF（make_fuzzy_udf 等）包装为 Polars map_batches 函数。
+    """
+    def fn(s):
+        return pl.Series(s.name, udf(s.to_arrow()), dtype=dtype)
+    return fn
+
+def compile_conditions_polars(pl, conditions: List[Dict[str, str]], columns: List[str], combine_mode: str, combine_threshold: float, write_audit: bool, memo: Optional[SimilarityMemo] = None, plan: Optional[Dict] = None, log=print, types: Optional[Dict] = None) -> Dict:
+    """
+    将条件集编译为 Polars 表达式（语义与 eval_conditions_block 一致）：
+    - 列统一按文本比较（cast String + 空值填空串）；缺列按空串。types（列名 → Polars 类型）中的布尔列按 True/False、
+      浮点列按 Python 的写法（如 1e-05）转文本，与 pandas 引擎 astype(str) 一致
+    - text contains 按列合并词组，用 str.contains_any（Aho-Corasick）；enum 用 is_in；number 用 cast(Float64, strict=False) 比较
+    - regex：Rust regex 可编译时用 str.contains，否则以 Python re 的 map_batches 执行
+    - fuzzy：map_batches 向量化评分（同样使用相似度缓存），code_prefer 编码命中记 1.0
+    返回：
+      {"sim": [表达式], "hit": [表达式], "score": [表达式], "final": [审计列/_match_all/_score_all 表达式], "internal": 内部列名列表}
+    """
+    if plan is None or plan.get("conditions") is not conditions:
+        plan = compile_condition_plan(conditions)
+    groups = contains_token_groups(conditions)
+    present = set(columns)
+    types = types or {}
+    def text_expr(column: str):
+        if column not in present:
+            return pl.lit("")
+        dtype = types.get(column)
+        if dtype == pl.Boolean:
+            return pl.when(pl.col(column)).then(pl.lit("True")).when(~pl.col(column)).then(pl.lit("False")).otherwise(pl.lit(""))
+        if dtype is not None and dtype.is_float():
+            # Polars 的浮点转文本与 Python 不同（1e-05 → 0.00001），按 numpy（同 Python repr）转换
+            text = pl.col(column).map_batches(lambda s: pl.Series(s.name, s.fill_null(0.0).to_numpy().astype(str)), return_dtype=pl.String, is_elementwise=True)
+            return pl.when(pl.col(column).is_null()).then(pl.lit("")).otherwise(text)
+        return pl.col(column).cast(pl.String).fill_null("")
+    def code_expr(column: str):
+        return text_expr(column).str.extract(r"(\d{4,6}[A-Z]{0,3})", 1).fill_null("").str.replace_all("[^0-9]", "")
+    sims, hit_exprs, score_exprs, audit = [], [], [], []
+    hits, weighted = [], []
+    for idx, cond in enumerate(conditions, start=1):
+        col = cond["column"]
+        typ = cond["type"]
+        op = cond["operator"]
+        val = cond["value"]
+        th_raw = cond.get("threshold","")
+        opts = parse_options(cond.get("options",""))
+        ic = opts.get("ignore_case","").lower()=="true"
+        t = text_expr(col)
+        hit = pl.lit(False)
+        score = None
+        try:
+            w = float(cond.get("weight","1") or "1")
+            if typ == "text":
+                tc = t.str.to_lowercase() if ic else t
+                target = val.lower() if ic else val
+                if op == "equals":
+                    hit = tc == target
+                elif op == "contains":
+                    group = groups.get(col)
+                    if group:
+                        tokens, g_ic = group
+                        gc = t.str.to_lowercase() if g_ic else t
+                        hit = gc.str.contains_any([x.lower() if g_ic else x for x in tokens])
+                    else:
+                        hit = tc.str.contains(target, literal=True)
+                elif op == "startswith":
+                    hit = tc.str.starts_with(target)
+                elif op == "endswith":
+                    hit = tc.str.ends_with(target)
+            elif typ == "enum" and op == "in":
+                items = [x.strip() for x in val.split(";") if x.strip()]
+                hit = t.is_in(items) if items else pl.lit(False)
+            elif typ == "number":
+                num = t.str.strip_chars().cast(pl.Float64, strict=False)
+                if op == "between":
+                    parts = val.replace(" ","").split("-")
+                    lo = float(parts[0]); hi = float(parts[1])
+                    hit = (num >= lo) & (num <= hi)
+                elif op == "min":
+                    hit = num >= float(val)
+                elif op == "max":
+                    hit = num <= float(val)
+                elif op == "equals":
+                    hit = num == float(val)
+            elif typ == "boolean" and op == "is":
+                truth = val.lower() in ("true","1","yes","y","t")
+                hit = t.str.to_lowercase().is_in(["true","1","yes","y","t"]) == truth
+            elif typ == "regex" and op == "match":
+                creg = plan["regex"].get(id(cond))
+                if creg:
+                    try:
+                        pl.select(pl.lit("").str.contains(val))
+                        hit = t.str.contains(val)
+                    except Exception:
+                        hit = t.map_batches(polars_batch(pl, make_regex_udf(creg), pl.Boolean), return_dtype=pl.Boolean, is_elementwise=True)
+            elif typ == "code" and op == "equals":
+                hit = code_expr(col) == re.sub(r"[^0-9]", "", val)
+            elif typ == "fuzzy" and op == "similar":
+                th = 0.0
+                if th_raw:
+                    th = float(th_raw[:-1])/100.0 if th_raw.endswith("%") else float(th_raw)
+                sim_col = f"__sim_{idx}"
+                sims.append(t.map_batches(polars_batch(pl, make_fuzzy_udf(normalize_text(val), memo, *condition_scorer(opts, th)), pl.Float64), return_dtype=pl.Float64, is_elementwise=True).alias(sim_col))
+                sim = pl.col(sim_col)
+                if opts.get("code_prefer","").lower()=="true" and extract_code(val):
+                    hit_code = code_expr(col) == extract_code(val)
+                    score = pl.when(hit_code).then(pl.lit(1.0)).otherwise(sim)
+                    hit = hit_code | (sim >= th)
+                else:
+                    score = sim
+                    hit = sim >= th
+        except Exception as e:
+            log(f"条件评估错误（跳过）：{col}:{typ}/{op} -> {e}")
+            continue
+        h_col, s_col = f"__hit_{idx}", f"__score_{idx}"
+        hit_exprs.append(hit.fill_null(False).alias(h_col))
+        score_exprs.append((score if score is not None else pl.col(h_col).cast(pl.Float64)).alias(s_col))
+        hits.append(pl.col(h_col))
+        weighted.append(pl.col(s_col) * w)
+        if write_audit:
+            audit.append(pl.col(h_col).alias(f"_cond_{idx}_match"))
+            audit.append(pl.col(s_col).round(4).alias(f"_cond_{idx}_score"))
+            audit.append(pl.lit(f"{col}:{typ}/{op}={val}").alias(f"_cond_{idx}_desc"))
+    # 与 pandas 引擎相同的从左到右累加顺序（浮点和与阈值比较的结果才一致）
+    total = pl.lit(0.0)
+    for term in weighted:
+        total = total + term
+    if combine_mode == "AND":
+        match = pl.all_horizontal(hits) if hits else pl.lit(True)
+    elif combine_mode == "OR":
+        match = pl.any_horizontal(hits) if hits else pl.lit(False)
+    else:
+        match = total >= float(combine_threshold)
+    final = audit + [match.alias("_match_all"), total.round(4).alias("_score_all")]
+    internal = [e.meta.output_name() for e in sims + hit_exprs + score_exprs]
+    return {"sim": sims, "hit": hit_exprs, "score": score_exprs, "final": final, "internal": internal}
+
+def polars_csv_scan(pl, path: str, key: str):
+    """
+    CSV 的 LazyFrame 扫描，列类型与 pandas 引擎一致（规则同 duckdb_csv_source）：全部按文本扫描，
+    一次聚合统计每列的非缺失值是否全为整数/数值/布尔，再按结果转换类型。
+    """
+    lf = pl.scan_csv(path, infer_schema=False)
+    na = list(PANDAS_NA_VALUES)
+    st = os.stat(key)
+    ck = ("polars", os.path.abspath(key), st.st_mtime_ns, st.st_size)
+    kinds = _CSV_ENGINE_TYPES.get(ck)
+    if kinds is None:
+        columns = lf.collect_schema().names()
+        aggs = []
+        for i, c in enumerate(columns):
+            col = pl.when(pl.col(c).is_in(na)).then(None).otherwise(pl.col(c))
+            aggs += [col.count().alias(f"__n{i}"),
+                     (col.str.contains(f"^(?:{CSV_INT_PATTERN})$") & col.cast(pl.Int64, strict=False).is_not_null()).fill_null(True).all().alias(f"__i{i}"),
+                     col.str.contains(f"^(?:{CSV_FLOAT_PATTERN})$").fill_null(True).all().alias(f"__f{i}"),
+                     (col.is_in(list(CSV_BOOL_VALUES)) | col.is_null()).all().alias(f"__b{i}")]
+        stats = lf.select(aggs).collect().row(0, named=True) if aggs else {}
+        kinds = _CSV_ENGINE_TYPES[ck] = {c: csv_pandas_kind(stats[f"__n{i}"], stats[f"__i{i}"], stats[f"__f{i}"], stats[f"__b{i}"])
+                                         for i, c in enumerate(columns)}
+    arrow = csv_arrow_backend()
+    casts = []
+    for c, k in kinds.items():
+        col = pl.when(pl.col(c).is_in(na)).then(None).otherwise(pl.col(c))
+        if k == "int":
+            casts.append(col.cast(pl.Int64).alias(c))
+        elif k == "float":
+            casts.append(col.str.to_lowercase().str.replace(r"^([+-]?)infinity$", "${1}inf").cast(pl.Float64).alias(c))
+        elif k == "bool":
+            casts.append((col.str.to_lowercase() == "true").alias(c))
+        elif not arrow:
+            casts.append(col.alias(c))
+    return lf.with_columns(casts) if casts else lf
+
+def polars_source(pl, pd, fp: str, sheet: str, chunk_size: int, tmp_dir: str):
+    """
+    生成输入文件的 LazyFrame 扫描与行数：
+    - CSV：scan_csv 后按 pandas 的规则推断并转换列类型（见 polars_csv_scan）；非UTF-8或压缩文件先转码/解压一次
+    - Parquet：scan_parquet（投影下推只读取用到的列）
+    - Excel：先转换为临时 Parquet（见 excel_to_parquet_parts），再按列名对角合并扫描
+    """
+    fmt = input_format(fp)
+    if fmt == "parquet":
+        return pl.scan_parquet(fp), estimate_total_rows(fp, sheet)
+    if fmt == "csv":
+        encoding = detect_csv_encoding(fp)
+        native = encoding in ("utf-8", "utf-8-sig") and split_compression(fp)[1] is None
+        path = fp if native else transcode_to_utf8(fp, encoding)
+        return polars_csv_scan(pl, path, fp), total_rows_csv(fp)
+    parts, rows = excel_to_parquet_parts(pd, fp, sheet, chunk_size, tmp_dir)
+    if not parts:
+        return pl.LazyFrame(), 0
+    return pl.concat([pl.scan_parquet(x) for x in parts], how="diagonal_relaxed"), rows
+
+def polars_write(pl, lf, columns: List[str], out_path: str, append: bool, dedup: bool, dedup_key: Optional[str], major_col: str) -> Tuple[str, int]:
+    """
+    将结果 LazyFrame 流式写出为 Parquet/CSV（语义同 write_output）：
+    - 去重：unique(subset=...) 保留首行并保持顺序；dedup_key 缺失时按“规范化Major|编码”回退键
+    - 追加：旧结果在前、本次结果在后，先写临时文件再替换
+    返回：
+      (写出路径, 写出行数)
+    """
+    out_path = engine_output_path(out_path)
+    base, codec = split_compression(out_path)
+    is_csv = base.lower().endswith(".csv")
+    if dedup:
+        if dedup_key and dedup_key in columns:
+            lf = lf.unique(subset=[dedup_key], keep="first", maintain_order=True)
+        else:
+            if major_col in columns:
+                norm = pl.col(major_col).cast(pl.String).fill_null("").map_batches(polars_batch(pl, make_normalize_udf(), pl.String), return_dtype=pl.String, is_elementwise=True)
+                key = norm + "|"
+            else:
+                key = pl.lit("")
+            lf = lf.with_columns(key.alias("__dedup_key")).unique(subset=["__dedup_key"], keep="first", maintain_order=True).drop("__dedup_key")
+    if append and os.path.exists(out_path):
+        old = pl.scan_csv(transcode_to_utf8(out_path, "utf-8") if codec else out_path, infer_schema=False) if is_csv else pl.scan_parquet(out_path)
+        lf = pl.concat([old, lf], how="diagonal_relaxed")
+    tmp = out_path + ".part"
+    if is_csv:
+        lf.sink_csv(tmp, include_bom=True, engine="streaming")
+    else:
+        lf.sink_parquet(tmp, compression="zstd", engine="streaming")
+    n = (pl.scan_csv(tmp, infer_schema=False) if is_csv else pl.scan_parquet(tmp)).select(pl.len()).collect().item()
+    if codec:
+        # Polars 不支持压缩 CSV 写出：先写未压缩 CSV，再流式压缩（zstd 多线程）
+        compress_file(tmp, tmp + ".z", codec)
+        tmp += ".z"
+    os.replace(tmp, out_path)
+    return out_path, int(n)
+
+def run_polars_job(pd, job: Dict, conditions: List[Dict[str, str]], plan: Optional[Dict] = None, memo: Optional[SimilarityMemo] = None, log=print, on_event=None, should_stop=None) -> Dict:
+    """
+    以 Polars 执行一个筛选任务（ENGINE="polars"）：
+    - 每个输入文件：LazyFrame 扫描 → 条件表达式 → 过滤命中行，以流式引擎写入临时 Parquet（投影下推、多线程、超内存分批）
+    - 逐文件去重写出，再按文件顺序对角合并后去重写出
+    - 事件与返回值同 run_filter_job；should_stop 在文件之间检查
+    """
+    import polars as pl  # type: ignore
+    import tempfile
+    emit = on_event or (lambda ev: None)
+    files = job.get("files") or []
+    sheet = job.get("sheet") or ""
+    combine_mode = job.get("combine_mode") or "OR"
+    combine_threshold = float(job.get("combine_threshold", 0.8))
+    chunk_size = int(job.get("chunk_size") or 50000)
+    write_audit = bool(job.get("write_audit"))
+    major_col = job.get("major_col") or "Major"
+    append = bool(job.get("append"))
+    dedup = bool(job.get("dedup"))
+    dedup_key = job.get("dedup_key")
+    total_written = []
+    merged_saved = None
+    matched_total = 0
+    total_rows = 0
+    stopped = False
+    t0 = time.time()
+    with tempfile.TemporaryDirectory(prefix="filter_polars_") as tmp_dir:
+        results = []
+        for pth in files:
+            if should_stop and should_stop():
+                stopped = True
+                break
+            pth = resolve_path(pth)
+            if not os.path.exists(pth):
+                log(f"文件不存在：{pth}（跳过）")
+                continue
+            out_dir = job.get("out_dir") or os.path.dirname(pth)
+            base = os.path.splitext(os.path.basename(split_compression(pth)[0]))[0]
+            log(f"开始处理：{os.path.basename(pth)}")
+            file_start = time.time()
+            lf, file_rows = polars_source(pl, pd, pth, sheet, chunk_size, tmp_dir)
+            emit({"type": "file_start", "file": pth, "total": file_rows})
+            schema = lf.collect_schema()
+            columns = schema.names()
+            q = compile_conditions_polars(pl, conditions, columns, combine_mode, combine_threshold, write_audit, memo, plan, log, dict(schema))
+            if q["sim"]:
+                lf = lf.with_columns(q["sim"])
+            lf = lf.with_columns(q["hit"]).with_columns(q["score"]).with_columns(q["final"])
+            lf = lf.filter(pl.col("_match_all")).drop(q["internal"])
+            part = os.path.join(tmp_dir, f"result_{len(results):04d}.parquet")
+            lf.sink_parquet(part, engine="streaming")
+            if memo is not None:
+                memo.flush()
+            total_rows += file_rows
+            matched = pl.scan_parquet(part).select(pl.len()).collect().item()
+            emit({"type": "progress", "file": pth, "rows": file_rows, "total": file_rows, "matched": matched, "elapsed": round(time.time() - file_start, 3)})
+            if matched:
+                out_cols = pl.scan_parquet(part).collect_schema().names()
+                saved, _ = polars_write(pl, pl.scan_parquet(part), out_cols, os.path.join(out_dir, f"{base}_filtered"), append, dedup, dedup_key, major_col)
+                log(f"已写出：{saved}（{matched} 行）")
+                emit({"type": "file_done", "file": pth, "output": saved, "rows": matched})
+                total_written.append(saved)
+                results.append((part, out_cols))
+                matched_total += matched
+            else:
+                log("无命中结果，跳过写出")
+                emit({"type": "file_done", "file": pth, "output": None, "rows": 0})
+        if stopped:
+            log("已中止：当前文件结果未写出")
+        if results and not stopped:
+            merged = pl.concat([pl.scan_parquet(part) for part, _ in results], how="diagonal_relaxed")
+            columns = list(dict.fromkeys(c for _, cols in results for c in cols))
+            m_out = job.get("merge_out") or os.path.join(os.path.dirname(files[0]) if files else os.getcwd(), "merged_filtered.xlsx")
+            merged_saved, merged_rows = polars_write(pl, merged, columns, m_out, append, dedup, dedup_key, major_col)
+            log(f"合并写出：{merged_saved}（{matched_total} 行）")
+            emit({"type": "merged", "output": merged_saved, "rows": merged_rows})
+    t1 = time.time()
+    log(f"完成：总计处理 {total_rows} 行，耗时 {int(t1-t0)} 秒")
+    result = {"outputs": total_written, "merged": merged_saved, "rows": total_rows, "matched": matched_total, "seconds": round(t1 - t0, 3), "stopped": stopped}
+    emit(dict(result, type="done"))
+    return result
+
+# ===================== 分布式执行 =====================
+def frame_row_count(fp: str, sh: Optional[str]) -> int:
+    """
+    单个帧（文件, 工作表）的预估数据行数（整帧分片的进度用）；未知时返回 0（压缩 CSV 不为计数而解压）。
+    """
+    try:
+        fmt = input_format(fp)
+        if fmt == "csv":
+            return 0 if split_compression(fp)[1] else total_rows_csv(fp)
+        if fmt == "parquet":
+            import pyarrow.parquet as pq  # type: ignore
+            return pq.ParquetFile(fp).metadata.num_rows
+        return total_rows_excel(fp, sh)
+    except Exception:
+        return 0
+
+def plan_shards(pd, job: Dict, shard_rows: Optional[int] = None, log=print) -> List[Dict]:
+    """
+    将任务切分为分片，按输入顺序排列（合并时按此顺序输出）；每个分片只读取自己的那部分数据，总解析量与单机顺序读取相同：
+    - 未压缩 CSV：按字节区间切分，约 CLUSTER_SHARD_ROWS 行一片（按平均行长换算），区间两端对齐到行首（见 csv_byte_range）
+    - Parquet：按行组切分，连续的行组累计达到 CLUSTER_SHARD_ROWS 行为一片
+    - Excel（openpyxl 只能从头顺序解析工作表）与压缩 CSV（不能随机访问）：每个文件 × 工作表为一个分片
+    返回：
+      [{"id", "file", "frame", "sheet", "bytes", "row_groups", "rows"}...]；bytes 为 [起始, 结束或None]，
+      row_groups 为行组下标列表，整帧分片两者均为 None；rows 为预估行数（进度用）
+    """
+    step = max(int(shard_rows or CLUSTER_SHARD_ROWS or job.get("chunk_size") or 50000), 1)
+    shards = []
+    def add(pth, frame, sh, rows, byte_range=None, row_groups=None):
+        shards.append({"id": len(shards), "file": pth, "frame": frame, "sheet": sh, "bytes": byte_range, "row_groups": row_groups, "rows": rows})
+    for pth in job.get("files") or []:
+        pth = resolve_path(pth)
+        if not os.path.exists(pth):
+            log(f"文件不存在：{pth}（跳过）")
+            continue
+        for frame, (fp, sh) in enumerate(build_sheet_frames(pd, pth, job.get("sheet") or "")):
+            fmt = input_format(fp)
+            if fmt == "csv" and not split_compression(fp)[1]:
+                total = total_rows_csv(fp)
+                size = os.path.getsize(fp)
+                span = max(-(-size * step // total), 1) if total else size
+                starts = list(range(0, size, span)) or [0]
+                for k, start in enumerate(starts):
+                    stop = starts[k + 1] if k + 1 < len(starts) else None
+                    add(pth, frame, sh, total * ((stop if stop is not None else size) - start) // max(size, 1), [start, stop])
+            elif fmt == "parquet":
+                import pyarrow.parquet as pq  # type: ignore
+                meta = pq.ParquetFile(fp).metadata
+                group, rows = [], 0
+                for g in range(meta.num_row_groups):
+                    group.append(g)
+                    rows += meta.row_group(g).num_rows
+                    if rows >= step:
+                        add(pth, frame, sh, rows, row_groups=group)
+                        group, rows = [], 0
+                if group or meta.num_row_groups == 0:
+                    add(pth, frame, sh, rows, row_groups=group)
+            else:
+                add(pth, frame, sh, frame_row_count(fp, sh))
+    return shards
+
+def iter_shard_chunks(pd, shard: Dict, chunk_size: int) -> Iterable:
+    """
+    读取一个分片的数据行，分块产出（经 prefetching_reader 预读）：字节区间（CSV）或行组（Parquet）只读取分片自身的数据，整帧分片按文件类型顺序读取。
+    """
+    byte_range, row_groups = shard.get("bytes"), shard.get("row_groups")
+    reader = None
+    if byte_range:
+        reader = lambda pd, fp, sh, chunk_size: chunk_generator_from_csv(pd, fp, chunk_size, (int(byte_range[0]), byte_range[1]))
+    elif row_groups is not None:
+        reader = lambda pd, fp, sh, chunk_size: chunk_generator_from_parquet(pd, fp, chunk_size, [int(g) for g in row_groups])
+    source = prefetching_reader(reader)(pd, shard["file"], shard["sheet"], chunk_size)
+    try:
+        yield from source
+    finally:
+        close = getattr(source, "close", None)
+        if close:
+            close()
+
+def run_shard(pd, job: Dict, conditions: List[Dict[str, str]], plan: Dict, memo: Optional[SimilarityMemo], shard: Dict,
+              out_path: str, progress=None, should_stop=None) -> Optional[Dict]:
+    """
+    工作进程执行一个分片：分块评估条件，命中行写为 pickle（out_path，先写临时文件再替换）。
+    progress(已处理行数) 在每块之后调用；should_stop 返回 True 时放弃该分片并返回 None。
+    返回：
+      {"output": 文件名或None（无命中）, "rows": 处理行数, "matched": 命中行数, "dtypes": [[列名, 类型]...]}
+    """
+    chunk_size = int(job.get("chunk_size") or 50000)
+    sheet_column = job.get("sheet_column") or None
+    label = frame_sheet_label(shard["file"], shard["sheet"]) if sheet_column else None
+    parts = []
+    rows = 0
+    for block in iter_shard_chunks(pd, shard, chunk_size):
+        if should_stop and should_stop():
+            return None
+        rows += len(block)
+        if sheet_column:
+            block[sheet_column] = label
+        block, _ = eval_conditions_block(pd, block, conditions, job.get("combine_mode") or "OR", float(job.get("combine_threshold", 0.8)), bool(job.get("write_audit")), memo, plan)
+        out_df = block[block["_match_all"]==True].copy()
+        if len(out_df) > 0:
+            parts.append(out_df)
+        if progress:
+            progress(rows)
+    if memo is not None:
+        memo.flush()
+    if not parts:
+        return {"output": None, "rows": rows, "matched": 0, "dtypes": []}
+    df = pd.concat(parts, ignore_index=True)
+    tmp = out_path + ".part"
+    df.to_pickle(tmp, compression=None)
+    os.replace(tmp, out_path)
+    return {"output": os.path.basename(out_path), "rows": rows, "matched": len(df), "dtypes": [[str(c), str(t)] for c, t in df.dtypes.items()]}
+
+def cluster_send(wfile, msg: Dict) -> None:
+    """
+    发送一条协议消息（一行 JSON）。
+    """
+    import json
+    wfile.write((json.dumps(msg, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+    wfile.flush()
+
+def cluster_recv(rfile) -> Optional[Dict]:
+    """
+    读取一条协议消息；连接关闭时返回 None。
+    """
+    import json
+    line = rfile.readline()
+    return json.loads(line.decode("utf-8")) if line else None
+
+class ClusterCoordinator:
+    """
+    分布式执行的协调者：
+    - 分片队列：工作进程请求（next）时分配下一个待处理分片，全部分配后回复 wait，全部完成后回复 done
+    - 心跳：工作进程处理分片期间定期发送 heartbeat；连接断开或超过 CLUSTER_TIMEOUT 无消息时，其分片重新入队
+    - 失败：分片失败或失联计一次尝试，超过 CLUSTER_MAX_ATTEMPTS 时任务失败（其余工作进程收到 cancel/done）
+    - 同一分片先完成的结果生效；被重新分配的旧尝试在下一次心跳时收到 cancel
+    协议：每行一条 JSON；工作进程先发 hello（含口令），此后每条请求对应一条回复。
+    """
+    def __init__(self, job: Dict, conditions: List[Dict[str, str]], shards: List[Dict], work_dir: str, token: Optional[str] = None, log=print):
+        import threading
+        from collections import deque
+        self.job = job
+        self.conditions = conditions
+        self.shards = shards
+        self.work_dir = work_dir
+        self.token = token
+        self.log = log
+        self.cond = threading.Condition()
+        self.pending = deque(sh["id"] for sh in shards)
+        self.state = {sh["id"]: {"status": "pending", "worker": None, "attempts": 0, "rows": 0, "errors": []} for sh in shards}
+        self.results: Dict[int, Dict] = {}
+        self.workers: Dict[str, Dict] = {}
+        self.error: Optional[str] = None
+        self.stopped = False
+        self.server = None
+
+    def welcome(self) -> Dict:
+        settings = {"CSV_BACKEND": CSV_BACKEND, "CSV_ENCODING": CSV_ENCODING, "REGEX_ENGINE": REGEX_ENGINE, "FUZZY_MATCHER": FUZZY_MATCHER}
+        return {"type": "welcome", "job": self.job, "conditions": self.conditions, "work_dir": self.work_dir,
+                "heartbeat": CLUSTER_HEARTBEAT, "settings": settings}
+
+    def finished(self) -> bool:
+        return self.error is not None or self.stopped or len(self.results) == len(self.shards)
+
+    def touch(self, wid: str) -> None:
+        with self.cond:
+            if wid in self.workers:
+                self.workers[wid]["seen"] = time.time()
+
+    def join(self, wid: str, addr) -> None:
+        with self.cond:
+            self.workers[wid] = {"addr": addr, "seen": time.time(), "shards": set()}
+        self.log(f"工作进程已连接：{wid}（{addr[0]}）")
+
+    def next_shard(self, wid: str) -> Dict:
+        with self.cond:
+            if self.finished():
+                return {"type": "done"}
+            while self.pending:
+                sid = self.pending.popleft()
+                st = self.state[sid]
+                if st["status"] != "pending":
+                    continue
+                st.update(status="running", worker=wid, rows=0)
+                st["attempts"] += 1
+                self.workers[wid]["shards"].add(sid)
+                return {"type": "shard", "shard": self.shards[sid], "attempt": st["attempts"]}
+            return {"type": "wait", "seconds": 1.0}
+
+    def heartbeat(self, wid: str, sid: int, rows: int) -> Dict:
+        with self.cond:
+            st = self.state.get(sid)
+            if st is None or self.error is not None or self.stopped or st["status"] == "done" or st["worker"] != wid:
+                return {"type": "cancel"}
+            st["rows"] = int(rows)
+            self.cond.notify_all()
+            return {"type": "ok"}
+
+    def complete(self, wid: str, sid: int, result: Dict) -> None:
+        with self.cond:
+            self.workers.get(wid, {}).get("shards", set()).discard(sid)
+            st = self.state.get(sid)
+            if st is None or st["status"] == "done":
+                return
+            st.update(status="done", worker=wid, rows=int(result.get("rows") or 0))
+            self.results[sid] = result
+            self.cond.notify_all()
+
+    def fail(self, wid: str, sid: int, error: str) -> None:
+        with self.cond:
+            self.workers.get(wid, {}).get("shards", set()).discard(sid)
+            st = self.state.get(sid)
+            if st is None or st["status"] != "running" or st["worker"] != wid:
+                return
+            self._requeue(sid, f"{wid}：{error}")
+
+    def _requeue(self, sid: int, reason: str) -> None:
+        # 调用方持有锁
+        st = self.state[sid]
+        st["errors"].append(reason)
+        st.update(status="pending", worker=None, rows=0)
+        if st["attempts"] >= max(int(CLUSTER_MAX_ATTEMPTS), 1):
+            self.error = f"分片 {sid} 已尝试 {st['attempts']} 次仍失败：{reason}"
+        else:
+            self.pending.appendleft(sid)
+            self.log(f"分片 {sid} 重新分配（{reason}）")
+        self.cond.notify_all()
+
+    def leave(self, wid: str, reason: str) -> None:
+        """
+        工作进程断开或失联：其正在处理的分片重新入队。
+        """
+        with self.cond:
+            info = self.workers.pop(wid, None)
+            if info is None:
+                return
+            for sid in sorted(info["shards"]):
+                st = self.state[sid]
+                if st["status"] == "running" and st["worker"] == wid:
+                    self._requeue(sid, f"{wid} {reason}")
+        if not self.finished():
+            self.log(f"工作进程已断开：{wid}（{reason}）")
+
+    def expire(self) -> None:
+        """
+        检查心跳超时的工作进程（由 wait 循环定期调用）。
+        """
+        now = time.time()
+        with self.cond:
+            late = [wid for wid, info in self.workers.items() if info["shards"] and now - info["seen"] > CLUSTER_TIMEOUT]
+        for wid in late:
+            self.leave(wid, f"{int(CLUSTER_TIMEOUT)} 秒无心跳")
+
+    def progress(self) -> Tuple[int, int, int]:
+        """
+        返回（已处理行数（含处理中的分片）, 已完成分片数, 命中行数）。
+        """
+        with self.cond:
+            rows = sum(st["rows"] for st in self.state.values())
+            matched = sum(int(r.get("matched") or 0) for r in self.results.values())
+            return rows, len(self.results), matched
+
+    def serve(self, host: str, port: int):
+        """
+        在后台线程中启动 TCP 服务，返回实际监听地址 (host, port)。
+        """
+        import socketserver
+        import threading
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+        self.server = Server((host, port), make_cluster_handler(self))
+        threading.Thread(target=self.server.serve_forever, name="cluster-coordinator", daemon=True).start()
+        return self.server.server_address[:2]
+
+    def close(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+def make_cluster_handler(coord: ClusterCoordinator):
+    """
+    构造协调者的连接处理类：每个工作进程一条长连接，按请求逐条回复。
+    """
+    import hmac
+    import socketserver
+    class ClusterHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            hello = cluster_recv(self.rfile)
+            if not hello or hello.get("type") != "hello":
+                return
+            # 口令按常量时间比较，避免按响应时间逐字节猜测
+            if coord.token and not hmac.compare_digest(str(hello.get("token") or "").encode("utf-8"), str(coord.token).encode("utf-8")):
+                cluster_send(self.wfile, {"type": "error", "error": "口令错误"})
+                return
+            wid = str(hello.get("worker") or f"{self.client_address[0]}:{self.client_address[1]}")
+            coord.join(wid, self.client_address)
+            reason = "连接断开"
+            try:
+                cluster_send(self.wfile, coord.welcome())
+                while True:
+                    msg = cluster_recv(self.rfile)
+                    if msg is None:
+                        break
+                    coord.touch(wid)
+                    kind = msg.get("type")
+                    if kind == "next":
+                        reply = coord.next_shard(wid)
+                    elif kind == "heartbeat":
+                        reply = coord.heartbeat(wid, int(msg["shard"]), int(msg.get("rows") or 0))
+                    elif kind == "result":
+                        coord.complete(wid, int(msg["shard"]), msg)
+                        reply = {"type": "ok"}
+                    elif kind == "failed":
+                        coord.fail(wid, int(msg["shard"]), str(msg.get("error")))
+                        reply = {"type": "ok"}
+                    else:
+                        reply = {"type": "error", "error": f"未知消息：{kind}"}
+                    cluster_send(self.wfile, reply)
+                    if reply["type"] == "done":
+                        reason = "已完成"
+                        break
+            except (OSError, ValueError) as e:
+                reason = f"连接异常：{e}"
+            finally:
+                coord.leave(wid, reason)
+    return ClusterHandler
+
+def cluster_worker(address: str, token: Optional[str] = None, log=print, connect_timeout: float = 30.0) -> int:
+    """
+    工作进程（python filter_cli.py --worker 主机:端口）：连接协调者，循环领取分片并执行，直到协调者回复 done。
+    - 任务、条件与读取设置由协调者下发；分片结果写入共享目录（协调者指定的 work_dir）
+    - 处理分片期间后台线程按协调者的间隔发送心跳，收到 cancel（分片已被重新分配或任务失败）时放弃当前分片
+    - 协调者尚未启动时在 connect_timeout 秒内重试连接
+    返回：
+      进程退出码（与协调者的连接异常中断时为1）
+    """
+    import socket
+    import threading
+    global CSV_BACKEND, CSV_ENCODING, REGEX_ENGINE, FUZZY_MATCHER
+    host, _, port = address.rpartition(":")
+    wid = f"{socket.gethostname()}:{os.getpid()}"
+    deadline = time.time() + connect_timeout
+    while True:
+        try:
+            sock = socket.create_connection((host or "127.0.0.1", int(port)))
+            break
+        except OSError as e:
+            if time.time() >= deadline:
+                log(f"无法连接协调者 {address}：{e}")
+                return 1
+            time.sleep(0.5)
+    rfile, wfile = sock.makefile("rb"), sock.makefile("wb")
+    lock = threading.Lock()
+    def rpc(msg: Dict) -> Dict:
+        with lock:
+            cluster_send(wfile, msg)
+            reply = cluster_recv(rfile)
+        if reply is None:
+            raise ConnectionError("协调者已断开")
+        return reply
+    memo = None
+    try:
+        welcome = rpc({"type": "hello", "worker": wid, "token": token or cluster_token()})
+        if welcome.get("type") != "welcome":
+            log(f"协调者拒绝连接：{welcome.get('error')}")
+            return 1
+        settings = welcome.get("settings") or {}
+        CSV_BACKEND = settings.get("CSV_BACKEND", CSV_BACKEND)
+        CSV_ENCODING = settings.get("CSV_ENCODING", CSV_ENCODING)
+        REGEX_ENGINE = settings.get("REGEX_ENGINE", REGEX_ENGINE)
+        FUZZY_MATCHER = settings.get("FUZZY_MATCHER", FUZZY_MATCHER)
+        job, conditions, work_dir = welcome["job"], welcome["conditions"], welcome["work_dir"]
+        interval = float(welcome.get("heartbeat") or CLUSTER_HEARTBEAT)
+        pd = ensure_pandas()
+        plan = compile_condition_plan(conditions)
+        cond_path = job.get("conditions")
+        if CLUSTER_SIM_MEMO and cond_path and os.path.exists(str(cond_path)) and needs_similarity_memo(conditions):
+            memo = open_similarity_memo(cond_path)
+        log(f"工作进程 {wid} 已连接协调者 {address}（条件 {len(conditions)} 条）")
+        while True:
+            msg = rpc({"type": "next"})
+            kind = msg.get("type")
+            if kind == "done":
+                break
+            if kind == "wait":
+                time.sleep(float(msg.get("seconds") or 1.0))
+                continue
+            if kind != "shard":
+                raise RuntimeError(f"未知消息：{kind}")
+            shard, attempt = msg["shard"], int(msg.get("attempt") or 1)
+            sid = int(shard["id"])
+            status = {"rows": 0, "cancel": False}
+            beat_stop = threading.Event()
+            def beat():
+                while not beat_stop.wait(interval):
+                    try:
+                        if rpc({"type": "heartbeat", "shard": sid, "rows": status["rows"]}).get("type") == "cancel":
+                            status["cancel"] = True
+                    except (OSError, ConnectionError):
+                        status["cancel"] = True
+                        return
+            beater = threading.Thread(target=beat, name=f"heartbeat-{sid}", daemon=True)
+            beater.start()
+            t0 = time.time()
+            try:
+                out_path = os.path.join(work_dir, f"shard{sid:06d}-{os.getpid()}-{attempt}.pkl")
+                result = run_shard(pd, job, conditions, plan, memo, shard, out_path,
+                                   progress=lambda n: status.__setitem__("rows", n), should_stop=lambda: status["cancel"])
+            except Exception as e:
+                beat_stop.set()
+                beater.join()
+                log(f"分片 {sid} 失败：{e}")
+                rpc({"type": "failed", "shard": sid, "attempt": attempt, "error": str(e)})
+                continue
+            beat_stop.set()
+            beater.join()
+            if result is None:
+                log(f"分片 {sid} 已放弃（协调者取消）")
+                continue
+            log(f"分片 {sid} 完成：{result['rows']} 行，命中 {result['matched']} 行，耗时 {time.time() - t0:.1f} 秒")
+            rpc(dict(result, type="result", shard=sid, attempt=attempt))
+        return 0
+    except (OSError, ConnectionError) as e:
+        log(f"与协调者的连接中断：{e}")
+        return 1
+    finally:
+        if memo is not None:
+            memo.close()
+        sock.close()
+
+def start_local_workers(n: int, address: str, token: Optional[str] = None) -> List:
+    """
+    在本机启动 n 个工作进程（子进程运行本脚本的 --worker），返回 Popen 列表。
+    """
+    import subprocess
+    import sys
+    env = dict(os.environ)
+    if token:
+        env["FILTER_CLUSTER_TOKEN"] = token
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", address]
+    return [subprocess.Popen(cmd, env=env) for _ in range(max(int(n), 0))]
+
+def cluster_schema(pd, dtype_lists: List[List], extra: Iterable = ()):
+    """
+    由各分片结果的列类型构造空表：列顺序与类型等同于把全部分片（及 extra 中的表）纵向合并的结果。
+    """
+    empties = []
+    for dtypes in dtype_lists:
+        cols = {}
+        for c, t in dtypes:
+            try:
+                cols[c] = pd.Series(dtype=t)
+            except (TypeError, ValueError):
+                cols[c] = pd.Series(dtype=object)
+        empties.append(pd.DataFrame(cols))
+    empties.extend(df.iloc[:0] for df in extra)
+    return pd.concat(empties, ignore_index=True) if empties else pd.DataFrame()
+
+def conform_frame(df, schema):
+    """
+    按 cluster_schema 的列顺序与类型调整一个分片结果（缺失列补空值），使逐块写出与整体合并后写出一致。
+    """
+    df = df.reindex(columns=schema.columns)
+    for c in schema.columns:
+        if df[c].dtype != schema[c].dtype:
+            try:
+                df[c] = df[c].astype(schema[c].dtype)
+            except (TypeError, ValueError):
+                df[c] = df[c].astype(object)
+    return df
+
+class StreamingDedup:
+    """
+    跨块去重：逐块保留此前未出现过的键的首行，结果与对全部块合并后 drop_duplicates 一致。
+    键的取法同 write_output：DEDUP_KEY 列（合并后的列中存在时），否则“规范化Major|编码”。
+    """
+    def __init__(self, columns, dedup_key: Optional[str], major_col: str):
+        self.dedup_key = dedup_key if dedup_key and dedup_key in columns else None
+        self.major_col = major_col
+        self.seen = set()
+
+    def keys(self, pd, df):
+        if self.dedup_key:
+            return df[self.dedup_key]
+        key_series = df[self.major_col].astype(str).fillna("").map(normalize_text) if self.major_col in df.columns else pd.Series([""]*len(df))
+        code_series = df.get("_matched_code", pd.Series([""]*len(df)))
+        return key_series + "|" + code_series.astype(str)
+
+    def filter(self, pd, df):
+        import numpy as np
+        codes, uniq = pd.factorize(self.keys(pd, df.reset_index(drop=True)), use_na_sentinel=False)
+        uniq = [None if pd.isna(u) else u for u in pd.Series(uniq, dtype=object)]
+        fresh = np.array([u not in self.seen for u in uniq], dtype=bool)
+        self.seen.update(uniq)
+        first = np.zeros(len(codes), dtype=bool)
+        first[np.unique(codes, return_index=True)[1]] = True
+        return df[first & fresh[codes]] if len(codes) else df
+
+def write_stream(pd, frames, out_path: str, schema, append: bool, dedup: bool, dedup_key: Optional[str], major_col: str) -> str:
+    """
+    流式写出（语义同 write_output，不拼接整表）：frames() 每次调用重新产出结果块；
+    先写追加模式的旧内容，再写去重后的新结果；写出失败时降级为同名 CSV 重写一遍。
+    """
+    out_path = apply_output_format(resolve_path(out_path))
+    old = read_output(pd, out_path) if append and os.path.exists(out_path) else None
+    if old is not None:
+        schema = cluster_schema(pd, [], [old, schema])
+    def emit(path):
+        sink = open_table_sink(path, list(schema.columns))
+        seen = StreamingDedup(schema.columns, dedup_key, major_col) if dedup else None
+        def blocks():
+            if old is not None:
+                yield conform_frame(old, schema)
+            for df in frames():
+                df = conform_frame(df, schema)
+                yield seen.filter(pd, df) if seen is not None else df
+        if sink is None:
+            parts = list(blocks())
+            (pd.concat(parts, ignore_index=True) if parts else schema).to_excel(path, index=False)
+            return
+        try:
+            for df in blocks():
+                sink.write(pd, df)
+            sink.close()
+        except BaseException:
+            sink.discard()
+            raise
+    try:
+        emit(out_path)
+        return out_path
+    except Exception:
+        csv_path = os.path.splitext(split_compression(out_path)[0])[0] + ".csv"
+        emit(csv_path)
+        return csv_path
+
+def cluster_token() -> Optional[str]:
+    """
+    工作进程连接口令：CLUSTER_TOKEN，未设置时取环境变量 FILTER_CLUSTER_TOKEN。
+    """
+    return CLUSTER_TOKEN or os.environ.get("FILTER_CLUSTER_TOKEN")
+
+def is_loopback_host(host: str) -> bool:
+    """
+    监听地址是否为本机回环地址（127.0.0.0/8、::1 或 localhost）；空串与 0.0.0.0 表示全部地址，不是回环地址。
+    """
+    import ipaddress
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host.lower() == "localhost"
+
+def cluster_exposure_error(host: str, token: Optional[str]) -> Optional[str]:
+    """
+    协调者监听非本机回环地址却未设置口令时返回错误描述（否则 None）：
+    协调者会读入分片目录中的结果文件（pickle），任何能连上端口的进程都可领取分片并提交结果，跨主机运行必须校验口令。
+    """
+    if token or is_loopback_host(host):
+        return None
+    return f"CLUSTER_HOST={host or '（全部地址）'} 不是本机回环地址，必须设置 CLUSTER_TOKEN（--token 或环境变量 FILTER_CLUSTER_TOKEN）"
+
+def run_cluster_job(pd, job: Dict, conditions: List[Dict[str, str]], log=print, on_event=None, should_stop=None) -> Dict:
+    """
+    以分布式方式执行一个筛选任务（ENGINE="cluster"）：
+    - 切分分片（plan_shards），启动协调者（CLUSTER_HOST:CLUSTER_PORT）与 CLUSTER_LOCAL_WORKERS 个本机工作进程，等待全部分片完成
+    - 按文件顺序流式合并分片结果：逐文件输出与合并输出各自去重（write_stream），结果与 pandas 引擎一致
+    - 事件与返回值同 run_filter_job；should_stop 返回 True 时中止（已完成的分片不写出）
+    - 监听非本机回环地址且未设置口令时拒绝执行（见 cluster_exposure_error）
+    """
+    import shutil
+    import tempfile
+    token = cluster_token()
+    exposure = cluster_exposure_error(CLUSTER_HOST, token)
+    if exposure:
+        raise ValueError(exposure)
+    emit = on_event or (lambda ev: None)
+    files = job.get("files") or []
+    major_col = job.get("major_col") or "Major"
+    append = bool(job.get("append"))
+    dedup = bool(job.get("dedup"))
+    dedup_key = job.get("dedup_key")
+    t0 = time.time()
+    job = dict(job, files=[resolve_path(p) for p in files], conditions=resolve_path(job["conditions"]) if job.get("conditions") and os.path.exists(str(job["conditions"])) else job.get("conditions"))
+    shards = plan_shards(pd, job, log=log)
+    m_out = job.get("merge_out") or os.path.join(os.path.dirname(job["files"][0]) if job["files"] else os.getcwd(), "merged_filtered.xlsx")
+    root = resolve_path(CLUSTER_WORK_DIR or os.path.join(os.path.dirname(resolve_path(m_out)), ".filter_cluster"))
+    os.makedirs(root, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="run-", dir=root)
+    coord = ClusterCoordinator(job, conditions, shards, work_dir, token, log)
+    procs = []
+    total_est = sum(sh["rows"] for sh in shards)
+    try:
+        host, port = coord.serve(CLUSTER_HOST, CLUSTER_PORT)
+        address = f"{'127.0.0.1' if host in ('0.0.0.0', '') else host}:{port}"
+        log(f"协调者已启动：{host}:{port}，{len(shards)} 个分片（预估 {total_est} 行），分片目录 {work_dir}")
+        if CLUSTER_LOCAL_WORKERS > 0:
+            procs = start_local_workers(CLUSTER_LOCAL_WORKERS, address, token)
+            log(f"已启动 {len(procs)} 个本机工作进程")
+        else:
+            log(f"等待工作进程连接：python filter_cli.py --worker {address}")
+        last = None
+        while True:
+            with coord.cond:
+                coord.cond.wait(min(1.0, CLUSTER_HEARTBEAT))
+            if should_stop and should_stop():
+                coord.stopped = True
+            coord.expire()
+            if coord.finished():
+                break
+            if procs and not coord.workers and all(p.poll() is not None for p in procs):
+                coord.error = "本机工作进程均已退出"
+                break
+            rows, done, matched = coord.progress()
+            if (rows, done) != last:
+                last = (rows, done)
+                emit({"type": "progress", "file": None, "rows": rows, "total": total_est, "matched": matched, "elapsed": round(time.time() - t0, 3)})
+                if job.get("progress_step"):
+                    log(f"{render_progress(rows, total_est)} 分片 {done}/{len(shards)} | 已处理 {rows}/{total_est if total_est > 0 else '?'} 行 | 工作进程 {len(coord.workers)} | 已运行 {format_time(time.time() - t0)} | 命中 {matched} 行")
+        if coord.error is not None:
+            raise RuntimeError(coord.error)
+        total_written = []
+        merged_saved = None
+        matched_total = 0
+        rows_total = sum(int(r.get("rows") or 0) for r in coord.results.values())
+        if coord.stopped:
+            log("已中止：分片结果未写出")
+        else:
+            def load(sh):
+                return pd.read_pickle(os.path.join(work_dir, coord.results[sh["id"]]["output"]), compression=None)
+            hit = [sh for sh in shards if coord.results[sh["id"]].get("output")]
+            for pth in job["files"]:
+                mine = [sh for sh in hit if sh["file"] == pth]
+                if not any(sh["file"] == pth for sh in shards):
+                    continue
+                if not mine:
+                    log(f"{os.path.basename(pth)}：无命中结果，跳过写出")
+                    emit({"type": "file_done", "file": pth, "output": None, "rows": 0})
+                    continue
+                out_dir = job.get("out_dir") or os.path.dirname(pth)
+                base = os.path.splitext(os.path.basename(split_compression(pth)[0]))[0]
+                schema = cluster_schema(pd, [coord.results[sh["id"]]["dtypes"] for sh in mine])
+                saved = write_stream(pd, lambda mine=mine: (load(sh) for sh in mine), os.path.join(out_dir, f"{base}_filtered.xlsx"), schema, append, dedup, dedup_key, major_col)
+                rows = sum(int(coord.results[sh["id"]]["matched"]) for sh in mine)
+                matched_total += rows
+                total_written.append(saved)
+                log(f"已写出：{saved}（{rows} 行）")
+                emit({"type": "file_done", "file": pth, "output": saved, "rows": rows})
+            if hit:
+                schema = cluster_schema(pd, [coord.results[sh["id"]]["dtypes"] for sh in hit])
+                merged_saved = write_stream(pd, lambda: (load(sh) for sh in hit), m_out, schema, append, dedup, dedup_key, major_col)
+                log(f"合并写出：{merged_saved}（{matched_total} 行）")
+                emit({"type": "merged", "output": merged_saved, "rows": matched_total})
+    finally:
+        coord.stopped = coord.stopped or not coord.finished()
+        coord.close()
+        for p in procs:
+            try:
+                p.wait(timeout=max(CLUSTER_HEARTBEAT, 1.0) * 2)
+            except Exception:
+                p.kill()
+        shutil.rmtree(work_dir, ignore_errors=True)
+        try:
+            os.rmdir(root)  # 分片根目录为空时一并删除
+        except OSError:
+            pass
+    t1 = time.time()
+    log(f"完成：总计处理 {rows_total} 行，耗时 {int(t1-t0)} 秒")
+    result = {"outputs": total_written, "merged": merged_saved, "rows": rows_total, "matched": matched_total, "seconds": round(t1 - t0, 3), "stopped": coord.stopped}
+    emit(dict(result, type="done"))
+    return result
+
+# ===================== 批量任务 =====================
+# 任务字典中可由清单/命令行/服务请求覆盖的键（files 与 conditions 单独处理）
+JOB_KEYS = ("sheet", "combine_mode", "combine_threshold", "out_dir", "merge_out", "append", "dedup",
+            "dedup_key", "chunk_size", "progress_step", "write_audit", "major_col", "engine", "checkpoint", "resume",
+            "sheet_column", "events_out", "metrics_out", "trace_out", "profile_memory", "memory_report", "chunk_memory_mb", "optimize_conditions")
+
+class ConditionSets:
+    """
+    条件集注册表：按 ID（或路径）缓存已读取的条件、预编译计划与相似度缓存，供同一进程内的多个任务共享。
+    - 条件文件修改后再次取用时自动重新加载；同一路径复用同一个相似度缓存
+    - 线程安全：加载过程串行化，避免重复打开缓存
+    """
+
+    def __init__(self, pd, use_memo: bool = True):
+        import threading
+        self.pd = pd
+        self.use_memo = use_memo
+        self._lock = threading.RLock()
+        self._sets: Dict[str, Dict] = {}
+
+    def register(self, set_id: str, path: str) -> Dict:
+        """
+        注册（或刷新）条件集：读取条件文件、预编译计划，含 fuzzy 条件时打开相似度缓存。
+        """
+        path = resolve_path(path)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"条件文件不存在：{path}")
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cur = self._sets.get(set_id)
+            if cur and cur["path"] == path and cur["mtime"] == mtime:
+                return cur
+            conditions = read_conditions_csv(self.pd, path)
+            memo = None
+            for other in self._sets.values():
+                if other["path"] == path and other.get("memo") is not None:
+                    memo = other["memo"]
+                    break
+            if memo is None and self.use_memo and needs_similarity_memo(conditions):
+                memo = open_similarity_memo(path)
+            entry = {
+                "id": set_id,
+                "path": path,
+                "mtime": mtime,
+                "conditions": conditions,
+                "plan": compile_condition_plan(conditions),
+                "memo": memo,
+            }
+            self._sets[set_id] = entry
+            return entry
+
+    def resolve(self, ref: Optional[str]) -> Optional[Dict]:
+        """
+        按 ID 或文件路径取得条件集；路径首次出现时以路径为 ID 自动注册。
+        """
+        if not ref:
+            return None
+        with self._lock:
+            cur = self._sets.get(ref)
+            return self.register(ref, cur["path"] if cur is not None else ref)
+
+    def entries(self) -> List[Dict]:
+        """
+        已注册条件集列表（快照）。
+        """
+        with self._lock:
+            return list(self._sets.values())
+
+    def close(self) -> None:
+        """
+        关闭全部相似度缓存（同一缓存只关闭一次）。
+        """
+        with self._lock:
+            memos = {id(e["memo"]): e["memo"] for e in self._sets.values() if e.get("memo") is not None}
+        for memo in memos.values():
+            memo.close()
+
+class ChunkCache:
+    """
+    读取缓存：按 (文件, 修改时间, 大小, 工作表, 分块行数) 缓存已解析的数据块，供同一进程内的重复任务复用
+    （批量任务清单与服务模式）。
+    - 总行数超过 max_rows 时按最近使用淘汰；单个文件超过上限则不缓存
+    - 产出的是浅拷贝，评估阶段新增的列不会污染缓存
+    """
+
+    def __init__(self, max_rows: int):
+        import threading
+        from collections import OrderedDict
+        self.max_rows = max(int(max_rows or 0), 0)
+        self._lock = threading.Lock()
+        self._chunks = OrderedDict()
+        self._totals: Dict[Tuple, int] = {}
+        self._rows = 0
+
+    @staticmethod
+    def _stamp(fp: str) -> Tuple:
+        st = os.stat(fp)
+        return (fp, st.st_mtime_ns, st.st_size)
+
+    def reader(self, pd, fp: str, sh: Optional[str], chunk_size: int) -> Iterable:
+        """
+        与 iter_file_chunks 相同的签名；命中缓存时直接产出，否则边读边缓存。
+        """
+        key = self._stamp(fp) + (sh, chunk_size)
+        with self._lock:
+            cached = self._chunks.get(key)
+            if cached is not None:
+                self._chunks.move_to_end(key)
+        if cached is not None:
+            for block in cached:
+                yield block.copy(deep=False)
+            return
+        kept = []
+        kept_rows = 0
+        for block in iter_file_chunks(pd, fp, sh, chunk_size):
+            if kept is not None:
+                kept_rows += len(block)
+                if kept_rows <= self.max_rows:
+                    kept.append(block.copy(deep=False))
+                else:
+                    kept = None
+            yield block
+        if kept is not None:
+            with self._lock:
+                self._chunks[key] = kept
+                self._rows += kept_rows
+                while self._rows > self.max_rows and self._chunks:
+                    _, old = self._chunks.popitem(last=False)
+                    self._rows -= sum(len(b) for b in old)
+
+    def row_counter(self, pth: str, sheet: str) -> int:
+        """
+        与 estimate_total_rows 相同的签名；按文件修改时间缓存预估行数。
+        """
+        key = self._stamp(pth) + (sheet,)
+        with self._lock:
+            total = self._totals.get(key)
+        if total is None:
+            total = estimate_total_rows(pth, sheet)
+            with self._lock:
+                self._totals[key] = total
+        return total
+
+def load_manifest(path: str) -> List[Dict]:
+    """
+    读取批量任务清单（JSON；安装 PyYAML 后支持 YAML），返回完整的任务字典列表。
+    清单格式：
+      {"defaults": {...公共参数...}, "jobs": [{"name": "...", "inputs": [...], "conditions": "...", ...}, ...]}
+      或直接为任务列表；任务键与 default_job 相同（inputs 等价于 files）
+    相对路径按清单文件所在目录解析；未填写的参数取 defaults，再取顶部配置。
+    """
+    path = resolve_path(path)
+    with open(path, "r", encoding="utf-8-sig") as f:
+        text = f.read()
+    if os.path.splitext(path)[1].lower() in (".yaml", ".yml"):
+        try:
+            import yaml  # type: ignore
+        except Exception:
+            raise RuntimeError("读取YAML清单需要安装依赖：pip install pyyaml")
+        data = yaml.safe_load(text)
+    else:
+        import json
+        data = json.loads(text)
+    if isinstance(data, list):
+        data = {"jobs": data}
+    if not isinstance(data, dict) or not isinstance(data.get("jobs"), list):
+        raise RuntimeError("清单格式错误：需要 jobs 列表")
+    base_dir = os.path.dirname(path)
+    def rel(p):
+        return p if (p is None or os.path.isabs(str(p))) else os.path.normpath(os.path.join(base_dir, str(p)))
+    defaults = data.get("defaults") or {}
+    jobs = []
+    for i, raw in enumerate(data["jobs"], start=1):
+        if not isinstance(raw, dict):
+            raise RuntimeError(f"清单第 {i} 个任务格式错误")
+        merged = dict(defaults)
+        merged.update(raw)
+        unknown = [k for k in merged if k not in JOB_KEYS and k not in ("name", "inputs", "files", "conditions")]
+        if unknown:
+            raise RuntimeError(f"清单第 {i} 个任务含未知参数：{', '.join(unknown)}")
+        job = default_job()
+        job.update({k: merged[k] for k in JOB_KEYS if k in merged})
+        inputs = merged.get("inputs", merged.get("files"))
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        if not inputs:
+            raise RuntimeError(f"清单第 {i} 个任务缺少 inputs")
+        job["files"] = [rel(x) for x in inputs]
+        job["conditions"] = rel(merged["conditions"]) if merged.get("conditions") else None
+        job["out_dir"] = rel(job.get("out_dir"))
+        if "merge_out" in merged:
+            job["merge_out"] = rel(job.get("merge_out"))
+        for k in ("events_out", "metrics_out", "trace_out", "memory_report"):
+            if k in merged:
+                job[k] = rel(job.get(k))
+        job["name"] = str(merged.get("name") or f"job{i}")
+        jobs.append(job)
+    return jobs
+
+def job_outputs(job: Dict) -> set:
+    """
+    预测任务会写出的文件（逐文件输出与合并输出），用于判断任务之间能否并发。
+    扩展名被忽略（写 Excel 失败时会降级为同名 CSV）。
+    """
+    outs = set()
+    files = job.get("files") or []
+    for pth in files:
+        pth = resolve_path(pth)
+        out_dir = job.get("out_dir") or os.path.dirname(pth)
+        base = os.path.splitext(os.path.basename(split_compression(pth)[0]))[0]
+        outs.add(os.path.splitext(resolve_path(os.path.join(out_dir, f"{base}_filtered.xlsx")))[0])
+    m_out = job.get("merge_out") or os.path.join(os.path.dirname(files[0]) if files else os.getcwd(), "merged_filtered.xlsx")
+    outs.add(os.path.splitext(split_compression(resolve_path(m_out))[0])[0])
+    return outs
+
+def run_jobs(pd, jobs: List[Dict], parallel: int = 1, log=print) -> List[Dict]:
+    """
+    在同一进程内执行多个任务，共享 pandas、条件集（计划与相似度缓存）与读取缓存：
+    - 输出文件互不相交的任务可并发执行（最多 parallel 个）
+    - 输出有交集的任务按清单顺序串行，后者等待前者完成（保证追加/覆盖语义与顺序执行一致）
+    返回：
+      每个任务的结果字典（含 name/status/error），顺序与 jobs 一致
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    registry = ConditionSets(pd, use_memo=SIM_MEMO)
+    cache = ChunkCache(SERVICE_CACHE_ROWS)
+    outs = [job_outputs(j) for j in jobs]
+    deps = [{i for i in range(k) if outs[i] & outs[k]} for k in range(len(jobs))]
+    results: List[Optional[Dict]] = [None] * len(jobs)
+    prefix = len(jobs) > 1
+
+    def run_one(k: int) -> Dict:
+        job = jobs[k]
+        name = job.get("name") or f"job{k+1}"
+        job_log = (lambda msg: log(f"[{name}] {msg}")) if prefix else log
+        try:
+            if job.get("conditions"):
+                entry = registry.resolve(job["conditions"])
+                job_log(f"已加载条件 {len(entry['conditions'])} 条")
+            else:
+                entry = None
+            res = run_filter_job(
+                pd, job, entry["conditions"] if entry else [],
+                plan=entry["plan"] if entry else None,
+                memo=entry["memo"] if entry else None,
+                log=job_log, reader=cache.reader, row_counter=cache.row_counter,
+            )
+            return dict(res, name=name, status="done", error=None)
+        except Exception as e:
+            job_log(f"任务失败：{e}")
+            return {"name": name, "status": "failed", "error": str(e)}
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(int(parallel), 1)) as pool:
+            pending = list(range(len(jobs)))
+            running = {}
+            while pending or running:
+                for k in list(pending):
+                    if len(running) >= max(int(parallel), 1):
+                        break
+                    if all(results[d] is not None for d in deps[k]):
+                        pending.remove(k)
+                        running[pool.submit(run_one, k)] = k
+                if not running:
+                    break
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for fut in done:
+                    results[running.pop(fut)] = fut.result()
+    finally:
+        registry.close()
+    return [r for r in results if r is not None]
+
+# ===================== 服务模式 =====================
+class FilterService:
+    """
+    常驻筛选服务：
+    - 条件集：按 ID 注册条件文件，预编译计划与相似度缓存常驻内存；文件修改后自动重新加载
+    - 任务：进入有界队列，由固定数量的工作线程执行（并发上限 workers）
+    - 事件：每个任务记录结构化进度事件，可通过 HTTP 流式读取
+    """
+
+    def __init__(self, workers: int = SERVICE_WORKERS, queue_size: int = SERVICE_QUEUE_SIZE, cache_rows: int = SERVICE_CACHE_ROWS):
+        import queue
+        import threading
+        self.pd = ensure_pandas()
+        self.cache = ChunkCache(cache_rows)
+        self.conditions = ConditionSets(self.pd, use_memo=SIM_MEMO)
+        self.jobs: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max(int(queue_size), 1))
+        self._seq = 0
+        self._threads = []
+        for i in range(max(int(workers), 1)):
+            t = threading.Thread(target=self._worker, name=f"filter-worker-{i+1}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, payload: Dict) -> str:
+        """
+        提交任务：校验输入并入队，返回任务ID；队列已满时抛出 queue.Full。
+        payload：{"inputs": [...], "conditions": 条件集ID或路径, 其余键同 default_job}
+        """
+        inputs = payload.get("inputs")
+        if not isinstance(inputs, list) or not inputs:
+            raise ValueError("inputs 必须为非空文件路径列表")
+        unknown = [k for k in payload if k not in JOB_KEYS and k not in ("inputs", "conditions")]
+        if unknown:
+            raise ValueError(f"未知参数：{', '.join(unknown)}")
+        mode = str(payload.get("combine_mode", COMBINE_MODE)).upper()
+        if mode not in ("AND", "OR", "WEIGHTED"):
+            raise ValueError(f"不支持的组合模式：{mode}")
+        job = default_job()
+        job.update({k: payload[k] for k in JOB_KEYS if k in payload})
+        job["combine_mode"] = mode
+        job["files"] = [str(x) for x in inputs]
+        job["conditions"] = payload.get("conditions") or None
+        import threading
+        with self._lock:
+            self._seq += 1
+            job_id = f"job-{self._seq:06d}"
+            record = {
+                "id": job_id, "status": "queued", "job": job, "events": [], "result": None, "error": None,
+                "created": time.time(), "started": None, "finished": None, "stop": False,
+                "cond": threading.Condition(),
+            }
+            self.jobs[job_id] = record
+        try:
+            self._queue.put_nowait(job_id)
+        except Exception:
+            with self._lock:
+                del self.jobs[job_id]
+            raise
+        self._emit(record, {"type": "queued"})
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        请求中止任务（排队中的任务直接取消，运行中的任务在下一个数据块前停止）。
+        """
+        record = self.jobs.get(job_id)
+        if record is None:
+            return False
+        record["stop"] = True
+        if record["status"] == "queued":
+            record["status"] = "cancelled"
+            self._emit(record, {"type": "cancelled"})
+        return True
+
+    def summary(self, record: Dict) -> Dict:
+        """
+        任务摘要（不含事件列表与内部对象），用于HTTP返回。
+        """
+        job = record["job"]
+        return {
+            "id": record["id"], "status": record["status"], "inputs": job["files"], "conditions": job["conditions"],
+            "combine_mode": job["combine_mode"], "result": record["result"], "error": record["error"],
+            "created": record["created"], "started": record["started"], "finished": record["finished"],
+            "events": len(record["events"]),
+        }
+
+    def _emit(self, record: Dict, event: Dict) -> None:
+        with record["cond"]:
+            event = dict(event, seq=len(record["events"]), time=round(time.time(), 3))
+            record["events"].append(event)
+            record["cond"].notify_all()
+
+    def _worker(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            record = self.jobs.get(job_id)
+            if record is None or record["status"] == "cancelled":
+                continue
+            record["status"] = "running"
+            record["started"] = time.time()
+            self._emit(record, {"type": "started"})
+            try:
+                entry = self.conditions.resolve(record["job"]["conditions"])
+                conditions = entry["conditions"] if entry else []
+                result = run_filter_job(
+                    self.pd, record["job"], conditions,
+                    plan=entry["plan"] if entry else None,
+                    memo=entry["memo"] if entry else None,
+                    log=lambda msg, r=record: self._emit(r, {"type": "log", "message": msg}),
+                    on_event=lambda ev, r=record: self._emit(r, ev),
+                    should_stop=lambda r=record: r["stop"],
+                    reader=self.cache.reader,
+                    row_counter=self.cache.row_counter,
+                )
+                record["result"] = result
+                record["status"] = "cancelled" if result.get("stopped") else "done"
+            except Exception as e:
+                record["error"] = str(e)
+                record["status"] = "failed"
+                self._emit(record, {"type": "failed", "error": str(e)})
+            finally:
+                record["finished"] = time.time()
+                self._emit(record, {"type": "end", "status": record["status"]})
+
+    def stream_events(self, job_id: str, start: int = 0, timeout: float = 1.0) -> Iterable:
+        """
+        逐个产出任务事件（从序号 start 开始），任务结束后停止。
+        """
+        record = self.jobs[job_id]
+        i = max(int(start), 0)
+        while True:
+            with record["cond"]:
+                while i >= len(record["events"]) and record["finished"] is None and record["status"] != "cancelled":
+                    record["cond"].wait(timeout)
+                batch = record["events"][i:]
+                finished = record["finished"] is not None or record["status"] == "cancelled"
+            for ev in batch:
+                yield ev
+            i += len(batch)
+            if finished and i >= len(record["events"]):
+                return
+
+    def close(self) -> None:
+        """
+        关闭全部条件集的相似度缓存。
+        """
+        self.conditions.close()
+
+def service_token() -> Optional[str]:
+    """
+    服务口令：SERVICE_TOKEN，未设置时取环境变量 FILTER_SERVICE_TOKEN。
+    """
+    return SERVICE_TOKEN or os.environ.get("FILTER_SERVICE_TOKEN")
+
+def service_allowed_hosts(host: str) -> Optional[set]:
+    """
+    请求头 Host 允许的主机名（防 DNS 重绑定：恶意网页把自己的域名解析到 127.0.0.1 后访问本服务）：
+    - 监听回环地址：该地址与 localhost/127.0.0.1/::1
+    - 监听具体地址：仅该地址
+    - 监听全部地址（""/0.0.0.0/::）：无法枚举，返回 None 不校验（此时必须设置口令）
+    """
+    host = (host or "").strip("[]").lower()
+    if host in ("", "0.0.0.0", "::"):
+        return None
+    if is_loopback_host(host):
+        return {host, "localhost", "127.0.0.1", "::1"}
+    return {host}
+
+def make_service_handler(service: FilterService, host: str = SERVICE_HOST, token: Optional[str] = None):
+    """
+    构造 HTTP 请求处理类（JSON 接口）：
+      GET    /health                  服务状态
+      GET    /conditions              已注册条件集
+      POST   /conditions              注册条件集 {"id": "...", "path": "..."}
+      GET    /jobs                    任务列表
+      POST   /jobs                    提交任务 {"inputs": [...], "conditions": "...", "combine_mode": "OR", ...}
+      GET    /jobs/<id>               任务状态与输出路径
+      GET    /jobs/<id>/events?from=N 流式事件（NDJSON，任务结束后关闭连接）
+      DELETE /jobs/<id>               中止任务
+    请求校验（服务会按请求读取本机文件并写出到请求指定的路径，须防止网页跨站调用）：
+    - Host 须为监听地址（见 service_allowed_hosts），否则 403
+    - 设置口令（token）时须带 Authorization: Bearer <口令>，否则 401
+    - POST/DELETE 须为 Content-Type: application/json，否则 415：浏览器跨站发送该类型前要先发 OPTIONS 预检，本服务不应答预检
+    """
+    import hmac
+    import json
+    import queue
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+    allowed_hosts = service_allowed_hosts(host)
+
+    class Handler(BaseHTTPRequestHandler):
+        server_version = "FilterService/1.0"
+
+        def log_message(self, fmt, *args):
+            print(f"[service] {self.address_string()} {fmt % args}")
+
+        def _send(self, code: int, payload) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self) -> Dict:
+            n = int(self.headers.get("Content-Length") or 0)
+            data = json.loads(self.rfile.read(n).decode("utf-8") or "{}") if n else {}
+            if not isinstance(data, dict):
+                raise ValueError("请求体必须为 JSON 对象")
+            return data
+
+        def _parts(self):
+            url = urlparse(self.path)
+            return [p for p in url.path.split("/") if p], parse_qs(url.query)
+
+        def _reject(self, write: bool = False) -> bool:
+            # 按 Host、口令与（写请求的）Content-Type 校验请求；不通过时回复错误并返回 True
+            if allowed_hosts is not None:
+                name = (self.headers.get("Host") or "").strip().lower()
+                name = name[1:name.find("]")] if name.startswith("[") else name.rsplit(":", 1)[0]
+                if name not in allowed_hosts:
+                    self._send(403, {"error": "Host 不是服务监听地址"})
+                    return True
+            if token:
+                auth = self.headers.get("Authorization") or ""
+                given = auth[7:].strip() if auth[:7].lower() == "bearer " else ""
+                if not hmac.compare_digest(given.encode("utf-8"), token.encode("utf-8")):
+                    self._send(401, {"error": "口令错误"})
+                    return True
+            if write and self.headers.get_content_type() != "application/json":
+                self._send(415, {"error": "Content-Type 必须为 application/json"})
+                return True
+            return False
+
+        def do_GET(self):
+            if self._reject():
+                return
+            parts, query = self._parts()
+            if parts == ["health"]:
+                self._send(200, {"status": "ok", "jobs": len(service.jobs), "queued": service._queue.qsize()})
+            elif parts == ["conditions"]:
+                self._send(200, [{"id": e["id"], "path": e["path"], "count": len(e["conditions"])} for e in service.conditions.entries()])
+            elif parts == ["jobs"]:
+                self._send(200, [service.summary(r) for r in list(service.jobs.values())])
+            elif len(parts) == 2 and parts[0] == "jobs":
+                record = service.jobs.get(parts[1])
+                if record is None:
+                    self._send(404, {"error": "任务不存在"})
+                else:
+                    self._send(200, service.summary(record))
+            elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "events":
+                if parts[1] not in service.jobs:
+                    self._send(404, {"error": "任务不存在"})
+                    return
+                start = int((query.get("from") or ["0"])[0] or 0)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    for ev in service.stream_events(parts[1], start):
+                        self.wfile.write((json.dumps(ev, ensure_ascii=False) + "\n").encode("utf-8"))
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+            else:
+                self._send(404, {"error": "未知路径"})
+
+        def do_POST(self):
+            if self._reject(write=True):
+                return
+            parts, _ = self._parts()
+            try:
+                body = self._body()
+                if parts == ["conditions"]:
+                    if not body.get("id") or not body.get("path"):
+                        raise ValueError("需要 id 与 path")
+                    entry = service.conditions.register(str(body["id"]), str(body["path"]))
+                    self._send(201, {"id": entry["id"], "path": entry["path"], "count": len(entry["conditions"])})
+                elif parts == ["jobs"]:
+                    job_id = service.submit(body)
+                    self._send(202, {"id": job_id, "status": "queued"})
+                else:
+                    self._send(404, {"error": "未知路径"})
+            except queue.Full:
+                self._send(503, {"error": "任务队列已满，请稍后重试"})
+            except (ValueError, FileNotFoundError, RuntimeError) as e:
+                self._send(400, {"error": str(e)})
+
+        def do_DELETE(self):
+            if self._reject(write=True):
+                return
+            parts, _ = self._parts()
+            if len(parts) == 2 and parts[0] == "jobs" and service.cancel(parts[1]):
+                self._send(200, {"id": parts[1], "stop": True})
+            else:
+                self._send(404, {"error": "任务不存在"})
+
+    return Handler
+
+def serve(host: str = SERVICE_HOST, port: int = SERVICE_PORT, workers: int = SERVICE_WORKERS, token: Optional[str] = None) -> None:
+    """
+    启动本地 HTTP/JSON 服务并常驻运行（Ctrl+C 退出）；监听非本机回环地址却未设置口令时抛出 ValueError。
+    """
+    from http.server import ThreadingHTTPServer
+    token = token or service_token()
+    if not token and not is_loopback_host(host):
+        raise ValueError(f"SERVICE_HOST={host or '（全部地址）'} 不是本机回环地址，必须设置 SERVICE_TOKEN（--service-token 或环境变量 FILTER_SERVICE_TOKEN）")
+    service = FilterService(workers=workers)
+    httpd = ThreadingHTTPServer((host, port), make_service_handler(service, host, token))
+    httpd.daemon_threads = True
+    print(f"筛选服务已启动：http://{host}:{httpd.server_address[1]}（并发 {workers}{'，需口令' if token else ''}）")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.close()
+        print("筛选服务已停止")
+
+def build_arg_parser():
+    """
+    命令行参数：未指定的参数取顶部配置区域的常量（清单任务中则取清单 defaults）。
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="跨平台CLI批量筛选：无参数时按顶部配置执行一次；参数可覆盖配置，--manifest 批量执行多个任务",
+    )
+    job = parser.add_argument_group("任务参数（覆盖顶部配置）")
+    job.add_argument("-i", "--input", dest="inputs", action="append", metavar="PATH", help="输入文件，可重复指定（对应 EXCEL_FILES）")
+    job.add_argument("--sheet", help='工作表："" 首个 / "A,B" 多个 / "*" 全部')
+    job.add_argument("--sheet-column", metavar="NAME", help="追加来源工作表列（对应 SHEET_COLUMN）")
+    job.add_argument("--sheet-workers", type=int, help="多工作表并行解析的进程数，1 为逐表读取（对应 SHEET_WORKERS）")
+    job.add_argument("-c", "--conditions", metavar="PATH", help="条件文件（CSV/Excel）")
+    job.add_argument("--combine-mode", type=str.upper, choices=["AND", "OR", "WEIGHTED"], help="条件组合模式")
+    job.add_argument("--combine-threshold", type=float, help="WEIGHTED 总阈值（与 Σ score·weight 比较，可大于 1）")
+    job.add_argument("-o", "--out-dir", help="逐文件输出目录（默认源目录）")
+    job.add_argument("--merge-out", help="合并输出文件")
+    job.add_argument("--append", action=argparse.BooleanOptionalAction, default=None, help="追加模式")
+    job.add_argument("--dedup", action=argparse.BooleanOptionalAction, default=None, help="去重")
+    job.add_argument("--dedup-key", help="去重键列名")
+    job.add_argument("--chunk-size", type=int, help="分块行数")
+    job.add_argument("--progress-step", type=int, help="每处理N行输出一次进度")
+    job.add_argument("--audit", dest="write_audit", action=argparse.BooleanOptionalAction, default=None, help="写出每条件审计列")
+    job.add_argument("--optimize-conditions", action=argparse.BooleanOptionalAction, default=None, help="执行前优化条件集（对应 OPTIMIZE_CONDITIONS，默认关闭；命中不变，被合并/移除的条件不再计入 _score_all）")
+    job.add_argument("--major-col", help="旧逻辑使用的专业列名")
+    job.add_argument("--engine", type=str.lower, choices=list(ENGINES), help="执行引擎（对应 ENGINE）")
+    job.add_argument("--regex-engine", choices=["auto", "re2", "hyperscan", "re"], help="regex 条件的多模式集合引擎（对应 REGEX_ENGINE）")
+    job.add_argument("--excel-writer", choices=["auto", "xlsxwriter", "openpyxl"], help="Excel 写出方式（对应 EXCEL_WRITER）")
+    job.add_argument("--excel-split", choices=["sheet", "file"], help="超出单表行数上限时续写到新工作表或新文件（对应 EXCEL_SPLIT）")
+    job.add_argument("--output-format", type=str.lower, choices=["xlsx", "csv", "csv.gz", "csv.zst", "csv.xz", "parquet"], help="输出格式，替换输出文件扩展名（对应 OUTPUT_FORMAT）")
+    job.add_argument("--zstd-level", type=int, help="zstd 压缩级别（对应 ZSTD_LEVEL）")
+    job.add_argument("--zstd-threads", type=int, help="zstd 压缩线程数，0 为CPU核数（对应 ZSTD_THREADS）")
+    job.add_argument("--csv-backend", choices=["auto", "pyarrow", "pandas"], help="CSV读取后端（对应 CSV_BACKEND）")
+    job.add_argument("--csv-encoding", help="CSV编码，auto 为自动检测（对应 CSV_ENCODING）")
+    job.add_argument("--checkpoint", action=argparse.BooleanOptionalAction, default=None, help="按分块记录检查点（对应 CHECKPOINT）")
+    job.add_argument("--resume", action="store_true", default=None, help="从上次中断的分块继续（对应 RESUME）")
+    job.add_argument("--prefetch-depth", type=int, help="后台预读分块数，0 关闭（对应 PREFETCH_DEPTH）")
+    job.add_argument("--prefetch-mode", choices=["auto", "process", "thread"], help="预读方式（对应 PREFETCH_MODE）")
+    job.add_argument("--background-write", action=argparse.BooleanOptionalAction, default=None, help="后台写出逐文件结果（对应 BACKGROUND_WRITE）")
+    metrics = parser.add_argument_group("运行指标")
+    metrics.add_argument("--events-out", metavar="PATH", help="结构化事件日志（JSON Lines，追加写入）（对应 METRICS_EVENTS）")
+    metrics.add_argument("--metrics-out", metavar="PATH", help="Prometheus 文本格式指标文件（对应 METRICS_PROM）")
+    metrics.add_argument("--trace-out", metavar="PATH", help="Chrome trace-event 文件，记录每个分块的读取/评估/写出（对应 TRACE_FILE）")
+    metrics.add_argument("--profile-memory", action=argparse.BooleanOptionalAction, default=None, help="剖析内存：逐阶段/逐分块峰值 RSS 与 tracemalloc 快照（对应 PROFILE_MEMORY）")
+    metrics.add_argument("--memory-report", metavar="PATH", help="内存剖析报告（JSON）路径（对应 MEMORY_REPORT）")
+    metrics.add_argument("--tracemalloc-top", type=int, help="每个快照保留的分配位置数（对应 TRACEMALLOC_TOP）")
+    metrics.add_argument("--tracemalloc-interval", type=float, help="tracemalloc 快照间隔秒数，0 为只在结束时（对应 TRACEMALLOC_INTERVAL）")
+    metrics.add_argument("--chunk-memory-mb", type=float, help="自适应分块的内存预算（MB），按内存剖析报告换算分块行数（对应 CHUNK_MEMORY_MB）")
+    batch = parser.add_argument_group("批量任务")
+    batch.add_argument("--manifest", metavar="PATH", help="任务清单（JSON/YAML），同一进程内执行全部任务")
+    batch.add_argument("-j", "--jobs", type=int, default=1, help="同时执行的任务数（仅输出互不相交的任务会并发）")
+    service = parser.add_argument_group("服务模式")
+    service.add_argument("--serve", action="store_true", help="以本地HTTP/JSON服务模式常驻运行")
+    service.add_argument("--host", default=SERVICE_HOST, help="服务监听地址（默认仅本机）")
+    service.add_argument("--port", type=int, default=SERVICE_PORT, help="服务端口")
+    service.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="同时执行的任务数")
+    service.add_argument("--service-token", help="服务口令（对应 SERVICE_TOKEN，也可用环境变量 FILTER_SERVICE_TOKEN）")
+    cluster = parser.add_argument_group("分布式执行（--engine cluster）")
+    cluster.add_argument("--worker", metavar="HOST:PORT", help="以工作进程运行：连接协调者领取分片并执行，直到任务完成")
+    cluster.add_argument("--local-workers", type=int, help="协调者在本机启动的工作进程数（对应 CLUSTER_LOCAL_WORKERS）")
+    cluster.add_argument("--cluster-host", help="协调者监听地址（对应 CLUSTER_HOST）")
+    cluster.add_argument("--cluster-port", type=int, help="协调者端口，0 为自动分配（对应 CLUSTER_PORT）")
+    cluster.add_argument("--shard-rows", type=int, help="每个分片的约计行数（CSV 换算为字节区间、Parquet 累计行组；对应 CLUSTER_SHARD_ROWS）")
+    cluster.add_argument("--token", help="工作进程连接口令（对应 CLUSTER_TOKEN，也可用环境变量 FILTER_CLUSTER_TOKEN）")
+    preview = parser.add_argument_group("抽样预览")
+    preview.add_argument("--preview", action="store_true", help="不执行筛选：均匀抽样估计命中数、各条件选择率与全量耗时")
+    preview.add_argument("--preview-rows", type=int, default=PREVIEW_ROWS, help="抽样行数（对应 PREVIEW_ROWS）")
+    preview.add_argument("--seed", type=int, default=PREVIEW_SEED, help="抽样随机种子（对应 PREVIEW_SEED）")
+    bench = parser.add_argument_group("基准")
+    bench.add_argument("--bench-startup", action="store_true", help="测量冷启动导入耗时（-X importtime），超出预算或加载了重依赖时退出码为1")
+    bench.add_argument("--startup-budget-ms", type=int, default=STARTUP_BUDGET_MS, help="冷启动耗时预算（毫秒）")
+    bench.add_argument("--bench-write", action="store_true", help="Excel 写出吞吐基准（to_excel 与 ExcelSink 对比）")
+    bench.add_argument("--bench-rows", type=int, default=200000, help="写出基准的行数")
+    return parser
+
+def job_overrides(args) -> Dict:
+    """
+    从命令行参数中取出显式指定的任务参数（未指定的为 None，不覆盖）。
+    """
+    over = {k: getattr(args, k) for k in JOB_KEYS if getattr(args, k, None) is not None}
+    if args.conditions:
+        over["conditions"] = args.conditions
+    if args.inputs:
+        over["files"] = list(args.inputs)
+    return over
+
+def bench_startup(budget_ms: int = STARTUP_BUDGET_MS, runs: int = 5) -> int:
+    """
+    冷启动基准：以 -X importtime 在全新解释器中导入本脚本 runs 次，取导入耗时中位数。
+    判定：中位数超出 budget_ms，或导入阶段加载了任一重依赖（HEAVY_MODULES 及 numpy），视为回退。
+    返回：
+      退出码（0 通过 / 1 回退）
+    """
+    import subprocess
+    import sys
+    here = os.path.dirname(os.path.abspath(__file__))
+    name = os.path.splitext(os.path.basename(__file__))[0]
+    heavy = set(HEAVY_MODULES) | {"numpy"}
+    samples = []
+    loaded = set()
+    for _ in range(max(int(runs), 1)):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {name}"],
+            cwd=here, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(f"导入失败：{proc.stderr.strip()[-500:]}")
+            return 1
+        for line in proc.stderr.splitlines():
+            # 格式：import time: self [us] | cumulative | imported package
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            parts = [x.strip() for x in line[len("import time:"):].split("|")]
+            if len(parts) != 3 or not parts[1].isdigit():
+                continue
+            mod = parts[2]
+            if mod.split(".")[0] in heavy:
+                loaded.add(mod.split(".")[0])
+            if mod == name:
+                samples.append(int(parts[1]) / 1000.0)
+    samples.sort()
+    median = samples[len(samples) // 2] if samples else float("inf")
+    print(f"冷启动导入耗时：中位数 {median:.1f} ms（{len(samples)} 次：{', '.join(f'{x:.1f}' for x in samples)}），预算 {budget_ms} ms")
+    if loaded:
+        print(f"回退：导入阶段加载了重依赖 {', '.join(sorted(loaded))}")
+    ok = median <= budget_ms and not loaded
+    print("通过" if ok else "未通过")
+    return 0 if ok else 1
+
+def bench_excel_write(rows: int = 200000) -> int:
+    """
+    Excel 写出基准：生成 rows 行合成结果（整数、含空值的小数、文本、布尔、日期时间），在临时目录中分别以
+    pandas to_excel（默认引擎，即原写出方式）、ExcelSink(openpyxl 只写)、ExcelSink(xlsxwriter 常量内存) 写出，
+    报告耗时、吞吐（行/秒）、文件数与大小。rows 超过单表上限时 to_excel 会失败，ExcelSink 自动续写。
+    返回：
+      退出码（0）
+    """
+    import tempfile
+    pd = ensure_pandas()
+    import numpy as np
+    rng = np.random.default_rng(0)
+    rows = max(int(rows), 1)
+    majors = np.array(["计算机科学与技术", "软件工程", "会计学", "金融学", "数学与应用数学", "汉语言文学"], dtype=object)
+    gpa = rng.uniform(2.0, 4.0, rows).round(2)
+    gpa[rng.random(rows) < 0.1] = np.nan
+    df = pd.DataFrame({
+        "PersonID": np.arange(rows),
+        "Major": majors[rng.integers(0, len(majors), rows)],
+        "School": [f"第{i % 500}大学" for i in range(rows)],
+        "GPA": gpa,
+        "Graduated": pd.Timestamp("2020-07-01") + pd.to_timedelta(rng.integers(0, 1500, rows), unit="D"),
+        "_match_all": True,
+        "_score_all": rng.random(rows).round(4),
+    })
+    def run_to_excel(path):
+        df.to_excel(path, index=False)
+        return [path]
+    methods = [("pandas to_excel", run_to_excel)]
+    methods.append(("ExcelSink openpyxl", lambda path: write_excel(pd, df, path, backend="openpyxl")))
+    if module_installed("xlsxwriter"):
+        methods.append(("ExcelSink xlsxwriter", lambda path: write_excel(pd, df, path, backend="xlsxwriter")))
+    else:
+        print("未安装 xlsxwriter，跳过常量内存写出（pip install xlsxwriter）")
+    print(f"Excel 写出基准：{rows} 行 × {df.shape[1]} 列")
+    with tempfile.TemporaryDirectory(prefix="filter_bench_") as tmp:
+        for i, (name, fn) in enumerate(methods):
+            path = os.path.join(tmp, f"bench{i}.xlsx")
+            t = time.perf_counter()
+            try:
+                files = fn(path)
+            except Exception as e:
+                print(f"  {name:<22} 失败：{type(e).__name__}: {str(e)[:120]}")
+                continue
+            dt = time.perf_counter() - t
+            size = sum(os.path.getsize(f) for f in files) / 1048576
+            print(f"  {name:<22} {dt:8.2f} 秒  {rows / dt:10.0f} 行/秒  {len(files)} 个文件  {size:.1f} MB")
+    return 0
+
+def main(argv=None) -> int:
+    """
+    命令行入口：
+    - 无任务参数：按顶部配置执行一次（与直接运行脚本一致）
+    - 指定任务参数：以参数覆盖顶部配置后执行
+    - --manifest：读取清单，在同一进程内执行全部任务（命令行任务参数覆盖清单中的同名参数）
+    - --serve：以服务模式常驻运行
+    - --worker：以分布式执行的工作进程运行（见 cluster_worker）
+    返回：
+      进程退出码（有任务失败时为1）
+    """
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    global CSV_BACKEND, CSV_ENCODING, PREFETCH_DEPTH, PREFETCH_MODE, BACKGROUND_WRITE, SHEET_WORKERS, REGEX_ENGINE, EXCEL_WRITER, EXCEL_SPLIT, OUTPUT_FORMAT, ZSTD_LEVEL, ZSTD_THREADS
+    global CLUSTER_LOCAL_WORKERS, CLUSTER_HOST, CLUSTER_PORT, CLUSTER_SHARD_ROWS, CLUSTER_TOKEN, TRACEMALLOC_TOP, TRACEMALLOC_INTERVAL
+    if args.csv_backend:
+        CSV_BACKEND = args.csv_backend
+    if args.csv_encoding:
+        CSV_ENCODING = args.csv_encoding
+    if args.prefetch_depth is not None:
+        PREFETCH_DEPTH = args.prefetch_depth
+    if args.prefetch_mode:
+        PREFETCH_MODE = args.prefetch_mode
+    if args.background_write is not None:
+        BACKGROUND_WRITE = args.background_write
+    if args.sheet_workers is not None:
+        SHEET_WORKERS = args.sheet_workers
+    if args.regex_engine:
+        REGEX_ENGINE = args.regex_engine
+    if args.excel_writer:
+        EXCEL_WRITER = args.excel_writer
+    if args.excel_split:
+        EXCEL_SPLIT = args.excel_split
+    if args.output_format:
+        OUTPUT_FORMAT = args.output_format
+    if args.zstd_level is not None:
+        ZSTD_LEVEL = args.zstd_level
+    if args.zstd_threads is not None:
+        ZSTD_THREADS = args.zstd_threads
+    if args.tracemalloc_top is not None:
+        TRACEMALLOC_TOP = args.tracemalloc_top
+    if args.tracemalloc_interval is not None:
+        TRACEMALLOC_INTERVAL = args.tracemalloc_interval
+    if args.local_workers is not None:
+        CLUSTER_LOCAL_WORKERS = args.local_workers
+    if args.cluster_host:
+        CLUSTER_HOST = args.cluster_host
+    if args.cluster_port is not None:
+        CLUSTER_PORT = args.cluster_port
+    if args.shard_rows is not None:
+        CLUSTER_SHARD_ROWS = args.shard_rows
+    if args.token:
+        CLUSTER_TOKEN = args.token
+    if args.worker:
+        return cluster_worker(args.worker, CLUSTER_TOKEN)
+    if args.bench_startup:
+        return bench_startup(args.startup_budget_ms)
+    if args.bench_write:
+        return bench_excel_write(args.bench_rows)
+    if args.serve:
+        try:
+            serve(args.host, args.port, args.workers, args.service_token)
+        except ValueError as e:
+            print(f"配置错误：{e}")
+            return 1
+        return 0
+    over = job_overrides(args)
+    if not (args.manifest or over or args.preview):
+        process_files()
+        return 0
+    # 清单解析与配置校验期间在后台导入 pandas 等重依赖
+    preload_modules()
+    if args.manifest:
+        if args.inputs:
+            parser.error("--manifest 与 --input 不能同时使用")
+        try:
+            jobs = load_manifest(args.manifest)
+        except (OSError, ValueError, RuntimeError) as e:
+            print(f"配置错误：清单读取失败：{e}")
+            return 2
+        for job in jobs:
+            job.update(over)
+    else:
+        job = default_job()
+        job.update(over)
+        jobs = [job]
+    errors = [f"[{j.get('name') or i}] {e}" if len(jobs) > 1 else e for i, j in enumerate(jobs, start=1) for e in validate_job(j)]
+    if errors:
+        for e in errors:
+            print(f"配置错误：{e}")
+        return 2
+    pd = ensure_pandas()
+    if args.preview:
+        preview_jobs(pd, jobs, args.preview_rows, args.seed)
+        return 0
+    t0 = time.time()
+    results = run_jobs(pd, jobs, parallel=args.jobs)
+    failed = [r for r in results if r.get("status") != "done"]
+    if len(jobs) > 1:
+        print(f"全部任务完成：{len(results) - len(failed)}/{len(jobs)} 成功，耗时 {int(time.time() - t0)} 秒")
+    return 1 if failed else 0
 
 if __name__ == "__main__":
-    process_files()
+    raise SystemExit(main())
@@ -1,12 +1,45 @@
 import os
 import re
+import sys
 import json
 import threading
-import queue
 import time
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 
+# 重依赖延迟到首次使用时导入；窗口构建期间由后台线程预加载，缩短首次处理前的等待
+HEAVY_MODULES = ("pandas", "openpyxl", "rapidfuzz", "ahocorasick")
+_OPTIONAL_MODULES = {}
+
+def preload_modules_local(names=HEAVY_MODULES):
+    def _load():
+        for name in names:
+            optional_module(name)
+        load_cli_module()
+    t = threading.Thread(target=_load, name="preload-modules", daemon=True)
+    t.start()
+    return t
+
+def optional_module(name: str):
+    # 导入可选依赖并缓存结果；未安装时返回 None（避免逐行重复尝试导入）
+    if name not in _OPTIONAL_MODULES:
+        try:
+            import importlib
+            _OPTIONAL_MODULES[name] = importlib.import_module(name)
+        except Exception:
+            _OPTIONAL_MODULES[name] = None
+    return _OPTIONAL_MODULES[name]
+
+def module_available(name: str) -> bool:
+    # 仅检查依赖是否已安装，不触发导入
+    if _OPTIONAL_MODULES.get(name) is not None or name in sys.modules:
+        return True
+    try:
+        import importlib.util
+        return importlib.util.find_spec(name) is not None
+    except Exception:
+        return False
+
 def to_halfwidth(s: str) -> str:
     r = []
     for ch in s:
@@ -78,15 +111,126 @@ def parse_requirements(lines):
         result.append(it)
     return result
 
+# 规范化规则与模糊评分器的版本；修改 normalize_text 或评分方式时递增，相似度缓存据此失效
+GUI_NORMALIZE_VERSION = "gui-norm-1"
+GUI_SCORER = "sequence_matcher"
+GUI_SCORER_FINGERPRINT = f"difflib-1|{GUI_NORMALIZE_VERSION}"
+
+# 多条件筛选的执行引擎：本地（逐行评估）或 CLI 脚本中的引擎（条件语义与 CLI 一致，输出 Parquet/CSV）
+GUI_ENGINES = {"本地": "local", "DuckDB": "duckdb", "Polars": "polars"}
+# 多工作表并行解析的进程数：0→min(工作表数, CPU核数)；1→逐表读取
+GUI_SHEET_WORKERS = 0
+# 勾选“追加来源工作表列”时写入的列名
+GUI_SHEET_COLUMN = "_sheet"
+# 多条件逐行评估的检查点间隔（行）：中断后“继续上次”最多重做这么多行
+GUI_CHECKPOINT_ROWS = 2000
+# regex 多模式集合为每个取值缓存的命中结果条数上限（超出后清空重建）
+GUI_REGEX_VALUE_CACHE = 200000
+# 专业列筛选（旧版）分块读取的行数：内存占用只与块大小有关
+GUI_CHUNK_ROWS = 20000
+# 输出缓冲（逐文件结果与合并输出共用）在内存中保留的最大行数，超过后新结果溢写到临时文件（Parquet/pickle）
+GUI_OUTPUT_MEMORY_ROWS = 1000000
+# “抽样预览”的样本行数（在全部文件/工作表上均匀抽样，见 CLI 的 preview_job）
+GUI_PREVIEW_ROWS = 5000
+# 输出格式（逐文件与默认合并输出的扩展名）；压缩 CSV 与 Parquet 经 CLI 的流式写入器写出（见 CLI 的 open_table_sink）
+GUI_OUTPUT_FORMATS = {"Excel (.xlsx)": "xlsx", "CSV": "csv", "CSV (gzip)": "csv.gz", "CSV (zstd)": "csv.zst", "CSV (xz)": "csv.xz", "Parquet (zstd)": "parquet"}
+# 勾选“导出运行指标”时写在合并输出旁的文件（<合并输出名><后缀>），格式见 CLI 的 RunMetrics
+GUI_METRICS_FILES = {"events_out": ".events.jsonl", "metrics_out": ".prom", "trace_out": ".trace.json"}
+# 日志框最多保留的行数（环形缓冲，超出后删除最早的行）；完整日志写入 GUI_LOG_FILE
+GUI_LOG_LINES = 5000
+# 完整日志文件（程序同目录）；超过 GUI_LOG_MAX_BYTES 后轮转，保留 GUI_LOG_BACKUPS 个旧文件（.log.1 最新）；设为 None 不写文件
+GUI_LOG_FILE = "major_filter_gui.log"
+GUI_LOG_MAX_BYTES = 5 * 1024 * 1024
+GUI_LOG_BACKUPS = 3
+# 主线程刷新日志框与进度条的间隔（毫秒）：每次只插入一批日志、只应用最新的进度
+GUI_UI_TICK_MS = 100
+
+_CLI_MODULE = None
+_CLI_MODULE_TRIED = False
+
+def load_cli_module():
+    # 复用 CLI 脚本中的引擎实现（如相似度缓存）；找不到或导入失败时返回 None，GUI 退回本地逻辑
+    global _CLI_MODULE, _CLI_MODULE_TRIED
+    if _CLI_MODULE_TRIED:
+        return _CLI_MODULE
+    _CLI_MODULE_TRIED = True
+    here = os.path.dirname(os.path.abspath(__file__))
+    candidates = [
+        os.path.join(here, "..", "cli", "filter_cli.py"),
+        os.path.join(here, "filter_cli.py"),
+        os.path.join(getattr(sys, "_MEIPASS", here), "filter_cli.py"),
+    ]
+    for path in candidates:
+        if not os.path.exists(path):
+            continue
+        try:
+            import importlib.util
+            spec = importlib.util.spec_from_file_location("filter_cli", path)
+            mod = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(mod)
+            _CLI_MODULE = mod
+            break
+        except Exception:
+            continue
+    return _CLI_MODULE
+
+def open_similarity_memo_local(conditions_path: str | None):
+    # 相似度缓存写在条件文件旁；未记录条件文件路径时写在配置文件旁
+    cli = load_cli_module()
+    if cli is None:
+        return None
+    try:
+        memo = cli.SimilarityMemo(cli.similarity_memo_path(conditions_path or os.path.abspath("major_filter_gui.json")))
+        memo.bind(GUI_SCORER, GUI_SCORER_FINGERPRINT)
+        return memo
+    except Exception:
+        return None
+
 def similarity(a: str, b: str) -> float:
     from difflib import SequenceMatcher
     return SequenceMatcher(None, a, b).ratio()
 
-def best_match(major: str, reqs):
+def requirement_candidates(reqs, majors_norm=()):
+    # 专业要求条数达到 CLI 的 TFIDF_MIN_TARGETS 时，用 CLI 的 TF-IDF 字符 n-gram 索引为各个不同的规范化专业名批量召回 top-k 候选；
+    # 编码相同、规范化名相同的要求另按字典查找，始终在候选中。条数较少、FUZZY_MATCHER=exact、找不到 CLI 或未安装 scipy 时返回 None（逐条比较）
+    # 索引只构建一次；分块处理时用 extend_requirement_candidates 为新出现的专业名补充候选
+    cli = load_cli_module()
+    if cli is None or str(cli.FUZZY_MATCHER).lower() == "exact" or len(reqs) < cli.TFIDF_MIN_TARGETS or not cli.module_installed("scipy"):
+        return None
+    try:
+        index = cli.NgramTfidfIndex([r["norm"] for r in reqs])
+    except Exception:
+        return None
+    by_norm = {}
+    by_code = {}
+    for i, r in enumerate(reqs):
+        by_norm.setdefault(r["norm"], []).append(i)
+        if r["code"]:
+            by_code.setdefault(r["code"], []).append(i)
+    candidates = {"top": {}, "norm": by_norm, "code": by_code, "index": index, "k": cli.TFIDF_TOP_K}
+    extend_requirement_candidates(candidates, majors_norm)
+    return candidates
+
+def extend_requirement_candidates(candidates, majors_norm):
+    values = sorted(set(v for v in majors_norm if v and v not in candidates["top"]))
+    if not values:
+        return
+    idx, sims = candidates["index"].top_k(values, candidates["k"])
+    for v, row_idx, row_sim in zip(values, idx, sims):
+        candidates["top"][v] = [int(j) for j, sc in zip(row_idx, row_sim) if sc > 0]
+
+def best_match(major: str, reqs, candidates=None):
     if not major:
         return None, 0.0
     major_norm = normalize_text(major)
     major_code = extract_code(major) or ""
+    if candidates is not None:
+        # 只比较召回的候选（保持原顺序，得分相同时仍取靠前的要求）
+        pool = set(candidates["top"].get(major_norm, ()))
+        pool.update(candidates["norm"].get(major_norm, ()))
+        if major_code:
+            pool.update(candidates["code"].get(major_code, ()))
+        reqs = [reqs[i] for i in sorted(pool)]
     best = None
     best_score = 0.0
     for r in reqs:
@@ -104,47 +248,388 @@ def best_match(major: str, reqs):
             best = r
     return best, best_score
 
+def iter_excel_chunks_local(pd, excel_path: str, sheet: str | None, chunk_rows: int, limit: int | None):
+    # 分块读取单个工作表（CLI 的 openpyxl 只读流式读取，内存只与块大小有关）；找不到 CLI 时整表读取后切块；limit 限制总行数
+    cli = load_cli_module()
+    if cli is not None:
+        source = cli.iter_file_chunks(pd, excel_path, sheet or None, chunk_rows)
+    else:
+        df = pd.read_excel(excel_path, sheet_name=sheet, nrows=limit) if sheet else pd.read_excel(excel_path, nrows=limit)
+        source = (df.iloc[i:i + chunk_rows].reset_index(drop=True) for i in range(0, len(df), chunk_rows))
+    left = limit if limit and limit > 0 else None
+    try:
+        for block in source:
+            if left is not None:
+                if left <= 0:
+                    break
+                if len(block) > left:
+                    block = block.iloc[:left]
+                left -= len(block)
+            yield block
+    finally:
+        close = getattr(source, "close", None)
+        if close:
+            close()
+
+def output_stem_local(path: str) -> str:
+    # 输入文件名去掉压缩扩展名与类型扩展名：data.csv.gz → data
+    name = os.path.basename(path)
+    stem, ext = os.path.splitext(name)
+    if ext.lower() in (".gz", ".zst", ".zstd", ".xz"):
+        name = stem
+    return os.path.splitext(name)[0]
+
+def metrics_paths_local(merge_path: str) -> dict:
+    # 运行指标文件路径（GUI_METRICS_FILES）：与合并输出同目录、同名
+    stem = os.path.join(os.path.dirname(os.path.abspath(merge_path)), output_stem_local(merge_path))
+    return {k: stem + suffix for k, suffix in GUI_METRICS_FILES.items()}
+
+def metrics_span_local(metrics, phase: str, key: str | None = None, **args):
+    # 记录一段阶段耗时（CLI 的 RunMetrics.span）；未导出运行指标时为空上下文
+    if metrics is None:
+        import contextlib
+        return contextlib.nullcontext()
+    return metrics.span(phase, key, **args)
+
+def read_output_local(pd, path: str):
+    # 读取既有输出（追加模式）：有 CLI 时含超出行数上限续写的 _partN 工作表/分卷
+    cli = load_cli_module()
+    if cli is not None:
+        return cli.read_output(pd, path)
+    ext = os.path.splitext(path)[1].lower()
+    return pd.read_excel(path) if ext in (".xlsx", ".xls") else pd.read_csv(path)
+
+class StreamingOutputLocal:
+    # 逐块接收命中行：先溢写到输出旁的临时目录（pickle），结束时按顺序流式写出（xlsx/压缩 CSV/Parquet 用 CLI 的 open_table_sink，
+    # 找不到 CLI 时 xlsx 用 openpyxl write_only；失败降级 CSV），
+    # 内存只与块大小有关。追加模式与 write_output 一致：先写旧文件内容，启用去重时按 dedup_keys 保留首次出现的行。
+    # outputs：OutputManagerLocal；实际写出的各块边写边转为其条目（written，超出 GUI_OUTPUT_MEMORY_ROWS 即溢写），供合并输出复用而不必读回文件
+    def __init__(self, out_path: str, append: bool = False, dedup: bool = False, dedup_key: str | None = None, col_major: str = "Major", outputs=None):
+        import tempfile
+        self.out_path = out_path
+        self.append = append
+        self.dedup = dedup
+        self.dedup_key = dedup_key
+        self.col_major = col_major
+        self.outputs = outputs
+        self.written = []
+        self.rows = 0
+        self.parts = []
+        self.columns = {}
+        self.old = None
+        self.tmp = tempfile.mkdtemp(prefix=".stream_", dir=os.path.dirname(os.path.abspath(out_path)) or None)
+
+    def add(self, df):
+        if df is None or len(df) == 0:
+            return
+        path = os.path.join(self.tmp, f"part{len(self.parts):06d}.pkl")
+        df.to_pickle(path)
+        self.parts.append(path)
+        self.columns.update(dict.fromkeys(df.columns))
+        self.rows += len(df)
+
+    def load_old(self, pd):
+        # 追加模式的旧内容只读取一次（写出失败降级 CSV 时复用）
+        if self.old is None:
+            self.old = []
+            if self.append and os.path.exists(self.out_path):
+                try:
+                    self.old = [read_output_local(pd, self.out_path)]
+                except Exception:
+                    pass
+        return self.old
+
+    def frames(self, pd):
+        yield from self.load_old(pd)
+        for path in self.parts:
+            yield pd.read_pickle(path)
+
+    def deduped_frames(self, pd):
+        # 追加且去重时跨块按键保留首次出现的行（与整体 drop_duplicates 结果一致）
+        if not (self.append and self.dedup and os.path.exists(self.out_path)):
+            yield from self.frames(pd)
+            return
+        seen = set()
+        for df in self.frames(pd):
+            by_key = bool(self.dedup_key and self.dedup_key in df.columns)
+            keys = dedup_keys(pd, df, self.col_major, self.dedup_key if by_key else None)
+            first = ~pd.Series(keys).duplicated().to_numpy()
+            keep = first & ~pd.Series(keys).isin(seen).to_numpy()
+            seen.update(keys[first].tolist())
+            yield df[keep]
+
+    def written_frames(self, pd):
+        # 写出失败降级 CSV 时会重新遍历：先释放上一次尝试的条目
+        if self.outputs is not None:
+            for ent in self.written:
+                self.outputs.release(ent)
+        self.written = []
+        for df in self.deduped_frames(pd):
+            if self.outputs is not None:
+                self.written.append(self.outputs.entry(pd, df))
+            yield df
+
+    def write_table(self, pd, path: str):
+        cli = load_cli_module()
+        sink = None
+        if cli is not None:
+            columns = list(dict.fromkeys([c for df in self.load_old(pd) for c in df.columns] + list(self.columns)))
+            sink = cli.open_table_sink(path, columns)
+        if sink is not None:
+            try:
+                for df in self.written_frames(pd):
+                    sink.write(pd, df)
+                sink.close()
+            except BaseException:
+                sink.discard()
+                raise
+            return
+        from openpyxl import Workbook
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        columns = None
+        for df in self.written_frames(pd):
+            if columns is None:
+                columns = list(df.columns)
+                ws.append([str(c) for c in columns])
+            df = df.reindex(columns=columns).astype(object)
+            for row in df.where(df.notna(), None).itertuples(index=False, name=None):
+                ws.append(list(row))
+        wb.save(path)
+
+    def write_csv(self, pd, path: str):
+        columns = None
+        for df in self.written_frames(pd):
+            if columns is None:
+                columns = list(df.columns)
+                df.to_csv(path, index=False, encoding="utf-8-sig")
+            else:
+                df.reindex(columns=columns).to_csv(path, index=False, header=False, mode="a", encoding="utf-8")
+        if columns is None:
+            pd.DataFrame().to_csv(path, index=False, encoding="utf-8-sig")
+
+    def close(self) -> str:
+        import pandas as pd
+        import shutil
+        try:
+            ext = os.path.splitext(self.out_path)[1].lower()
+            if ext in (".xlsx", ".xls") or (ext != ".csv" and load_cli_module() is not None):
+                try:
+                    self.load_old(pd)
+                    self.write_table(pd, self.out_path)
+                    return self.out_path
+                except Exception:
+                    csv_path = os.path.join(os.path.dirname(self.out_path), output_stem_local(self.out_path) + ".csv")
+                    self.write_csv(pd, csv_path)
+                    return csv_path
+            self.write_csv(pd, self.out_path)
+            return self.out_path
+        finally:
+            shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def discard(self):
+        import shutil
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+def canonical_key_values(pd, s):
+    # 去重键的规范取值：空值与空串相同；数字样式的值统一为 float 文本（"0802"、802 与 802.0 相同），
+    # 使内存中的结果与写出后读回（read_excel/read_csv 会把数字文本解析成数值）的内容得到相同的键
+    codes, uniq = pd.factorize(s, use_na_sentinel=False)
+    uniq = pd.Series(uniq, dtype=object)
+    uniq = uniq.where(uniq.notna(), "")
+    num = pd.to_numeric(uniq.map(lambda v: v.strip() if isinstance(v, str) else v), errors="coerce")
+    text = uniq.astype(str)
+    text[num.notna()] = num[num.notna()].astype(float).map(repr)
+    return text.to_numpy()[codes] if len(codes) else text.to_numpy()[:0]
+
+def dedup_keys(pd, df, col_major: str, key: str | None):
+    # 向量化计算去重键（64 位哈希数组）：指定了 key 时按该列（缺列按空值），否则按 (规范化专业名, _matched_code)，取值先经 canonical_key_values 规范
+    n = len(df)
+    if key:
+        vals = canonical_key_values(pd, df[key]) if key in df.columns else [""] * n
+        return pd.util.hash_pandas_object(pd.Series(vals, dtype=object), index=False).to_numpy()
+    if col_major in df.columns:
+        raw = pd.Series(canonical_key_values(pd, df[col_major]), dtype=object)
+        uniq = raw.unique()
+        norm = raw.map(dict(zip(uniq, (normalize_text(v) for v in uniq)))).to_numpy()
+    else:
+        norm = [""] * n
+    code = canonical_key_values(pd, df["_matched_code"]) if "_matched_code" in df.columns else [""] * n
+    return pd.util.hash_pandas_object(pd.DataFrame({"m": norm, "c": code}), index=False).to_numpy()
+
 def dedup_dataframe(df, col_major: str, key: str | None):
     if df is None or len(df) == 0:
         return df
-    if key and key in df.columns:
-        return df.drop_duplicates(subset=[key]).copy()
-    keys = []
-    for i in range(len(df)):
-        v = str(df.iloc[i][col_major]) if col_major in df.columns else ""
-        code = str(df.iloc[i]["_matched_code"]) if "_matched_code" in df.columns else ""
-        keys.append((normalize_text(v), code))
-    df["_dedup_key"] = keys
-    res = df.drop_duplicates(subset=["_dedup_key"]).copy()
-    res.drop(columns=["_dedup_key"], inplace=True)
-    return res
+    import pandas as pd
+    keys = dedup_keys(pd, df, col_major, key if key and key in df.columns else None)
+    return df[~pd.Series(keys).duplicated().to_numpy()].copy()
 
 def write_output(df, out_path: str, append: bool = False, dedup: bool = False, dedup_key: str | None = None, col_major: str = "Major") -> str:
-    ext = os.path.splitext(out_path)[1].lower()
-    if append and os.path.exists(out_path):
-        try:
-            import pandas as pd
-            if ext in (".xlsx", ".xls"):
-                old = pd.read_excel(out_path)
+    # 单次写出（追加模式并入旧内容，追加已有文件时去重）；与 OutputManagerLocal 共用写出逻辑
+    import pandas as pd
+    outputs = OutputManagerLocal(col_major, append=append, dedup=dedup, dedup_key=dedup_key)
+    try:
+        saved, _ = outputs.write(pd, [outputs.entry(pd, df)], out_path)
+    finally:
+        outputs.close()
+    return saved
+
+class OutputManagerLocal:
+    # 本次运行的输出缓冲：逐文件结果与合并输出共用同一批 DataFrame，不再写出后读回。
+    # 缓冲行数超过 GUI_OUTPUT_MEMORY_ROWS 后新结果溢写到临时目录（Parquet，失败用 pickle），只保留句柄；
+    # 去重键按 dedup_keys 向量化计算，每个结果按去重方式各算一次并随切片沿用；本次运行写过的文件再次追加时直接用缓冲。
+    # memory：剖析内存时为 CLI 的 MemoryProfiler，留在内存中的结果计入输出缓冲
+    def __init__(self, col_major: str = "Major", append: bool = False, dedup: bool = False, dedup_key: str | None = None):
+        self.col_major = col_major
+        self.append = append
+        self.dedup = dedup
+        self.dedup_key = dedup_key
+        self.parts = []
+        self.written = {}
+        self.buffered = 0
+        self.spilled = 0
+        self.tmp = None
+        self.memory = None
+
+    def entry(self, pd, df, keys=None):
+        ent = {"df": df, "path": None, "rows": len(df), "columns": list(df.columns), "keys": dict(keys or {})}
+        if self.buffered + len(df) > GUI_OUTPUT_MEMORY_ROWS and len(df) > 0:
+            import tempfile
+            if self.tmp is None:
+                self.tmp = tempfile.mkdtemp(prefix="gui_outputs_")
+            path = os.path.join(self.tmp, f"part{self.spilled:06d}")
+            self.spilled += 1
+            try:
+                df.to_parquet(path + ".parquet", index=False)
+                ent["path"] = path + ".parquet"
+            except Exception:
+                df.to_pickle(path + ".pkl")
+                ent["path"] = path + ".pkl"
+            ent["df"] = None
+        else:
+            self.buffered += len(df)
+            if self.memory is not None and len(df) > 0:
+                self.memory.hold(df)
+        return ent
+
+    def frame(self, pd, ent):
+        if ent["df"] is not None:
+            return ent["df"]
+        if ent["path"].endswith(".parquet"):
+            return pd.read_parquet(ent["path"])
+        return pd.read_pickle(ent["path"])
+
+    def key_mode(self, entries):
+        if self.dedup_key and any(self.dedup_key in ent["columns"] for ent in entries):
+            return self.dedup_key
+        return None
+
+    def keys(self, pd, ent, mode):
+        if mode not in ent["keys"]:
+            ent["keys"][mode] = dedup_keys(pd, self.frame(pd, ent), self.col_major, mode)
+        return ent["keys"][mode]
+
+    def dedup_entries(self, pd, entries):
+        # 跨多个结果按首次出现去重（与 concat 后 drop_duplicates 一致），返回切片后的新条目（沿用已算好的键）
+        import numpy as np
+        mode = self.key_mode(entries)
+        all_keys = [self.keys(pd, ent, mode) for ent in entries]
+        keep = ~pd.Series(np.concatenate(all_keys) if all_keys else np.array([], dtype="uint64")).duplicated().to_numpy()
+        out = []
+        pos = 0
+        for ent, keys in zip(entries, all_keys):
+            mask = keep[pos:pos + len(keys)]
+            pos += len(keys)
+            if mask.all():
+                out.append(ent)
             else:
-                old = pd.read_csv(out_path)
-            merged = pd.concat([old, df], ignore_index=True)
-            if dedup:
-                merged = dedup_dataframe(merged, col_major, dedup_key)
-            df = merged
-        except Exception:
-            pass
-    if ext in (".xlsx", ".xls"):
+                out.append(self.entry(pd, self.frame(pd, ent)[mask], {mode: keys[mask]}))
+        return out
+
+    def add(self, ent):
+        # 加入合并池
+        self.parts.append(ent)
+        return ent
+
+    def release(self, ent):
+        # 丢弃未加入合并池的条目（内存中的不再计入缓冲行数，溢写的删除临时文件）
+        if ent["df"] is not None:
+            self.buffered -= ent["rows"]
+            ent["df"] = None
+        elif ent["path"]:
+            try:
+                os.remove(ent["path"])
+            except OSError:
+                pass
+
+    def old_entries(self, pd, out_path: str):
+        if not (self.append and os.path.exists(out_path)):
+            return []
+        cached = self.written.get(os.path.abspath(out_path))
+        if cached is not None:
+            return list(cached)
         try:
-            df.to_excel(out_path, index=False)
-            return out_path
+            old = read_output_local(pd, out_path)
         except Exception:
-            csv_path = os.path.splitext(out_path)[0] + ".csv"
-            df.to_csv(csv_path, index=False, encoding="utf-8-sig")
-            return csv_path
-    else:
-        df.to_csv(out_path, index=False, encoding="utf-8-sig")
-        return out_path
+            return []
+        return [self.entry(pd, old)]
+
+    def write(self, pd, entries, out_path: str, merged: bool = False, staging_dir: str | None = None):
+        # 写出一组结果（追加模式先并入旧内容；逐文件仅在追加已有文件时去重，合并输出启用去重即去重）；
+        # staging_dir：检查点任务写入该暂存目录（由 JobCheckpoint.publish 移入输出目录），原输出不动
+        # 返回 (实际路径, 写出内容的条目)
+        old = self.old_entries(pd, out_path)
+        entries = old + [ent for ent in entries if ent is not None]
+        if self.dedup and (merged or old):
+            entries = self.dedup_entries(pd, entries)
+        saved = out_path
+        ext = os.path.splitext(out_path)[1].lower()
+        cli = load_cli_module()
+        if staging_dir:
+            cli.reset_staging_dir(staging_dir)
+        target = os.path.join(staging_dir, os.path.basename(out_path)) if staging_dir else out_path
+        sink = None
+        if ext != ".csv" and cli is not None:
+            # 逐个结果流式写入（xlsx 超出单表行数上限自动续写；压缩 CSV/Parquet 边写边压缩），不拼接整表
+            sink = cli.open_table_sink(target, list(dict.fromkeys(c for ent in entries for c in ent["columns"])))
+        if sink is not None:
+            try:
+                for ent in entries:
+                    sink.write(pd, self.frame(pd, ent))
+                sink.close()
+                self.written[os.path.abspath(saved)] = entries
+                return saved, entries
+            except Exception:
+                sink.discard()
+        frames = [self.frame(pd, ent) for ent in entries]
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else (frames[0] if frames else pd.DataFrame())
+        if ext in (".xlsx", ".xls"):
+            try:
+                df.to_excel(target, index=False)
+            except Exception:
+                saved = os.path.splitext(out_path)[0] + ".csv"
+                if staging_dir:
+                    cli.reset_staging_dir(staging_dir)
+                df.to_csv(os.path.join(staging_dir, os.path.basename(saved)) if staging_dir else saved, index=False, encoding="utf-8-sig")
+        elif ext == ".parquet":
+            df.to_parquet(target, index=False)
+        else:
+            # .gz/.zst/.xz 由 pandas 按扩展名压缩
+            df.to_csv(target, index=False, encoding="utf-8-sig")
+        self.written[os.path.abspath(saved)] = entries
+        return saved, entries
+
+    def write_merged(self, pd, out_path: str, staging_dir: str | None = None):
+        # 返回 (实际路径, 合并池去重后的行数)
+        parts = self.dedup_entries(pd, self.parts) if self.dedup else self.parts
+        saved, _ = self.write(pd, parts, out_path, merged=True, staging_dir=staging_dir)
+        return saved, sum(ent["rows"] for ent in parts)
+
+    def close(self):
+        if self.tmp is not None:
+            import shutil
+            shutil.rmtree(self.tmp, ignore_errors=True)
+            self.tmp = None
 
 def parse_options_local(s: str):
     opts = {}
@@ -161,7 +646,7 @@ def parse_options_local(s: str):
             opts[part] = "true"
     return opts
 
-def apply_condition_local(val: str, cond: dict):
+def apply_condition_local(val: str, cond: dict, memo=None):
     t = cond.get("type", "")
     op = cond.get("operator", "")
     value = cond.get("value", "")
@@ -259,14 +744,73 @@ def apply_condition_local(val: str, cond: dict):
             tgt_code = extract_code(value) or ""
             if val_code and tgt_code and val_code == tgt_code:
                 return (True, 1.0)
+        cli = load_cli_module()
+        if cli is not None:
+            # 与 CLI 共用评分器注册表与规范化（options 中 scorer=<名称> 选择评分器），结果与 CLI 一致
+            a = cli.normalize_text(val)
+            scorer, cutoff = cli.condition_scorer(opts, th)
+            try:
+                s = cli.score_distinct([a], cli.normalize_text(value), memo, scorer, cutoff)[a]
+            except ValueError:
+                return (False, 0.0)
+            return (s >= th, s)
+        # 未找到 CLI 脚本：退回 difflib 评分
         a = normalize_text(val)
         b = normalize_text(value)
-        from difflib import SequenceMatcher
-        s = SequenceMatcher(None, a, b).ratio()
+        s = memo.get(GUI_SCORER, b, a) if memo is not None else None
+        if s is None:
+            from difflib import SequenceMatcher
+            s = SequenceMatcher(None, a, b).ratio()
+            if memo is not None:
+                memo.put(GUI_SCORER, b, a, s)
         return (s >= th, s)
     return (False, 0.0)
 
-def evaluate_conditions_row_local(row: dict, conditions: list, combine_mode: str, combine_threshold: float):
+_REGEX_SETS_LOCAL = {}
+
+def regex_set_local(patterns):
+    # 同列 regex 条件编成 CLI 的 RegexSet（re2/hyperscan/re 交替式预筛，见 CLI 的 REGEX_ENGINE），按模式元组缓存，跨行复用；
+    # 每个取值只扫描一次，命中的模式下标按取值缓存。找不到 CLI 时返回 None，逐条 re.search
+    entry = _REGEX_SETS_LOCAL.get(patterns)
+    if entry is None:
+        cli = load_cli_module()
+        if cli is None:
+            return None
+        entry = _REGEX_SETS_LOCAL[patterns] = {"set": cli.RegexSet(list(patterns)), "hits": {}}
+    return entry
+
+def regex_set_hits_local(entry, val: str):
+    hits = entry["hits"].get(val)
+    if hits is None:
+        if len(entry["hits"]) >= GUI_REGEX_VALUE_CACHE:
+            entry["hits"].clear()
+        hits = entry["hits"][val] = frozenset(entry["set"].matching_ids(val))
+    return hits
+
+_NUMBER_INTERVALS_LOCAL = {}
+
+def number_interval_local(op: str, value: str):
+    # number 条件对应的闭区间 (下界, 上界)，按 (运算符, 取值) 缓存；取值非法或运算符未知时为 None（不命中）
+    key = (op, value)
+    if key not in _NUMBER_INTERVALS_LOCAL:
+        try:
+            if op == "between":
+                parts = value.replace(" ", "").split("-")
+                iv = (float(parts[0]), float(parts[1]))
+            elif op == "min":
+                iv = (float(value), float("inf"))
+            elif op == "max":
+                iv = (float("-inf"), float(value))
+            elif op == "equals":
+                iv = (float(value), float(value))
+            else:
+                iv = None
+        except Exception:
+            iv = None
+        _NUMBER_INTERVALS_LOCAL[key] = iv
+    return _NUMBER_INTERVALS_LOCAL[key]
+
+def evaluate_conditions_row_local(row: dict, conditions: list, combine_mode: str, combine_threshold: float, memo=None):
     # 性能优化：将同列且相同选项的text/contains合并为“任意命中”组
     groups = []
     merged_keys = {}
@@ -286,13 +830,31 @@ def evaluate_conditions_row_local(row: dict, conditions: list, combine_mode: str
                     g["weight"] = 1.0
                 merged_keys[key] = g
                 groups.append(g)
-            g["tokens"].add(cond.get("value", ""))
+            g["tokens"].update(cond.get("_tokens") or [cond.get("value", "")])
         else:
             groups.append({"kind": "single", "cond": cond})
+    # 同列 regex 条件共用一个多模式集合：每条条件记下集合与模式下标，评估时每列只扫描一次
+    regex_cols = {}
+    for g in groups:
+        cond = g.get("cond")
+        if cond and cond.get("type", "") == "regex" and cond.get("value", ""):
+            pats = regex_cols.setdefault(cond.get("column", ""), {})
+            g["slot"] = pats.setdefault(cond["value"], len(pats))
+            g["kind"] = "regex_set"
+    for col, pats in regex_cols.items():
+        entry = regex_set_local(tuple(pats))
+        for g in groups:
+            if g.get("kind") == "regex_set" and g["cond"].get("column", "") == col:
+                if entry is None:
+                    g["kind"] = "single"
+                else:
+                    g["set"] = entry
     # Aho-Corasick（可选）构建
     automata = {}
     try:
-        import ahocorasick  # type: ignore
+        ahocorasick = optional_module("ahocorasick")
+        if ahocorasick is None:
+            raise ImportError("ahocorasick")
         for g in groups:
             if g.get("kind") == "contains_any":
                 A = ahocorasick.Automaton()
@@ -303,7 +865,8 @@ def evaluate_conditions_row_local(row: dict, conditions: list, combine_mode: str
                 automata[id(g)] = A
     except Exception:
         automata = {}
-    # 评估
+    # 评估（同列的 number 条件共用一次数值解析）
+    numbers = {}
     details = []
     total = 0.0
     any_hit = False
@@ -352,7 +915,21 @@ def evaluate_conditions_row_local(row: dict, conditions: list, combine_mode: str
             cond = g["cond"]
             col = cond.get("column", "")
             val = str(row.get(col, ""))
-            hit, score = apply_condition_local(val, cond)
+            if g.get("kind") == "regex_set":
+                hit = g["slot"] in regex_set_hits_local(g["set"], val)
+                score = 1.0 if hit else 0.0
+            elif cond.get("type", "") == "number":
+                if col not in numbers:
+                    try:
+                        numbers[col] = float(val.strip())
+                    except Exception:
+                        numbers[col] = None
+                v = numbers[col]
+                iv = number_interval_local(cond.get("operator", ""), cond.get("value", ""))
+                hit = v is not None and iv is not None and iv[0] <= v <= iv[1]
+                score = 1.0 if hit else 0.0
+            else:
+                hit, score = apply_condition_local(val, cond, memo)
             details.append((hit, score, f"{col}:{cond.get('type','')}/{cond.get('operator','')}={cond.get('value','')}"))
             w = 1.0
             try:
@@ -367,31 +944,84 @@ def evaluate_conditions_row_local(row: dict, conditions: list, combine_mode: str
     if combine_mode == "OR":
         return (any_hit, total, details)
     return (total >= combine_threshold, total, details)
-def read_excel_merged_local(pd, excel_path: str, sheet: str | None, limit: int | None):
-    if not sheet or sheet.strip() == "":
-        return pd.read_excel(excel_path, nrows=limit if limit else None)
-    s = sheet.strip()
+def excel_sheet_names_local(excel_path: str):
+    # 只读取工作簿目录（read_only），不解析数据
+    from openpyxl import load_workbook
+    wb = load_workbook(excel_path, read_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+def read_sheet_local(excel_path: str, sheet_name, limit: int | None):
+    # 单个工作表读取；也是并行解析子进程的入口（子进程独立打开文件）
+    import pandas as pd
+    return pd.read_excel(excel_path, sheet_name=sheet_name, nrows=limit if limit else None)
+
+def read_sheets_parallel_local(excel_path: str, names, limit: int | None):
+    # 多个工作表在独立子进程中解析，按工作表顺序返回；读取失败（如工作表不存在）的位置为 None
+    workers = max(1, min(GUI_SHEET_WORKERS or (os.cpu_count() or 1), len(names)))
+    if workers <= 1:
+        parts = []
+        for nm in names:
+            try:
+                parts.append(read_sheet_local(excel_path, nm, limit))
+            except Exception:
+                parts.append(None)
+        return parts
+    import multiprocessing as mp
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as ex:
+        futures = [ex.submit(read_sheet_local, excel_path, nm, limit) for nm in names]
+        parts = []
+        for fut in futures:
+            try:
+                parts.append(fut.result())
+            except Exception:
+                parts.append(None)
+        return parts
+
+def read_excel_merged_local(pd, excel_path: str, sheet: str | None, limit: int | None, sheet_column: str | None = None):
+    # 多个工作表（"*" 或 "A,B"）并行解析后按顺序纵向合并；sheet_column 非空时追加来源工作表列
+    # CSV/Parquet（含 .csv.gz/.csv.zst/.csv.xz 压缩文件）经 CLI 分块读取（边读边解压）后合并，来源工作表列为空
+    cli = load_cli_module()
+    if cli is not None and cli.input_format(excel_path) != "excel":
+        parts = list(iter_excel_chunks_local(pd, excel_path, None, GUI_CHUNK_ROWS, limit))
+        df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+        if sheet_column:
+            df[sheet_column] = ""
+        return df
+    s = (sheet or "").strip()
+    if not s:
+        df = read_sheet_local(excel_path, 0, limit)
+        if sheet_column:
+            df[sheet_column] = excel_sheet_names_local(excel_path)[0]
+        return df
     if s == "*":
-        dfs = pd.read_excel(excel_path, sheet_name=None, nrows=limit if limit else None)
-        parts = list(dfs.values())
-        if not parts:
+        names = excel_sheet_names_local(excel_path)
+        if not names:
             raise RuntimeError("未找到任何工作表")
-        return pd.concat(parts, ignore_index=True)
-    names = [x.strip() for x in s.split(",") if x.strip()]
+    else:
+        names = [x.strip() for x in s.split(",") if x.strip()]
     if len(names) == 1:
-        return pd.read_excel(excel_path, sheet_name=names[0], nrows=limit if limit else None)
+        df = read_sheet_local(excel_path, names[0], limit)
+        if sheet_column:
+            df[sheet_column] = names[0]
+        return df
     parts = []
-    for nm in names:
-        try:
-            dfp = pd.read_excel(excel_path, sheet_name=nm, nrows=limit if limit else None)
-            parts.append(dfp)
-        except Exception:
-            pass
+    for nm, dfp in zip(names, read_sheets_parallel_local(excel_path, names, limit)):
+        if dfp is None:
+            continue
+        if sheet_column:
+            dfp[sheet_column] = nm
+        parts.append(dfp)
     if not parts:
         raise RuntimeError("指定的工作表均不存在")
     return pd.concat(parts, ignore_index=True)
 
-def process_single(excel_path: str, require_path: str, col_major: str, threshold: float, out_path: str | None, sheet: str | None, progress_step: int, limit: int | None, append: bool, dedup: bool, dedup_key: str | None, progress_cb=None, log_cb=None, progress_text_cb=None):
+def process_single(excel_path: str, require_path: str, col_major: str, threshold: float, out_path: str | None, sheet: str | None, progress_step: int, limit: int | None, append: bool, dedup: bool, dedup_key: str | None, progress_cb=None, log_cb=None, progress_text_cb=None, outputs=None, metrics=None):
+    # outputs：可选的 OutputManagerLocal，写出的内容直接加入其合并池（不再读回输出文件）
+    # metrics：可选的运行指标（CLI 的 RunMetrics），每块记录读取/评估区间与进度事件，写出记为 write
     try:
         import pandas as pd
     except Exception:
@@ -400,49 +1030,147 @@ def process_single(excel_path: str, require_path: str, col_major: str, threshold
     reqs = parse_requirements(lines)
     if not reqs:
         raise RuntimeError("专业要求解析为空")
-    if sheet:
-        if limit and limit > 0:
-            df = pd.read_excel(excel_path, sheet_name=sheet, nrows=limit)
-        else:
-            df = pd.read_excel(excel_path, sheet_name=sheet)
-    else:
+    if out_path is None or out_path == "":
+        out_path = os.path.join(os.path.dirname(excel_path), f"{output_stem_local(excel_path)}_filtered.xlsx")
+    cli = load_cli_module()
+    total = 0
+    if cli is not None:
+        total = cli.estimate_total_rows(excel_path, sheet or "")
         if limit and limit > 0:
-            df = pd.read_excel(excel_path, nrows=limit)
-        else:
-            df = pd.read_excel(excel_path)
-    if col_major not in df.columns:
-        raise RuntimeError(f"未找到列: {col_major}")
-    matches = []
-    majors = df[col_major].astype(str).fillna("").tolist()
-    total = len(majors)
-    matched_so_far = 0
+            total = min(total, limit) if total else limit
+    # 每个不同的专业名只匹配一次（跨块复用）：原值 → (是否命中, 要求名, 编码, 分数)
+    memo = {}
+    candidates = requirement_candidates(reqs)
+    if candidates is not None and log_cb:
+        log_cb(f"专业要求 {len(reqs)} 条，启用 TF-IDF 候选召回（每个专业名比较前 {candidates['k']} 个候选）")
+    sink = StreamingOutputLocal(out_path, append=append, dedup=dedup, dedup_key=dedup_key, col_major=col_major, outputs=outputs)
+    done = 0
+    count = 0
     t0 = time.time()
-    for i, v in enumerate(majors, start=1):
-        m, score = best_match(v, reqs)
-        if m and score >= threshold:
-            matches.append({"match": True, "matched_name": m["name"], "matched_code": m["code"], "score": round(score, 4)})
-            matched_so_far += 1
-        else:
-            matches.append({"match": False, "matched_name": "", "matched_code": "", "score": round(score, 4)})
-        if progress_cb and progress_step and progress_step > 0 and i % progress_step == 0:
-            progress_cb(i, total)
-            if progress_text_cb:
-                bar = progress_text_cb("render", i, total)
-                progress_text_cb("log", f"{bar} 已处理 {i}/{total} 行 | 已运行 {time.strftime('%H:%M:%S', time.gmtime(time.time()-t0))} | 命中 {matched_so_far} 行")
-    df["_match"] = [x["match"] for x in matches]
-    df["_matched_name"] = [x["matched_name"] for x in matches]
-    df["_matched_code"] = [x["matched_code"] for x in matches]
-    df["_score"] = [x["score"] for x in matches]
-    out_df = df[df["_match"] == True].copy()
-    if out_path is None or out_path == "":
-        base = os.path.splitext(os.path.basename(excel_path))[0]
-        out_path = os.path.join(os.path.dirname(excel_path), f"{base}_filtered.xlsx")
-    count = len(out_df)
-    saved = write_output(out_df, out_path, append=append, dedup=dedup, dedup_key=dedup_key, col_major=col_major)
+    source = iter_excel_chunks_local(pd, excel_path, sheet, GUI_CHUNK_ROWS, limit)
+    if metrics is not None:
+        source = metrics.timed_blocks(source, excel_path)
+    try:
+        for block in source:
+            if col_major not in block.columns:
+                raise RuntimeError(f"未找到列: {col_major}")
+            t_eval = time.perf_counter()
+            s = block[col_major]
+            # 与整表 read_excel 一致：空单元格按 "nan" 参与匹配
+            majors = s.astype(object).where(s.notna(), "nan").astype(str)
+            fresh = [v for v in majors.unique() if v not in memo]
+            if fresh:
+                if candidates is not None:
+                    extend_requirement_candidates(candidates, [normalize_text(v) for v in fresh])
+                for v in fresh:
+                    m, score = best_match(v, reqs, candidates)
+                    if m and score >= threshold:
+                        memo[v] = (True, m["name"], m["code"], round(score, 4))
+                    else:
+                        memo[v] = (False, "", "", round(score, 4))
+            # 按列赋值
+            block["_match"] = majors.map(lambda v: memo[v][0]).astype(bool)
+            block["_matched_name"] = majors.map(lambda v: memo[v][1])
+            block["_matched_code"] = majors.map(lambda v: memo[v][2])
+            block["_score"] = majors.map(lambda v: memo[v][3]).astype(float)
+            out_block = block[block["_match"]]
+            sink.add(out_block)
+            count += len(out_block)
+            prev = done
+            done += len(block)
+            read_bytes, size_bytes = block.attrs.get("bytes_read"), block.attrs.get("bytes_total")
+            if read_bytes and size_bytes and not (limit and limit > 0):
+                # 压缩输入：按已读取的压缩字节占比外推总行数
+                total = max(done, int(done * size_bytes / read_bytes))
+            if metrics is not None:
+                metrics.add("evaluate", excel_path, t_eval, time.perf_counter() - t_eval, rows=len(block))
+                metrics.event({"type": "progress", "file": excel_path, "rows": done, "total": total or done, "matched": count, "elapsed": round(time.time() - t0, 3)})
+            if progress_cb and progress_step and progress_step > 0 and done // progress_step > prev // progress_step:
+                progress_cb(done, total or done)
+                if progress_text_cb:
+                    bar = progress_text_cb("render", done, total or done)
+                    progress_text_cb("log", f"{bar} 已处理 {done}/{total or '?'} 行 | 已运行 {time.strftime('%H:%M:%S', time.gmtime(time.time()-t0))} | 命中 {count} 行")
+    except BaseException:
+        sink.discard()
+        raise
+    with metrics_span_local(metrics, "write", excel_path, rows=count):
+        saved = sink.close()
+    if outputs is not None:
+        outputs.written[os.path.abspath(saved)] = [outputs.add(ent) for ent in sink.written]
     if log_cb:
         log_cb(f"筛选完成：{os.path.basename(excel_path)} 命中 {count} 条 → {saved}")
     return saved, count
 
+_PROGRESS_LINE_LOCAL = re.compile(r"\[[#-]+\] (?:\d+|\?\?)%")
+
+class LogChannelLocal:
+    # 后台线程 → 主线程的日志与进度通道：后台线程只追加到待刷新列表（加锁，不触碰 Tk），主线程每 GUI_UI_TICK_MS 取走一批。
+    # 进度只保留最新值；连续的进度条文本行（“[###---] 45% …”，本地与 CLI 引擎的格式相同）在日志框中只保留最后一行，日志文件照常逐行记录。
+    # 待刷新的日志框行数超过 max_lines 时丢弃最早的行（它们本就会被环形缓冲删除）。
+    def __init__(self, max_lines: int = GUI_LOG_LINES, path: str | None = GUI_LOG_FILE, max_bytes: int = GUI_LOG_MAX_BYTES, backups: int = GUI_LOG_BACKUPS):
+        self.max_lines = max(1, int(max_lines))
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._lines = []
+        self._file_lines = []
+        self._last_progress_line = False
+        self._progress = None
+        self._file = None
+
+    def log(self, msg: str):
+        progress = _PROGRESS_LINE_LOCAL.match(msg) is not None
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            self._file_lines.append(f"{stamp} {msg}")
+            if progress and self._last_progress_line and self._lines:
+                self._lines[-1] = msg
+            else:
+                self._lines.append(msg)
+                if len(self._lines) > 2 * self.max_lines:
+                    del self._lines[:-self.max_lines]
+            self._last_progress_line = progress
+
+    def progress(self, done: int, total: int):
+        with self._lock:
+            self._progress = (done, total)
+
+    def take_progress(self):
+        with self._lock:
+            p, self._progress = self._progress, None
+        return p
+
+    def drain(self):
+        # 取走待刷新的日志框行（最多 max_lines 行），并把完整日志成批写入文件
+        with self._lock:
+            lines, self._lines = self._lines, []
+            file_lines, self._file_lines = self._file_lines, []
+            self._last_progress_line = False
+        if file_lines:
+            self.write_file(file_lines)
+        return lines[-self.max_lines:]
+
+    def write_file(self, lines):
+        if not self.path:
+            return
+        import logging
+        try:
+            if self._file is None:
+                from logging.handlers import RotatingFileHandler
+                self._file = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding="utf-8")
+                self._file.setFormatter(logging.Formatter("%(message)s"))
+            self._file.emit(logging.makeLogRecord({"msg": "\n".join(lines), "levelno": logging.INFO, "levelname": "INFO"}))
+        except Exception:
+            # 日志文件不可写（目录只读等）时只保留日志框
+            self.path = None
+
+    def close(self):
+        self.drain()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
 class MajorFilterGUI:
     def __init__(self, root):
         self.root = root
@@ -467,16 +1195,23 @@ class MajorFilterGUI:
         self.combine_mode = tk.StringVar(value="AND")
         self.combine_threshold = tk.StringVar(value="0.80")
         self.write_audit = tk.BooleanVar(value=False)
+        self.sheet_column = tk.BooleanVar(value=False)
+        self.export_metrics = tk.BooleanVar(value=False)
+        self.profile_memory = tk.BooleanVar(value=False)
+        self.engine = tk.StringVar(value="本地")
+        self.output_format = tk.StringVar(value=next(iter(GUI_OUTPUT_FORMATS)))
         self.conditions = []
-        self.log_queue = queue.Queue()
-        self.progress_queue = queue.Queue()
+        self.conditions_path = None
+        self.channel = LogChannelLocal()
         self.running = False
         self.total_count = 0
+        self._preload = preload_modules_local()
         self.setup_style()
         self.create_widgets()
         self.load_config()
-        self.root.after(100, self.consume_logs)
-        self.root.after(100, self.consume_progress)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(GUI_UI_TICK_MS, self.consume_logs)
+        self.root.after(GUI_UI_TICK_MS, self.consume_progress)
 
     def setup_style(self):
         try:
@@ -567,6 +1302,8 @@ class MajorFilterGUI:
         mode_cb.grid(row=0, column=1, padx=6)
         ttk.Label(mode_bar, text="总阈值(加权)").grid(row=0, column=2, sticky="w")
         ttk.Entry(mode_bar, textvariable=self.combine_threshold, width=10).grid(row=0, column=3, padx=6)
+        ttk.Label(mode_bar, text="执行引擎").grid(row=0, column=4, sticky="w")
+        ttk.Combobox(mode_bar, values=list(GUI_ENGINES), textvariable=self.engine, state="readonly", width=10).grid(row=0, column=5, padx=6)
         self.cond_view = ttk.Treeview(cond_frame, columns=("column","type","operator","value","threshold","priority","weight","options"), show="headings", height=8)
         for c in ("column","type","operator","value","threshold","priority","weight","options"):
             self.cond_view.heading(c, text=c)
@@ -614,6 +1351,8 @@ class MajorFilterGUI:
         ttk.Label(output, text="合并输出文件").grid(row=1, column=0, sticky="e", padx=4, pady=2)
         ttk.Entry(output, textvariable=self.merge_out).grid(row=1, column=1, sticky="ew", padx=4, pady=2)
         ttk.Checkbutton(output, text="仅合并输出（不写逐文件）", variable=self.only_merge).grid(row=2, column=0, sticky="w", padx=4, pady=2)
+        ttk.Label(output, text="输出格式").grid(row=3, column=0, sticky="e", padx=4, pady=2)
+        ttk.Combobox(output, values=list(GUI_OUTPUT_FORMATS), textvariable=self.output_format, state="readonly", width=16).grid(row=3, column=1, sticky="w", padx=4, pady=2)
         # 处理选项分区
         options = ttk.Labelframe(container, text="处理选项")
         options.grid(row=4, column=0, sticky="nsew", padx=4, pady=4)
@@ -623,6 +1362,9 @@ class MajorFilterGUI:
         ttk.Checkbutton(options, text="追加模式", variable=self.append_mode).grid(row=1, column=0, sticky="w", padx=4, pady=2)
         ttk.Checkbutton(options, text="开启去重", variable=self.dedup).grid(row=1, column=1, sticky="w", padx=4, pady=2)
         ttk.Checkbutton(options, text="写出审计列", variable=self.write_audit).grid(row=2, column=0, sticky="w", padx=4, pady=2)
+        ttk.Checkbutton(options, text="追加来源工作表列", variable=self.sheet_column).grid(row=2, column=1, sticky="w", padx=4, pady=2)
+        ttk.Checkbutton(options, text="导出运行指标（事件/Prometheus/trace）", variable=self.export_metrics).grid(row=3, column=0, sticky="w", padx=4, pady=2)
+        ttk.Checkbutton(options, text="内存剖析（较慢）", variable=self.profile_memory).grid(row=3, column=1, sticky="w", padx=4, pady=2)
         # 监听Tab变化
         def on_tab_changed(event):
             idx = tabs.index(tabs.select())
@@ -641,8 +1383,12 @@ class MajorFilterGUI:
         ttk.Button(left, text="软件使用须知", command=self.show_usage_notice).grid(row=0, column=2, padx=4)
         self.btn_start = ttk.Button(right, text="开始处理", command=self.start_processing)
         self.btn_start.grid(row=0, column=0, padx=4)
+        self.btn_preview = ttk.Button(right, text="抽样预览", command=self.start_preview)
+        self.btn_preview.grid(row=0, column=1, padx=4)
+        self.btn_resume = ttk.Button(right, text="继续上次", command=lambda: self.start_processing(resume=True))
+        self.btn_resume.grid(row=0, column=2, padx=4)
         self.btn_stop = ttk.Button(right, text="取消运行", command=self.stop_processing)
-        self.btn_stop.grid(row=0, column=1, padx=4)
+        self.btn_stop.grid(row=0, column=3, padx=4)
         self.btn_stop.configure(state="disabled")
         # 反馈分区
         feedback = ttk.Labelframe(container, text="进度与日志")
@@ -706,7 +1452,7 @@ class MajorFilterGUI:
             self._syncing = False
 
     def add_files(self):
-        paths = filedialog.askopenfilenames(title="选择Excel文件", filetypes=[("Excel", ".xlsx .xls .csv"), ("All files", "*.*")])
+        paths = filedialog.askopenfilenames(title="选择Excel文件", filetypes=[("Excel/CSV/Parquet", ".xlsx .xls .csv .gz .zst .xz .parquet"), ("All files", "*.*")])
         for p in paths:
             if p and p not in self.files:
                 self.files.append(p)
@@ -741,6 +1487,7 @@ class MajorFilterGUI:
                     messagebox.showerror("错误", f"条件文件缺少列: {c}")
                     return
             self.conditions = []
+            self.conditions_path = os.path.abspath(p)
             self.cond_view.delete(*self.cond_view.get_children())
             for _, r in df.fillna("").iterrows():
                 item = {k: str(r[k]).strip() for k in required}
@@ -801,13 +1548,10 @@ class MajorFilterGUI:
             self.out_dir.set(p)
 
     def log_cb(self, msg: str):
-        self.log_queue.put(msg)
+        self.channel.log(msg)
 
     def progress_cb(self, done: int, total: int):
-        try:
-            self.progress_queue.put((done, total))
-        except Exception:
-            pass
+        self.channel.progress(done, total)
 
     def _format_time(self, secs: float) -> str:
         secs = int(secs)
@@ -826,37 +1570,40 @@ class MajorFilterGUI:
         return f"[{bar}] {pct:02d}%"
 
     def consume_logs(self):
+        # 每个刷新周期一次性插入本批日志，再按 GUI_LOG_LINES 删除最早的行（环形缓冲）
         try:
-            while True:
-                msg = self.log_queue.get_nowait()
-                self.log.insert(tk.END, msg + "\n")
+            lines = self.channel.drain()
+            if lines:
+                self.log.insert(tk.END, "\n".join(lines) + "\n")
+                excess = int(self.log.index("end-1c").split(".")[0]) - 1 - GUI_LOG_LINES
+                if excess > 0:
+                    self.log.delete("1.0", f"{excess + 1}.0")
                 self.log.see(tk.END)
-                # 控制日志大小，保留最后50,000字符
-                try:
-                    content_len = len(self.log.get("1.0", "end-1c"))
-                except Exception:
-                    content_len = 0
-                if content_len > 50000:
-                    self.log.delete("1.0", "end-40000c")
-        except queue.Empty:
+        except Exception:
             pass
-        self.root.after(100, self.consume_logs)
+        self.root.after(GUI_UI_TICK_MS, self.consume_logs)
 
     def consume_progress(self):
+        p = self.channel.take_progress()
+        if p is not None:
+            done, total = p
+            if total <= 0:
+                self.progress["value"] = 0
+                self.progress["maximum"] = 1
+            else:
+                self.progress["maximum"] = total
+                self.progress["value"] = done
+        self.root.after(GUI_UI_TICK_MS, self.consume_progress)
+
+    def on_close(self):
+        # 关闭窗口前写出尚未刷新的日志
+        self.running = False
         try:
-            while True:
-                done, total = self.progress_queue.get_nowait()
-                if total <= 0:
-                    self.progress["value"] = 0
-                    self.progress["maximum"] = 1
-                else:
-                    self.progress["maximum"] = total
-                    self.progress["value"] = done
-        except queue.Empty:
-            pass
-        self.root.after(100, self.consume_progress)
+            self.channel.close()
+        finally:
+            self.root.destroy()
 
-    def start_processing(self):
+    def start_processing(self, resume=False):
         if not self.files:
             messagebox.showwarning("提示", "请添加至少一个Excel文件")
             return
@@ -868,23 +1615,90 @@ class MajorFilterGUI:
         if mode == "multi" and not self.conditions and not req:
             messagebox.showwarning("提示", "请导入条件CSV；如需回退到旧版，请同时指定require.txt")
             return
-        try:
-            import pandas as pd  # noqa
-        except Exception:
+        if not module_available("pandas") or not module_available("openpyxl"):
             messagebox.showerror("错误", "需要安装pandas与openpyxl:\n pip install pandas openpyxl")
             return
+        engine = GUI_ENGINES.get(self.engine.get(), "local")
+        if mode == "multi" and self.conditions and engine != "local":
+            if not module_available(engine):
+                messagebox.showerror("错误", f"需要安装{self.engine.get()}:\n pip install {engine}")
+                return
+            if load_cli_module() is None:
+                messagebox.showerror("错误", "未找到 filter_cli.py，无法使用该执行引擎")
+                return
         try:
             self.running = True
+            self.resume = bool(resume)
             self.btn_start.configure(state="disabled")
+            self.btn_preview.configure(state="disabled")
+            self.btn_resume.configure(state="disabled")
             self.btn_stop.configure(state="normal")
         except Exception:
             pass
         self.total_count = 0
         self.progress["value"] = 0
-        self.log_cb("开始处理")
+        self.log_cb("继续上次任务" if resume else "开始处理")
         t = threading.Thread(target=self.run_processing, daemon=True)
         t.start()
 
+    def start_preview(self):
+        # 抽样预览：按当前文件、工作表、条件与组合设置均匀抽样，估计命中数、各条件选择率与全量耗时（不写出结果）
+        if not self.files:
+            messagebox.showwarning("提示", "请添加至少一个Excel文件")
+            return
+        if self.active_mode.get().strip() != "multi" or not self.conditions:
+            messagebox.showwarning("提示", "抽样预览仅用于多条件筛选，请先导入条件CSV")
+            return
+        if not module_available("pandas") or load_cli_module() is None:
+            messagebox.showerror("错误", "抽样预览需要 pandas 与 filter_cli.py")
+            return
+        try:
+            self.running = True
+            self.btn_start.configure(state="disabled")
+            self.btn_preview.configure(state="disabled")
+            self.btn_resume.configure(state="disabled")
+            self.btn_stop.configure(state="normal")
+        except Exception:
+            pass
+        self.log_cb(f"抽样预览（{GUI_PREVIEW_ROWS} 行）")
+        t = threading.Thread(target=self.run_preview, daemon=True)
+        t.start()
+
+    def run_preview(self):
+        cli = load_cli_module()
+        memo = None
+        try:
+            import pandas as pd
+            try:
+                ct = self.combine_threshold.get().strip()
+                combine_threshold = float(ct[:-1]) / 100.0 if ct.endswith("%") else float(ct)
+            except Exception:
+                combine_threshold = 0.8
+            job = cli.default_job()
+            job.update({
+                "files": list(self.files), "sheet": self.sheet.get().strip(), "conditions": self.conditions_path,
+                "combine_mode": self.combine_mode.get().strip() or "AND", "combine_threshold": combine_threshold,
+                "write_audit": bool(self.write_audit.get()), "major_col": self.major_col.get().strip() or "Major",
+            })
+            memo = cli.open_similarity_memo(self.conditions_path) if (cli.SIM_MEMO and self.conditions_path and cli.needs_similarity_memo(self.conditions)) else None
+            cli.preview_job(pd, job, self.conditions, memo=memo, log=self.log_cb, should_stop=lambda: not self.running, n=GUI_PREVIEW_ROWS)
+        except Exception as e:
+            self.log_cb(f"抽样预览失败：{e}")
+        finally:
+            if memo is not None:
+                try:
+                    memo.close()
+                except Exception:
+                    pass
+            try:
+                self.running = False
+                self.root.after(0, lambda: self.btn_start.configure(state="normal"))
+                self.root.after(0, lambda: self.btn_preview.configure(state="normal"))
+                self.root.after(0, lambda: self.btn_resume.configure(state="normal"))
+                self.root.after(0, lambda: self.btn_stop.configure(state="disabled"))
+            except Exception:
+                pass
+
     def stop_processing(self):
         try:
             self.running = False
@@ -923,6 +1737,7 @@ class MajorFilterGUI:
             "   - limit：仅读取前N行用于调试或大文件处理（留空为不限制）。\n"
             "   - 输出目录：逐文件筛选结果的保存目录。\n"
             "   - 合并输出文件：批量处理后合并导出文件名（留空使用默认）。\n"
+            "   - 输出格式：逐文件与默认合并输出的格式（Excel、CSV、gzip/zstd/xz 压缩 CSV、Parquet）；合并输出文件名自带扩展名时以其为准。\n"
             "   - 去重键：指定唯一键进行去重（不填则按规范化Major+编码）。\n"
             "   - 追加模式：勾选后在已存在的输出文件上追加写入，可结合去重使用。\n"
             "   - 开启去重：对结果进行去重处理。\n"
@@ -1049,31 +1864,89 @@ class MajorFilterGUI:
                 combine_threshold = float(ct)
         except Exception:
             combine_threshold = 0.8
+        out_ext = GUI_OUTPUT_FORMATS.get(self.output_format.get(), "xlsx")
         outputs = []
-        merged_parts = []
+        buffers = OutputManagerLocal(col_major, append=append, dedup=dedup, dedup_key=dedup_key)
         total_count = 0
+        memo = None
+        ckpt = None
+        metrics = None
+        stopped = False
+        run_start = time.time()
         try:
             import pandas as pd
+            engine = GUI_ENGINES.get(self.engine.get(), "local")
+            if self.active_mode.get() == "multi" and self.conditions and engine != "local":
+                total_count = self.run_engine_job(pd, engine, sheet, out_dir, merge_out, append, dedup, dedup_key, col_major, combine_mode, combine_threshold, progress_step)
+                self.root.after(0, lambda: messagebox.showinfo("完成", f"处理完成，共筛选 {total_count} 条"))
+                return
+            conditions = self.conditions
+            if self.active_mode.get() == "multi" and self.conditions:
+                ckpt = self.open_checkpoint(sheet, out_dir, merge_out, col_major, combine_mode, combine_threshold, limit)
+                conditions = self.optimized_conditions(combine_mode)
+            if merge_out is None:
+                first_dir = os.path.dirname(self.files[0]) if self.files else os.getcwd()
+                merge_out = os.path.join(first_dir, f"merged_filtered.{out_ext}")
+            metrics = self.open_metrics(merge_out)
+            if metrics is not None:
+                buffers.memory = metrics.memory
+            emit = metrics.event if metrics is not None else (lambda ev: None)
+            rows_total = 0
             for pth in self.files:
-                base = os.path.splitext(os.path.basename(pth))[0]
-                out_path = None if bool(self.only_merge.get()) else (os.path.join(out_dir, f"{base}_filtered.xlsx") if out_dir else None)
+                if not self.running:
+                    stopped = True
+                    break
+                emit({"type": "file_start", "file": pth, "total": 0})
+                base = output_stem_local(pth)
+                out_path = None if bool(self.only_merge.get()) else os.path.join(out_dir or os.path.dirname(pth), f"{base}_filtered.{out_ext}")
                 mode = self.active_mode.get()
+                ck_key = os.path.abspath(pth)
+                if ckpt is not None and ckpt.done_output(ck_key)[0]:
+                    # 检查点中已完成：不重写逐文件结果，命中行读回参与合并
+                    parts = ckpt.load_parts(pd, ck_key)
+                    part = pd.concat(parts, ignore_index=True) if parts else None
+                    count = len(part) if part is not None else 0
+                    if part is not None:
+                        buffers.add(buffers.entry(pd, part))
+                    outputs.append(ckpt.done_output(ck_key)[1] or "(仅合并)")
+                    total_count += count
+                    self.log_cb(f"已完成（检查点）：{os.path.basename(pth)} 命中 {count} 条")
+                    continue
                 if mode == "multi":
-                    df = read_excel_merged_local(pd, pth, sheet, limit)
+                    with metrics_span_local(metrics, "read", pth):
+                        df = read_excel_merged_local(pd, pth, sheet, limit, GUI_SHEET_COLUMN if bool(self.sheet_column.get()) else None)
                     if not self.conditions:
                         self.log_cb("未配置条件，已回退到专业列筛选")
-                        saved, count = process_single(pth, req, col_major, threshold, out_path, sheet, progress_step, limit, append, dedup, dedup_key, progress_cb=self.progress_cb, log_cb=self.log_cb, progress_text_cb=lambda kind, *args: (self._render_progress(args[0], args[1]) if kind=="render" else self.log_cb(args[0])))
+                        saved, count = process_single(pth, req, col_major, threshold, out_path, sheet, progress_step, limit, append, dedup, dedup_key, progress_cb=self.progress_cb, log_cb=self.log_cb, progress_text_cb=lambda kind, *args: (self._render_progress(args[0], args[1]) if kind=="render" else self.log_cb(args[0])), outputs=None if bool(self.only_merge.get()) else buffers, metrics=metrics)
                     else:
                         total = len(df)
-                        hits = []
-                        scores = []
+                        # 继续时：已完成的行不再评估（记为未命中），其命中行从检查点读回
+                        start = ckpt.offset(ck_key, 0) if ckpt is not None else 0
+                        prior = ckpt.load_parts(pd, ck_key) if ckpt is not None else []
+                        hits = [False] * start
+                        scores = [0.0] * start
                         file_start = time.time()
-                        file_matched = 0
-                        for i in range(len(df)):
+                        file_matched = sum(len(x) for x in prior)
+                        last_ck = start
+                        def spill(lo, hi):
+                            seg = df.iloc[lo:hi].copy()
+                            seg["_match_all"] = hits[lo:hi]
+                            seg["_score_all"] = scores[lo:hi]
+                            ckpt.spill(ck_key, 0, hi, seg[seg["_match_all"] == True])
+                        if memo is None:
+                            memo = open_similarity_memo_local(self.conditions_path)
+                        seg_t, seg_lo = time.perf_counter(), start
+                        def segment(hi):
+                            # 每个进度步长记为一个评估区间与一条进度事件
+                            if metrics is not None and hi > seg_lo:
+                                metrics.add("evaluate", pth, seg_t, time.perf_counter() - seg_t, rows=hi - seg_lo)
+                                emit({"type": "progress", "file": pth, "rows": hi, "total": total, "matched": file_matched, "elapsed": round(time.time() - file_start, 3)})
+                            return time.perf_counter(), hi
+                        for i in range(start, len(df)):
                             if not self.running:
                                 break
                             row = {c: str(df.iloc[i][c]) if c in df.columns else "" for c in df.columns}
-                            hit, score_all, ds = evaluate_conditions_row_local(row, self.conditions, combine_mode, combine_threshold)
+                            hit, score_all, ds = evaluate_conditions_row_local(row, conditions, combine_mode, combine_threshold, memo)
                             hits.append(hit)
                             scores.append(round(score_all, 4))
                             if hit:
@@ -1091,68 +1964,194 @@ class MajorFilterGUI:
                                     df.at[i, col_score] = round(s, 4)
                                     df.at[i, col_desc] = desc
                             if progress_step and progress_step > 0 and (i + 1) % progress_step == 0:
+                                seg_t, seg_lo = segment(i + 1)
                                 self.progress_cb(i + 1, total)
                                 bar = self._render_progress(i + 1, total)
                                 self.log_cb(f"{bar} 已处理 {i+1}/{total} 行 | 已运行 {self._format_time(time.time()-file_start)} | 命中 {file_matched} 行")
+                            if ckpt is not None and i + 1 - last_ck >= GUI_CHECKPOINT_ROWS:
+                                spill(last_ck, i + 1)
+                                last_ck = i + 1
+                        segment(len(hits))
+                        if memo is not None:
+                            memo.flush()
+                        if ckpt is not None and len(hits) > last_ck:
+                            spill(last_ck, len(hits))
+                        if len(hits) < total:
+                            stopped = True
+                            if ckpt is not None:
+                                self.log_cb(f"已中止：已处理 {len(hits)}/{total} 行，进度已保存，点击“继续上次”从中断处继续")
+                            else:
+                                self.log_cb("已中止：当前文件结果未写出")
+                            break
                         df["_match_all"] = hits
                         df["_score_all"] = scores
                         out_df = df[df["_match_all"] == True].copy()
+                        if prior:
+                            out_df = pd.concat(prior + [out_df], ignore_index=True)
                         if bool(self.only_merge.get()):
                             # 仅合并输出：不写逐文件，直接入合并池（可先局部去重以降低内存）
-                            part = out_df
+                            part = buffers.entry(pd, out_df)
                             if dedup:
-                                part = dedup_dataframe(part, col_major, dedup_key)
-                            merged_parts.append(part)
-                            count = len(part)
+                                part = buffers.dedup_entries(pd, [part])[0]
+                            buffers.add(part)
+                            count = part["rows"]
                             saved = "(仅合并)"
                             self.log_cb(f"筛选完成：{os.path.basename(pth)} 命中 {count} 条（已加入合并）")
                         else:
                             if out_path is None or out_path == "":
-                                out_path = os.path.join(os.path.dirname(pth), f"{base}_filtered.xlsx")
-                            saved = write_output(out_df, out_path, append=append, dedup=dedup, dedup_key=dedup_key, col_major=col_major)
+                                out_path = os.path.join(os.path.dirname(pth), f"{base}_filtered.{out_ext}")
+                            # 检查点任务：写入暂存目录后两阶段提交，中断后继续不会重复追加
+                            staging = load_cli_module().output_staging_dir(out_path) if ckpt is not None else None
+                            with metrics_span_local(metrics, "write", pth, rows=len(out_df)):
+                                saved, written = buffers.write(pd, [buffers.entry(pd, out_df)], out_path, staging_dir=staging)
+                            if ckpt is not None:
+                                ckpt.publish(ck_key, staging, os.path.abspath(saved))
+                            for ent in written:
+                                buffers.add(ent)
                             count = len(out_df)
                             self.log_cb(f"筛选完成：{os.path.basename(pth)} 命中 {count} 条 → {saved}")
+                        if ckpt is not None and saved == "(仅合并)":
+                            ckpt.mark_done(ck_key, None)
                 else:
-                    saved, count = process_single(pth, req, col_major, threshold, out_path, sheet, progress_step, limit, append, dedup, dedup_key, progress_cb=self.progress_cb, log_cb=self.log_cb)
+                    saved, count = process_single(pth, req, col_major, threshold, out_path, sheet, progress_step, limit, append, dedup, dedup_key, progress_cb=self.progress_cb, log_cb=self.log_cb, outputs=None if bool(self.only_merge.get()) else buffers, metrics=metrics)
                 outputs.append(saved)
                 total_count += count
-                try:
-                    if not bool(self.only_merge.get()):
-                        if isinstance(saved, str) and (saved.lower().endswith(".xlsx") or saved.lower().endswith(".csv")):
-                            if saved.lower().endswith(".xlsx"):
-                                part = pd.read_excel(saved)
-                            else:
-                                part = pd.read_csv(saved)
-                            if dedup:
-                                part = dedup_dataframe(part, col_major, dedup_key)
-                            merged_parts.append(part)
-                except Exception:
-                    pass
-            if merged_parts:
-                all_df = pd.concat(merged_parts, ignore_index=True)
-                if dedup:
-                    all_df = dedup_dataframe(all_df, col_major, dedup_key)
-                if merge_out is None:
-                    first_dir = os.path.dirname(self.files[0]) if self.files else os.getcwd()
-                    merge_out = os.path.join(first_dir, "merged_filtered.xlsx")
-                saved = write_output(all_df, merge_out, append=append, dedup=dedup, dedup_key=dedup_key, col_major=col_major)
-                self.log_cb(f"总计筛选 {total_count} 条；合并后共 {len(all_df)} 条 → {saved}")
+                emit({"type": "file_done", "file": pth, "output": saved, "rows": count})
+                if metrics is not None:
+                    rows_total += metrics.file_summary(pth)["rows"]
+            if stopped:
+                emit({"type": "done", "outputs": outputs, "merged": None, "rows": rows_total, "matched": total_count, "seconds": round(time.time() - run_start, 3), "stopped": True})
+                return
+            merged_saved = None
+            merged_done = ckpt.done_output(load_cli_module().MERGED_KEY) if ckpt is not None else (False, None)
+            if buffers.parts and merged_done[0]:
+                merged_saved = merged_done[1]
+                self.log_cb(f"总计筛选 {total_count} 条；合并输出已完成（检查点）→ {merged_saved}")
+            elif buffers.parts:
+                staging = load_cli_module().output_staging_dir(merge_out) if ckpt is not None else None
+                with metrics_span_local(metrics, "write"):
+                    merged_saved, merged_rows = buffers.write_merged(pd, merge_out, staging_dir=staging)
+                if ckpt is not None:
+                    ckpt.publish(load_cli_module().MERGED_KEY, staging, os.path.abspath(merged_saved))
+                self.log_cb(f"总计筛选 {total_count} 条；合并后共 {merged_rows} 条 → {merged_saved}")
+                emit({"type": "merged", "output": merged_saved, "rows": merged_rows})
             else:
                 self.log_cb(f"总计筛选 {total_count} 条")
+            emit({"type": "done", "outputs": outputs, "merged": merged_saved, "rows": rows_total, "matched": total_count, "seconds": round(time.time() - run_start, 3), "stopped": False})
+            if ckpt is not None:
+                ckpt.clear()
             self.root.after(0, lambda: messagebox.showinfo("完成", f"处理完成，共筛选 {total_count} 条"))
         except Exception as e:
             import traceback
             err = f"{e}\n{traceback.format_exc()}"
             self.log_cb(f"错误：{err}")
+            if metrics is not None:
+                metrics.fail(e)
             self.root.after(0, lambda: messagebox.showerror("错误", str(e)))
         finally:
+            if metrics is not None:
+                metrics.close()
+                if metrics.prom_path:
+                    self.log_cb(f"运行指标已写出：{metrics.prom_path}")
+            if memo is not None:
+                try:
+                    memo.close()
+                except Exception:
+                    pass
+            buffers.close()
             try:
                 self.running = False
                 self.root.after(0, lambda: self.btn_start.configure(state="normal"))
+                self.root.after(0, lambda: self.btn_preview.configure(state="normal"))
+                self.root.after(0, lambda: self.btn_resume.configure(state="normal"))
                 self.root.after(0, lambda: self.btn_stop.configure(state="disabled"))
             except Exception:
                 pass
 
+    def run_engine_job(self, pd, engine, sheet, out_dir, merge_out, append, dedup, dedup_key, col_major, combine_mode, combine_threshold, progress_step):
+        # 以 CLI 脚本的执行引擎处理全部文件（一次任务）：逐文件写出到输出目录（未指定时为源目录），再合并写出
+        cli = load_cli_module()
+        if self.limit.get().strip():
+            self.log_cb("提示：该执行引擎不支持 limit，将处理全部行")
+        if bool(self.only_merge.get()):
+            self.log_cb("提示：该执行引擎同时写出逐文件结果")
+        job = cli.default_job()
+        job.update({
+            "files": list(self.files), "sheet": sheet or "", "conditions": self.conditions_path,
+            "combine_mode": combine_mode, "combine_threshold": combine_threshold, "out_dir": out_dir, "merge_out": merge_out,
+            "append": append, "dedup": dedup, "dedup_key": dedup_key, "progress_step": progress_step,
+            "write_audit": bool(self.write_audit.get()), "major_col": col_major, "engine": engine,
+            "sheet_column": GUI_SHEET_COLUMN if bool(self.sheet_column.get()) else None,
+            "resume": bool(getattr(self, "resume", False)),
+        })
+        if bool(self.export_metrics.get()):
+            job.update(metrics_paths_local(merge_out or os.path.join(os.path.dirname(self.files[0]), "merged_filtered.xlsx")), name="gui")
+        if bool(self.profile_memory.get()):
+            job.update(profile_memory=True, name="gui")
+        memo = cli.open_similarity_memo(self.conditions_path) if (cli.SIM_MEMO and self.conditions_path and cli.needs_similarity_memo(self.conditions)) else None
+        def on_event(ev):
+            if ev.get("type") == "progress":
+                self.progress_cb(ev["rows"], ev["total"])
+        try:
+            result = cli.run_filter_job(pd, job, self.conditions, memo=memo, log=self.log_cb, on_event=on_event, should_stop=lambda: not self.running)
+        finally:
+            if memo is not None:
+                memo.close()
+        return result["matched"]
+
+    def optimized_conditions(self, combine_mode):
+        # 逐行评估前的条件优化（复用 CLI 的 optimize_conditions，受 OPTIMIZE_CONDITIONS 控制）；写出审计列或找不到 CLI 时用原条件
+        cli = load_cli_module()
+        if cli is None or not cli.OPTIMIZE_CONDITIONS or bool(self.write_audit.get()):
+            return self.conditions
+        conditions, report = cli.optimize_conditions(self.conditions, combine_mode)
+        self.log_cb(cli.describe_condition_optimization(report))
+        return conditions
+
+    def open_metrics(self, merge_out):
+        # 本地处理的运行指标（复用 CLI 的 RunMetrics）：写在合并输出旁（GUI_METRICS_FILES）；
+        # 勾选“内存剖析”时附带 CLI 的 MemoryProfiler（报告为合并输出旁的 .memprofile.json），可不导出其余指标
+        export, profile = bool(self.export_metrics.get()), bool(self.profile_memory.get())
+        if not export and not profile:
+            return None
+        cli = load_cli_module()
+        if cli is None:
+            self.log_cb("提示：未找到 filter_cli.py，无法导出运行指标")
+            return None
+        paths = metrics_paths_local(merge_out) if export else dict.fromkeys(GUI_METRICS_FILES)
+        try:
+            memory = None
+            if profile:
+                memory = cli.MemoryProfiler(cli.memory_report_path({"merge_out": merge_out}), cli.TRACEMALLOC_TOP, cli.TRACEMALLOC_INTERVAL,
+                                            cli.MEMORY_SAMPLE_INTERVAL, log=self.log_cb)
+            return cli.RunMetrics("gui", paths["events_out"], paths["metrics_out"], paths["trace_out"], engine="local", memory=memory)
+        except OSError as e:
+            self.log_cb(f"运行指标不可用：{e}")
+            return None
+
+    def open_checkpoint(self, sheet, out_dir, merge_out, col_major, combine_mode, combine_threshold, limit):
+        # 多条件逐行评估的检查点（复用 CLI 的 JobCheckpoint）；签名中标记 GUI 评估方式，与 CLI 任务的检查点互不混用
+        cli = load_cli_module()
+        if cli is None:
+            if getattr(self, "resume", False):
+                self.log_cb("提示：未找到 filter_cli.py，无法使用检查点，将从头处理")
+            return None
+        job = cli.default_job()
+        job.update({
+            "files": list(self.files), "sheet": sheet or "", "conditions": self.conditions_path,
+            "combine_mode": combine_mode, "combine_threshold": combine_threshold, "out_dir": out_dir, "merge_out": merge_out,
+            "write_audit": bool(self.write_audit.get()), "major_col": col_major,
+            "sheet_column": GUI_SHEET_COLUMN if bool(self.sheet_column.get()) else None,
+            "resume": bool(getattr(self, "resume", False)),
+        })
+        try:
+            import hashlib
+            cond_digest = hashlib.sha1(json.dumps(self.conditions, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+            return cli.open_job_checkpoint(job, log=self.log_cb, extra={"gui": "row", "limit": limit, "only_merge": bool(self.only_merge.get()), "conditions": cond_digest})
+        except Exception as e:
+            self.log_cb(f"检查点不可用：{e}")
+            return None
+
     def save_config(self):
         cfg = {
             "files": self.files,
@@ -1167,7 +2166,12 @@ class MajorFilterGUI:
             "only_merge": bool(self.only_merge.get()),
             "append_mode": bool(self.append_mode.get()),
             "dedup": bool(self.dedup.get()),
-            "dedup_key": self.dedup_key.get()
+            "dedup_key": self.dedup_key.get(),
+            "sheet_column": bool(self.sheet_column.get()),
+            "export_metrics": bool(self.export_metrics.get()),
+            "profile_memory": bool(self.profile_memory.get()),
+            "engine": self.engine.get(),
+            "output_format": self.output_format.get()
         }
         try:
             with open("major_filter_gui.json", "w", encoding="utf-8") as f:
@@ -1203,10 +2207,20 @@ class MajorFilterGUI:
             self.append_mode.set(cfg.get("append_mode", False))
             self.dedup.set(cfg.get("dedup", False))
             self.dedup_key.set(cfg.get("dedup_key", ""))
+            self.sheet_column.set(bool(cfg.get("sheet_column", False)))
+            self.export_metrics.set(bool(cfg.get("export_metrics", False)))
+            self.profile_memory.set(bool(cfg.get("profile_memory", False)))
+            if cfg.get("engine") in GUI_ENGINES:
+                self.engine.set(cfg["engine"])
+            if cfg.get("output_format") in GUI_OUTPUT_FORMATS:
+                self.output_format.set(cfg["output_format"])
         except Exception:
             pass
 
 def main():
+    # 打包为可执行文件时，并行解析的子进程需要先经过 freeze_support
+    import multiprocessing
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = MajorFilterGUI(root)
     root.mainloop()